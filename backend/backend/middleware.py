@@ -0,0 +1,50 @@
+"""
+Response compression for large API payloads.
+"""
+from django.conf import settings
+from django.middleware.gzip import GZipMiddleware
+from django.utils.cache import patch_vary_headers
+from django.utils.regex_helper import _lazy_re_compile
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+re_accepts_brotli = _lazy_re_compile(r'\bbr\b')
+
+# Already compressed formats (images, PDFs, DOCX is a zip), compressing them again only costs CPU
+INCOMPRESSIBLE_TYPES = ('image/', 'video/', 'audio/', 'application/pdf', 'application/zip', 'application/vnd.openxmlformats')
+
+class CompressionMiddleware(GZipMiddleware):
+    """
+    GZipMiddleware that leaves responses under RESPONSE_COMPRESSION_MIN_BYTES alone and
+    prefers brotli when the client accepts it and the brotli package is installed.
+    Streaming responses are always gzipped, already compressed formats and byte ranges never.
+    """
+    def process_response(self, request, response):
+        # A byte range is part of the uncompressed file
+        if response.status_code == 206:
+            return response
+        if response.get('Content-Type', '').startswith(INCOMPRESSIBLE_TYPES):
+            return response
+        if not response.streaming and len(response.content) < settings.RESPONSE_COMPRESSION_MIN_BYTES:
+            return response
+
+        accepts_brotli = re_accepts_brotli.search(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        if brotli is None or response.streaming or not accepts_brotli or response.has_header('Content-Encoding'):
+            return super().process_response(request, response)
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+        compressed_content = brotli.compress(response.content, quality=settings.RESPONSE_BROTLI_QUALITY)
+        if len(compressed_content) >= len(response.content):
+            return response
+        response.content = compressed_content
+        response.headers['Content-Length'] = str(len(response.content))
+
+        # Like GZipMiddleware: a compressed representation only matches weakly
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response.headers['ETag'] = 'W/' + etag
+        response.headers['Content-Encoding'] = 'br'
+        return response
@@ -0,0 +1,55 @@
+"""
+JSON renderer for the API, using orjson when it is installed.
+
+orjson encodes datetimes, UUIDs, dataclasses and NumPy arrays / scalars in C, which
+matters for the long time series of the eye analytics views. Without orjson, or when
+indented output is requested (browsable API), DRF's JSONRenderer is used unchanged.
+"""
+import math
+from decimal import Decimal
+
+import numpy as np
+from rest_framework.utils.encoders import JSONEncoder
+from rest_framework.renderers import JSONRenderer
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    Drop-in JSONRenderer: the same JSON as DRF's. Datetimes are isoformat() with
+    microseconds and UTC as 'Z', types orjson does not know (timedelta, Decimal, lazy
+    strings, querysets, ...) are encoded by DRF's JSONEncoder, and with STRICT_JSON
+    (the default) NaN and infinity raise ValueError instead of being written as null.
+    """
+    options = (orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_UTC_Z | orjson.OPT_NON_STR_KEYS) if orjson else 0
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        # Without STRICT_JSON DRF writes NaN and Infinity literals, which orjson cannot
+        if orjson is None or not self.strict or self.get_indent(accepted_media_type, renderer_context or {}):
+            return super().render(data, accepted_media_type, renderer_context)
+        if data is None:
+            return b''
+
+        ret = orjson.dumps(data, default=JSONEncoder().default, option=self.options)
+        # orjson writes NaN and infinity as null, look for them only when there is a null
+        if b'null' in ret and has_non_finite(data):
+            raise ValueError("Out of range float values are not JSON compliant")
+        # Same as DRF: U+2028 and U+2029 are valid JSON but not valid JavaScript
+        return ret.replace('\u2028'.encode(), b'\\u2028').replace('\u2029'.encode(), b'\\u2029')
+
+def has_non_finite(data):
+    # NaN or infinity anywhere in the data, also Decimals DRF's encoder turns into floats
+    if isinstance(data, (float, np.floating)):
+        return not math.isfinite(data)
+    if isinstance(data, Decimal):
+        return not data.is_finite()
+    if isinstance(data, np.ndarray):
+        return data.dtype.kind in 'fc' and not np.isfinite(data).all()
+    if isinstance(data, dict):
+        return any(has_non_finite(value) for value in data.values())
+    if isinstance(data, (list, tuple)):
+        return any(has_non_finite(value) for value in data)
+    return False
@@ -16,6 +16,7 @@ from pickle import FALSE
 from dotenv import load_dotenv
 import os
 import dj_database_url
+from corsheaders.defaults import default_headers
 
 # Specify the path to the .env file
 BASE_DIR = Path(__file__).resolve().parent.parent  # Adjust as needed
@@ -57,6 +58,7 @@ ASGI_APPLICATION = 'backend.asgi.application'
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'backend.middleware.CompressionMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -145,6 +147,22 @@ STATIC_URL = 'static/'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Uploads are hashed while they arrive, documents are stored by content hash
+FILE_UPLOAD_HANDLERS = [
+    'user_management.storage.HashingUploadHandler',
+    'django.core.files.uploadhandler.MemoryFileUploadHandler',
+    'django.core.files.uploadhandler.TemporaryFileUploadHandler',
+]
+
+# Chunked document uploads (document-upload): largest document and read size while appending a chunk
+DOCUMENT_UPLOAD_MAX_BYTES = int(os.getenv('DOCUMENT_UPLOAD_MAX_BYTES', 200 * 1024 * 1024))
+DOCUMENT_UPLOAD_BLOCK_BYTES = int(os.getenv('DOCUMENT_UPLOAD_BLOCK_BYTES', 64 * 1024))
+DOCUMENT_UPLOAD_EXPIRY_HOURS = int(os.getenv('DOCUMENT_UPLOAD_EXPIRY_HOURS', 24))
+
+# Worker processes of `manage.py run_document_jobs` and how often a failing document job is tried
+DOCUMENT_JOB_WORKERS = int(os.getenv('DOCUMENT_JOB_WORKERS', 2))
+DOCUMENT_JOB_MAX_ATTEMPTS = int(os.getenv('DOCUMENT_JOB_MAX_ATTEMPTS', 3))
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 
@@ -157,8 +175,17 @@ REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.IsAuthenticated',
     ),
+    # orjson when installed, DRF's JSONRenderer otherwise (see backend/renderers.py)
+    'DEFAULT_RENDERER_CLASSES': (
+        'backend.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ),
 }
 
+# Responses from this size on are compressed, with brotli when it is installed and accepted, gzip otherwise
+RESPONSE_COMPRESSION_MIN_BYTES = int(os.getenv('RESPONSE_COMPRESSION_MIN_BYTES', 1024))
+RESPONSE_BROTLI_QUALITY = int(os.getenv('RESPONSE_BROTLI_QUALITY', 5))
+
 SIMPLE_JWT = {
     "ACCESS_TOKEN_LIFETIME": timedelta(minutes=30),
     "REFRESH_TOKEN_LIFETIME": timedelta(days=1)
@@ -174,8 +201,52 @@ CORS_ALLOW_CREDENTIALS = True
 CORS_EXPOSE_HEADERS = [
     "line-number",
     "page-number",
+    "etag",
+    "accept-ranges",
+    "content-range",
 ]
 
+# Conditional and byte-range requests for documents (DocumentLoadView)
+CORS_ALLOW_HEADERS = (
+    *default_headers,
+    "range",
+    "if-range",
+    "if-none-match",
+    "if-modified-since",
+    "upload-offset",
+)
+
+# Run the face mesh every N processed frames (1 = every frame), see tests/face_pose/keyframe_benchmark
+EYE_KEYFRAME_INTERVAL = int(os.getenv('EYE_KEYFRAME_INTERVAL', 5))
+
+# Seconds between flushes of the consumer's per-minute rollup (EyeMetricsMinute)
+EYE_ROLLUP_FLUSH_SECONDS = float(os.getenv('EYE_ROLLUP_FLUSH_SECONDS', 5))
+
+# Seconds of live per-second counters kept in the cache for break checks (see eye_processing/live.py)
+EYE_LIVE_WINDOW_SECONDS = int(os.getenv('EYE_LIVE_WINDOW_SECONDS', 600))
+
+# Seconds between live metrics pushed on the video socket (0 disables), and the rolling window they cover
+EYE_METRICS_PUSH_SECONDS = float(os.getenv('EYE_METRICS_PUSH_SECONDS', 2))
+EYE_METRICS_WINDOW_SECONDS = int(os.getenv('EYE_METRICS_WINDOW_SECONDS', 60))
+
+# Seconds a cached analytics response is kept, it is replaced earlier when the user's data version changes
+# (see eye_processing/response_cache.py). Break checks are reused within EYE_BREAK_CHECK_CACHE_SECONDS
+EYE_RESPONSE_CACHE_SECONDS = int(os.getenv('EYE_RESPONSE_CACHE_SECONDS', 300))
+EYE_BREAK_CHECK_CACHE_SECONDS = int(os.getenv('EYE_BREAK_CHECK_CACHE_SECONDS', 5))
+
+# In-process cache by default, set CACHE_BACKEND=django.core.cache.backends.redis.RedisCache and
+# CACHE_LOCATION=redis://... when running several server processes
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', ''),
+    }
+}
+
+# Monthly SimpleEyeMetrics partitions (PostgreSQL), maintained by `manage.py eyemetrics_partitions`
+EYE_METRICS_PARTITIONS_AHEAD = int(os.getenv('EYE_METRICS_PARTITIONS_AHEAD', 3))
+EYE_METRICS_RETENTION_MONTHS = int(os.getenv('EYE_METRICS_RETENTION_MONTHS', 0))  # 0 keeps every month
+
 # POSTGRES_LOCALLY = False
 if os.getenv('ENVIRONMENT') == 'production': # To setup the database in production
     DATABASES['default'] = dj_database_url.parse(os.getenv('DATABASE_URL'))
\ No newline at end of file
@@ -1,6 +1,7 @@
 from rest_framework_simplejwt.views import TokenObtainPairView
 from rest_framework.exceptions import ValidationError
 from eye_processing.models import UserSession
+from eye_processing.response_cache import bump_data_version
 from django.db.models import Max
 
 class LoginView(TokenObtainPairView):
@@ -17,6 +18,7 @@ class LoginView(TokenObtainPairView):
                 session_id = max_session_id + 1 #Increment sesson ID
             )
             new_session.save()
+            bump_data_version(serializer.user.id)  # The new session shows up in the reading times
             print(max_session_id + 1)
             # Call the parent method to generate and return the token
             response = super().post(request, *args, **kwargs)
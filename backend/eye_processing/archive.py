@@ -0,0 +1,108 @@
+"""
+Columnar archive of finished videos.
+
+Once a video's WebSocket disconnects its SimpleEyeMetrics rows no longer change, so they
+are packed into one VideoArchive row: every column becomes a NumPy array and the arrays
+are stored with np.savez_compressed. Analytics read a video through load_video_columns,
+which uses the archive when there is one and the per-frame rows otherwise.
+"""
+from datetime import timezone
+from io import BytesIO
+
+import numpy as np
+
+from .models import SimpleEyeMetrics, VideoArchive
+from .response_cache import bump_data_version
+
+# Archived columns with their array dtype and the value stored for NULL
+ARCHIVE_COLUMNS = {
+    'timestamp': ('datetime64[us]', None),
+    'gaze_x': (np.float32, np.nan),
+    'gaze_y': (np.float32, np.nan),
+    'face_detected': (np.bool_, False),
+    'normalised_eye_speed': (np.float64, np.nan),
+    'face_yaw': (np.float64, np.nan),
+    'face_roll': (np.float64, np.nan),
+    'face_pitch': (np.float64, np.nan),
+    'eye_aspect_ratio': (np.float64, np.nan),
+    'blink_detected': (np.int8, 0),
+    'left_centre_x': (np.float32, np.nan),
+    'left_centre_y': (np.float32, np.nan),
+    'right_centre_x': (np.float32, np.nan),
+    'right_centre_y': (np.float32, np.nan),
+    'focus': (np.bool_, False),
+    'left_iris_velocity': (np.float64, np.nan),
+    'right_iris_velocity': (np.float64, np.nan),
+    'movement_type': (np.int8, 0),
+    'reading_mode': (np.int8, 3),
+    'wpm': (np.int32, 0),
+}
+
+def to_column(name, values):
+    dtype, null = ARCHIVE_COLUMNS[name]
+    if name == 'timestamp':
+        # Naive UTC datetimes, NumPy has no time zones
+        return np.array([value.astimezone(timezone.utc).replace(tzinfo=None) for value in values], dtype=dtype)
+    return np.array([null if value is None else value for value in values], dtype=dtype)
+
+def pack_columns(columns):
+    buffer = BytesIO()
+    np.savez_compressed(buffer, **columns)
+    return buffer.getvalue()
+
+def unpack_columns(data, names=None):
+    with np.load(BytesIO(bytes(data))) as arrays:
+        return {name: arrays[name] for name in (names or arrays.files)}
+
+def blink_starts(blink_detected):
+    # Consecutive blink frames are one blink, True on the first frame of each blink
+    blinking = np.asarray(blink_detected) == 1
+    return blinking & ~np.concatenate([[False], blinking[:-1]])
+
+def count_blinks(blink_detected):
+    return int(np.count_nonzero(blink_starts(blink_detected)))
+
+def read_rows(user, session_id, video_id, names):
+    rows = SimpleEyeMetrics.objects.filter(
+        user=user, session_id=session_id, video_id=video_id
+    ).order_by('timestamp').values_list(*names)
+
+    values = list(zip(*rows)) or [()] * len(names)
+    return {name: to_column(name, column) for name, column in zip(names, values)}
+
+def archive_video(user, session_id, video_id):
+    """
+    Pack a video's rows into its VideoArchive (replacing an older archive of the same
+    video). `user` is a User or its id. Returns None when the video has no rows.
+    """
+    columns = read_rows(user, session_id, video_id, list(ARCHIVE_COLUMNS))
+    timestamps = columns['timestamp']
+    if len(timestamps) == 0:
+        return None
+
+    archive, _ = VideoArchive.objects.update_or_create(
+        user_id=getattr(user, 'pk', user), session_id=session_id, video_id=video_id,
+        defaults={
+            'frame_count': len(timestamps),
+            'started_at': timestamps[0].astype(object).replace(tzinfo=timezone.utc),
+            'ended_at': timestamps[-1].astype(object).replace(tzinfo=timezone.utc),
+            'focus_frames': int(np.count_nonzero(columns['focus'])),
+            'face_frames': int(np.count_nonzero(columns['face_detected'])),
+            'blinks': count_blinks(columns['blink_detected']),
+            'data': pack_columns(columns),
+        }
+    )
+    bump_data_version(archive.user_id)
+    return archive
+
+def load_archived_columns(user, session_id, video_id, names):
+    # Columns of one video from its archive, None when it has not been packed
+    archive = VideoArchive.objects.filter(user=user, session_id=session_id, video_id=video_id).only('data').first()
+    return unpack_columns(archive.data, names) if archive is not None else None
+
+def load_video_columns(user, session_id, video_id, names):
+    # Columns of one video ordered by timestamp, from its archive when it has been packed
+    columns = load_archived_columns(user, session_id, video_id, names)
+    if columns is not None:
+        return columns
+    return read_rows(user, session_id, video_id, names)
@@ -0,0 +1,59 @@
+"""
+Streaming export of a session's per-frame metrics as NDJSON or CSV.
+
+Rows are read with a server-side cursor (QuerySet.iterator) and written out chunk by
+chunk through a StreamingHttpResponse, so memory stays flat however long the session
+is. The stored video frames are not exported.
+"""
+import csv
+import json
+
+from .archive import ARCHIVE_COLUMNS
+from .models import SimpleEyeMetrics
+
+EXPORT_COLUMNS = ['session_id', 'video_id', *ARCHIVE_COLUMNS]
+EXPORT_FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+CHUNK_SIZE = 2000
+
+class Echo:
+    # File-like object for csv.writer that returns the line instead of buffering it
+    def write(self, value):
+        return value
+
+def export_rows(user, session_id, video_id=None, columns=EXPORT_COLUMNS):
+    # Rows of the session (or one of its videos) in recording order, as tuples of `columns`
+    frames = SimpleEyeMetrics.objects.filter(user=user, session_id=session_id)
+    if video_id is not None:
+        frames = frames.filter(video_id=video_id)
+    return frames.order_by('video_id', 'timestamp').values_list(*columns).iterator(chunk_size=CHUNK_SIZE)
+
+def _isoformat(rows, columns):
+    # Timestamps as ISO 8601 strings, the other values as stored
+    if 'timestamp' not in columns:
+        return rows
+    index = columns.index('timestamp')
+    return ((*row[:index], row[index].isoformat(), *row[index + 1:]) for row in rows)
+
+def _chunked(lines):
+    # Join the lines into chunks of CHUNK_SIZE, one write to the client per chunk
+    chunk = []
+    for line in lines:
+        chunk.append(line)
+        if len(chunk) == CHUNK_SIZE:
+            yield ''.join(chunk)
+            chunk = []
+    if chunk:
+        yield ''.join(chunk)
+
+def ndjson_lines(rows, columns):
+    # One JSON object per row
+    return _chunked(json.dumps(dict(zip(columns, row))) + '\n' for row in _isoformat(rows, columns))
+
+def csv_lines(rows, columns):
+    # Header line, then one line per row
+    writer = csv.writer(Echo())
+    yield writer.writerow(columns)
+    yield from _chunked(writer.writerow(row) for row in _isoformat(rows, columns))
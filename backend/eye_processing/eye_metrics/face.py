@@ -1,8 +1,75 @@
 import cv2
 import mediapipe as mp
 import numpy as np
-import time
-from scipy.spatial.transform import Rotation   
+
+# Nose tip, left eye corner, right eye corner and forehead
+POSE_LANDMARK_IDX = (1, 33, 263, 10)
+
+def compute_axes(nose_tip, left_eye, right_eye, forehead):
+    # Works on single points (3,) or stacked points (N, 3)
+
+    # Compute x-axis: from left eye to right eye (left to right)
+    x_axis = left_eye - right_eye
+    x_axis = x_axis / np.linalg.norm(x_axis, axis=-1, keepdims=True)
+
+    # Compute y-axis: from nose to forehead (down to up)
+    y_axis = forehead - nose_tip
+    y_axis = y_axis / np.linalg.norm(y_axis, axis=-1, keepdims=True)
+
+    # Compute z-axis: orthogonal to x and y (right-hand rule)
+    z_axis = np.cross(x_axis, y_axis)
+    z_axis = z_axis / np.linalg.norm(z_axis, axis=-1, keepdims=True)
+
+    return x_axis, y_axis, z_axis
+
+def axes_to_euler(x_axis, y_axis, z_axis):
+    """
+    Closed-form equivalent of Rotation.from_matrix(R).as_euler("zyx", degrees=True)
+    for R = [x_axis, y_axis, z_axis] as columns, followed by the roll remap.
+    Accepts single axes (3,) or stacked axes (N, 3).
+    """
+    # Rotation matrix (face to camera), m[..., row, col]
+    m = np.stack([x_axis, y_axis, z_axis], axis=-1)
+
+    # R is not exactly orthogonal (x and y come from independent landmarks), so
+    # project it onto a rotation the same way SciPy does: via the quaternion
+    # built from the largest of the diagonal entries and the trace
+    diag = np.diagonal(m, axis1=-2, axis2=-1)
+    trace = diag.sum(axis=-1)
+    choice = np.argmax(np.concatenate([diag, trace[..., None]], axis=-1), axis=-1)
+
+    quat = np.stack([m[..., 2, 1] - m[..., 1, 2],
+                     m[..., 0, 2] - m[..., 2, 0],
+                     m[..., 1, 0] - m[..., 0, 1],
+                     1 + trace], axis=-1)
+    for i in range(3):
+        j, k = (i + 1) % 3, (i + 2) % 3
+        selected = choice == i
+        if not np.any(selected):
+            continue
+        quat_i = np.empty_like(quat)
+        quat_i[..., i] = 1 - trace + 2 * m[..., i, i]
+        quat_i[..., j] = m[..., j, i] + m[..., i, j]
+        quat_i[..., k] = m[..., k, i] + m[..., i, k]
+        quat_i[..., 3] = m[..., k, j] - m[..., j, k]
+        quat = np.where(selected[..., None], quat_i, quat)
+    quat = quat / np.linalg.norm(quat, axis=-1, keepdims=True)
+    x, y, z, w = np.moveaxis(quat, -1, 0)
+
+    # Extrinsic zyx: R = Rx(pitch) @ Ry(yaw) @ Rz(roll)
+    r00 = 1 - 2 * (y * y + z * z)
+    r01 = 2 * (x * y - z * w)
+    r02 = 2 * (x * z + y * w)
+    r12 = 2 * (y * z - x * w)
+    r22 = 1 - 2 * (x * x + y * y)
+
+    roll = np.degrees(np.arctan2(-r01, r00))
+    yaw = np.degrees(np.arcsin(np.clip(r02, -1.0, 1.0)))
+    pitch = np.degrees(np.arctan2(-r12, r22))
+
+    roll = (-roll) % 360 - 180
+
+    return roll, yaw, pitch
 
 class FaceProcessor:
     def __init__(self):
@@ -15,8 +82,9 @@ class FaceProcessor:
         self.prev_eye_positions = None
         self.prev_time = None  
 
-    def process_face(self, frame, draw_mesh=False, draw_contours=False, show_axis=True, draw_eye=False):
-        frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+    def process_face(self, frame, timestamp_dt, draw_mesh=False, draw_contours=False, show_axis=True, draw_eye=False):
+        # BGR to RGB by reversing channels, this also materialises a mirrored view of the frame
+        frame_rgb = np.ascontiguousarray(frame[:, :, ::-1])
         results = self.face_mesh.process(frame_rgb)
 
         if not results.multi_face_landmarks:
@@ -34,8 +102,8 @@ class FaceProcessor:
         face_rect, face_detected = self.extract_main_face(face_landmarks, frame_width, frame_height)
         left_eye, right_eye = self.extract_eye_regions(face_landmarks)
 
-        # Compute normalised eye velocity in camera frame
-        _, normalised_eye_speed = self.compute_velocity(left_eye, right_eye, x_axis, y_axis, z_axis)
+        # Compute normalised eye velocity in camera frame, timed by the frame's capture timestamp
+        _, normalised_eye_speed = self.compute_velocity(left_eye, right_eye, x_axis, y_axis, z_axis, timestamp_dt)
 
         # Transform coordinates to pixel coordinates for plotting
         left_eye_pixels = self.convert_face_frame_to_pixels(left_eye, frame_width, frame_height)
@@ -44,6 +112,9 @@ class FaceProcessor:
         if not (draw_mesh or draw_contours or show_axis or draw_eye):
             return face_detected, left_eye_pixels, right_eye_pixels, normalised_eye_speed, yaw, pitch, roll, frame
 
+        # Drawing needs a writable contiguous image, only copy for diagnostics
+        frame = np.ascontiguousarray(frame)
+
         if draw_mesh or draw_contours:
             self._draw_face_mesh(frame, face_landmarks, draw_mesh, draw_contours)
 
@@ -57,54 +128,25 @@ class FaceProcessor:
     
     def compute_face_axes(self, face_landmarks):
         # Extract key landmark positions (normalised coordinates)
-        nose_tip = np.array([face_landmarks.landmark[1].x,
-                            face_landmarks.landmark[1].y,
-                            face_landmarks.landmark[1].z])
-
-        left_eye = np.array([face_landmarks.landmark[33].x, 
-                            face_landmarks.landmark[33].y, 
-                            face_landmarks.landmark[33].z])
-
-        right_eye = np.array([face_landmarks.landmark[263].x, 
-                            face_landmarks.landmark[263].y, 
-                            face_landmarks.landmark[263].z])
-
-        forehead = np.array([face_landmarks.landmark[10].x, 
-                            face_landmarks.landmark[10].y, 
-                            face_landmarks.landmark[10].z])
-
-        # Compute x-axis: from left eye to right eye (left to right)
-        x_axis = left_eye - right_eye
-        x_axis /= np.linalg.norm(x_axis)  
+        nose_tip, left_eye, right_eye, forehead = (
+            np.array([face_landmarks.landmark[i].x,
+                      face_landmarks.landmark[i].y,
+                      face_landmarks.landmark[i].z])
+            for i in POSE_LANDMARK_IDX
+        )
 
-        # Compute y-axis: from nose to forehead (down to up)
-        y_axis = forehead - nose_tip
-        y_axis /= np.linalg.norm(y_axis) 
+        x_axis, y_axis, z_axis = compute_axes(nose_tip, left_eye, right_eye, forehead)
+        roll, yaw, pitch = axes_to_euler(x_axis, y_axis, z_axis)
 
-        # Compute z-axis: orthogonal to x and y (right-hand rule)
-        z_axis = np.cross(x_axis, y_axis)
-        z_axis /= np.linalg.norm(z_axis) 
-
-        # Create rotation matrix (face to camera)
-        R_face_to_camera = np.vstack([x_axis, y_axis, z_axis]).T  # 3x3 rotation matrix
-
-        # Convert to Euler angles (yaw, pitch, roll)
-
-        # yaw = np.arctan2(-R_face_to_camera[2, 0], np.sqrt(R_face_to_camera[2, 1]**2 + R_face_to_camera[2, 2]**2))  # Rotation around Y-axis
-        # roll = np.arctan2(R_face_to_camera[1, 0], R_face_to_camera[0, 0])  # Rotation around Z-axis
-        # pitch = np.arctan2(R_face_to_camera[2, 1], R_face_to_camera[2, 2])  # Rotation around X-axis
+        return x_axis, y_axis, z_axis, yaw, pitch, roll
 
-        r =  Rotation.from_matrix(R_face_to_camera)
-        roll, yaw, pitch = r.as_euler("zyx",degrees=True)
-        roll = (-roll) % 360 - 180
-        
-        # print(f"nose_tip: {nose_tip}, left_eye: {left_eye}, right_eye: {right_eye}, forehead: {forehead}")
-        # print(f"x_axis: {x_axis}, y_axis: {y_axis}, z_axis: {z_axis}")
-        # print(f"R_face_to_camera: {R_face_to_camera}")
-        # print(np.linalg.det(R_face_to_camera))
-        # yaw, pitch, roll = np.degrees([yaw, pitch, roll]) 
+    def compute_face_axes_batch(self, landmarks):
+        # Vectorised head pose for offline reprocessing, landmarks has shape (frames, n_landmarks, 3)
+        landmarks = np.asarray(landmarks, dtype=np.float64)
+        nose_tip, left_eye, right_eye, forehead = (landmarks[:, i, :] for i in POSE_LANDMARK_IDX)
 
-        # print(f"x-axis: {pitch}, y-axis: {yaw}, z-axis: {roll}")
+        x_axis, y_axis, z_axis = compute_axes(nose_tip, left_eye, right_eye, forehead)
+        roll, yaw, pitch = axes_to_euler(x_axis, y_axis, z_axis)
 
         return x_axis, y_axis, z_axis, yaw, pitch, roll
 
@@ -144,15 +186,16 @@ class FaceProcessor:
         sorted_indices = np.argsort(angles)  # Sort by angle counterclockwise
         return eye_points[sorted_indices]
     
-    def compute_velocity(self, left_eye, right_eye, x_axis, y_axis, z_axis):
-        current_time = time.time()
+    def compute_velocity(self, left_eye, right_eye, x_axis, y_axis, z_axis, timestamp_dt):
+        current_time = timestamp_dt
         if self.prev_eye_positions is None or self.prev_time is None:
             self.prev_eye_positions = (left_eye, right_eye)
             self.prev_time = current_time
             return np.array([0.0, 0.0, 0.0]), 0.0
 
-        delta_t = current_time - self.prev_time
-        if delta_t == 0:
+        # Duplicate or out-of-order frames leave the previous frame untouched
+        delta_t = (current_time - self.prev_time).total_seconds()
+        if delta_t <= 0:
             return np.array([0.0, 0.0, 0.0]), 0.0
 
         # Compute velocity for each landmark and average
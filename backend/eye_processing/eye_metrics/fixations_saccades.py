@@ -1,62 +1,127 @@
+from datetime import timedelta
+
 import numpy as np
 
+NO_IRIS = np.full(2, np.nan)
+
+def classify_eye_movements(left_irises, right_irises, timestamps, frame_width, frame_height, fixation_threshold=0.02):
+    """
+    Batch I-VT over a whole video, e.g. for recomputing stored SimpleEyeMetrics rows.
+    Irises are (x, y) pixel centres or None, timestamps are datetimes (or seconds).
+    Gives the same velocities and movement types as feeding the frames one by one
+    to FixationSaccadeDetector.process_eye_movements, both use iris_velocities and
+    classify_velocities.
+    """
+    left_irises = as_points(left_irises)
+    right_irises = as_points(right_irises)
+    dt = timesteps(timestamps)
+
+    left_velocity = np.zeros(len(dt))
+    right_velocity = np.zeros(len(dt))
+    movement_type = np.full(len(dt), "fixation", dtype="<U8")
+
+    # Frames without a positive timestep default to fixation and do not update the previous irises
+    moving = np.flatnonzero(dt > 0)
+    if moving.size == 0:
+        return left_velocity, right_velocity, movement_type
+
+    prev_left = np.concatenate([NO_IRIS[None], left_irises[moving[:-1]]])
+    prev_right = np.concatenate([NO_IRIS[None], right_irises[moving[:-1]]])
+
+    left_velocity[moving], right_velocity[moving] = iris_velocities(
+        left_irises[moving], right_irises[moving], prev_left, prev_right, dt[moving],
+        _select(frame_width, moving), _select(frame_height, moving)
+    )
+    movement_type[moving] = classify_velocities(left_velocity[moving], right_velocity[moving], fixation_threshold)
+
+    return left_velocity, right_velocity, movement_type
+
+def iris_velocities(left_iris, right_iris, prev_left_iris, prev_right_iris, dt, frame_width, frame_height):
+    # Normalised iris speeds for (n, 2) arrays of centres or single (2,) centres (NaN where the iris was not found)
+    def speed(iris, prev_iris):
+        dx = (iris[..., 0] - prev_iris[..., 0]) / frame_width
+        dy = (iris[..., 1] - prev_iris[..., 1]) / frame_height
+        return np.sqrt(dx * dx + dy * dy) / dt
+
+    left_velocity = speed(left_iris, prev_left_iris)
+    right_velocity = speed(right_iris, prev_right_iris)
+
+    # When one eye is missing use the other one, when both are missing there is no movement
+    left_missing = np.isnan(left_velocity)
+    right_missing = np.isnan(right_velocity)
+    left_velocity = np.where(left_missing, np.where(right_missing, 0.0, right_velocity), left_velocity)
+    right_velocity = np.where(right_missing, left_velocity, right_velocity)
+
+    return left_velocity, right_velocity
+
+def classify_velocities(left_velocity, right_velocity, fixation_threshold):
+    # Compute the overall velocity by averaging left and right eye velocities
+    overall_velocity = (left_velocity + right_velocity) / 2
+    return np.where(overall_velocity < fixation_threshold, "fixation", "saccade")
+
+def as_points(irises):
+    # (n, 2) float array of iris centres, NaN rows for missing centres
+    if isinstance(irises, np.ndarray):
+        return irises.astype(np.float64).reshape(-1, 2)
+    return np.array([(np.nan, np.nan) if iris is None else iris for iris in irises], dtype=np.float64).reshape(-1, 2)
+
+def as_point(iris):
+    # (2,) float array of one iris centre, NaN when missing
+    return NO_IRIS if iris is None else np.array(iris, dtype=np.float64)
+
+def timesteps(timestamps):
+    # Seconds since the previous frame, 0 for the first frame and for non-increasing timestamps
+    if isinstance(timestamps, np.ndarray) and np.issubdtype(timestamps.dtype, np.datetime64):
+        microseconds = timestamps.astype("datetime64[us]").astype(np.int64)
+        dt = np.diff(microseconds) / 1e6
+    elif len(timestamps) and hasattr(timestamps[0], "tzinfo"):
+        dt = np.array([timestep(prev_time, time) for prev_time, time in zip(timestamps, timestamps[1:])], dtype=np.float64)
+    else:
+        dt = np.diff(np.asarray(timestamps, dtype=np.float64))
+
+    dt = np.concatenate([[0.0], dt])
+    dt[dt < 0] = 0
+    return dt
+
+def timestep(prev_time, time):
+    # Seconds between two datetimes in whole microseconds, like the datetime64 path of timesteps
+    return (time - prev_time) // timedelta(microseconds=1) / 1e6
+
+def _select(value, index):
+    return value[index] if isinstance(value, np.ndarray) else value
+
 class FixationSaccadeDetector:
+    """
+    I-VT for the live stream, one frame at a time through the same iris_velocities and
+    classify_velocities as classify_eye_movements.
+    """
     def __init__(self, fixation_threshold=0.02):
-        self.prev_left_iris = None
-        self.prev_right_iris = None
+        self.prev_left_iris = NO_IRIS
+        self.prev_right_iris = NO_IRIS
         self.prev_time = None
         self.fixation_threshold = fixation_threshold
 
     def process_eye_movements(self, left_iris, right_iris, frame_width, frame_height, timestamp_dt):
         dt = self._compute_timestep(timestamp_dt)
-        if dt == 0:
+        if dt <= 0:
             return 0, 0, "fixation"  # Default to fixation when no movement
-        
-        left_velocity, right_velocity = self._compute_velocity(left_iris, right_iris, frame_width, frame_height, dt)
-        
-        # Compute the overall velocity by averaging left and right eye velocities
-        overall_velocity = (left_velocity + right_velocity) / 2
 
-        # Classify as fixation or saccade
-        movement_type = "fixation" if overall_velocity < self.fixation_threshold else "saccade"
+        left_iris = as_point(left_iris)
+        right_iris = as_point(right_iris)
+        left_velocity, right_velocity = iris_velocities(left_iris, right_iris, self.prev_left_iris, self.prev_right_iris, dt, frame_width, frame_height)
+        movement_type = classify_velocities(left_velocity, right_velocity, self.fixation_threshold)
 
-        return left_velocity, right_velocity, movement_type
+        # Update previous values
+        self.prev_left_iris = left_iris
+        self.prev_right_iris = right_iris
+
+        return float(left_velocity), float(right_velocity), str(movement_type)
 
     def _compute_timestep(self, timestamp_dt):
         if self.prev_time is None:
             self.prev_time = timestamp_dt
             return 0  # No movement detected on first frame
 
-        dt = (timestamp_dt - self.prev_time).total_seconds()
+        dt = timestep(self.prev_time, timestamp_dt)
         self.prev_time = timestamp_dt  # Update for the next frame
-        return dt if dt > 0 else 0
-
-    def _compute_velocity(self, left_iris, right_iris, frame_width, frame_height, dt):
-        left_velocity = None
-        right_velocity = None
-
-        # Compute velocity in x and y directions separately, then normalize
-        if left_iris is not None and self.prev_left_iris is not None:
-            dx = (left_iris[0] - self.prev_left_iris[0]) / frame_width
-            dy = (left_iris[1] - self.prev_left_iris[1]) / frame_height
-            left_velocity = np.linalg.norm([dx, dy]) / dt  # Compute overall velocity
-
-        if right_iris is not None and self.prev_right_iris is not None:
-            dx = (right_iris[0] - self.prev_right_iris[0]) / frame_width
-            dy = (right_iris[1] - self.prev_right_iris[1]) / frame_height
-            right_velocity = np.linalg.norm([dx, dy]) / dt
-
-        # Update previous values
-        self.prev_left_iris = left_iris
-        self.prev_right_iris = right_iris
-
-        # Handle cases where one or both velocities are None
-        if left_velocity is None and right_velocity is not None:
-            left_velocity = right_velocity
-        elif right_velocity is None and left_velocity is not None:
-            right_velocity = left_velocity
-        elif left_velocity is None and right_velocity is None:
-            left_velocity = 0
-            right_velocity = 0
-
-        return left_velocity, right_velocity
\ No newline at end of file
+        return dt
@@ -36,21 +36,25 @@ class IrisProcessor:
         smooth_curve = np.array([np.round(x_smooth).astype(int), np.round(y_smooth).astype(int)]).T
 
         # Create a blank mask the same size as the frame
-        mask = np.zeros_like(self.frame[:, :, 0])  # Single-channel mask (grayscale)
+        mask = np.zeros(self.frame.shape[:2], dtype=np.uint8)  # Single-channel mask (grayscale)
 
         # Fill the smooth curve on the mask
         cv2.fillPoly(mask, [smooth_curve], 255)
 
-        # Apply the mask to the frame
-        masked_frame = cv2.bitwise_and(self.frame, self.frame, mask=mask)
-
         # Extract the bounding rectangle of the smooth curve
         x_min, y_min, w, h = cv2.boundingRect(smooth_curve)
 
-        # Crop the bounding rectangle and include only the masked region
-        cropped_eye = masked_frame[y_min:y_min + h, x_min:x_min + w]
+        # Crop the bounding rectangle first so only the eye region is copied and masked
+        # (the frame may be a mirrored view of the camera image)
+        cropped_frame = np.ascontiguousarray(self.frame[y_min:y_min + h, x_min:x_min + w])
         cropped_mask = mask[y_min:y_min + h, x_min:x_min + w]
 
+        if cropped_frame.size == 0:
+            return cropped_frame, cropped_mask
+
+        # Apply the mask and include only the masked region
+        cropped_eye = cv2.bitwise_and(cropped_frame, cropped_frame, mask=cropped_mask)
+
         return cropped_eye, cropped_mask
 
     def convert_to_greyscale(self, image):
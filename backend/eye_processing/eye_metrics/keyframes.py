@@ -0,0 +1,99 @@
+import cv2
+import numpy as np
+
+# Focus gate: above these the head is moving or turned away and iris detection is skipped
+MAX_EYE_SPEED = 0.25
+MAX_YAW = 25
+MAX_PITCH = 30
+
+def head_moving(normalised_eye_speed, yaw, pitch):
+    return normalised_eye_speed > MAX_EYE_SPEED or abs(yaw) > MAX_YAW or abs(pitch) > MAX_PITCH
+
+class KeyframeScheduler:
+    """
+    Decides when the full face mesh has to run. Head pose and eye regions change slowly
+    while reading, so between keyframes the last face mesh result is reused. A keyframe is
+    forced every `interval` frames, when the EAR moves away from the keyframe EAR or when
+    the pixels inside the eye regions change (head or eye region motion).
+
+    Reused frames carry the keyframe's normalised_eye_speed and yaw/pitch/roll, so these
+    are up to `interval` - 1 frames old. Only keyframes with the head still and facing the
+    screen are reused: after one failing the focus gate the next frame is a keyframe again,
+    and head movement after a keyframe changes the eye regions and forces a new one.
+    """
+    def __init__(self, interval=1, ear_threshold=0.05, roi_threshold=12.0, roi_padding=10, roi_changed_share=0.05):
+        self.interval = interval
+        self.ear_threshold = ear_threshold
+        self.roi_threshold = roi_threshold
+        self.roi_changed_share = roi_changed_share
+        self.roi_padding = roi_padding
+
+        self.face_result = None
+        self.keyframe_ear = None
+        self.keyframe_roi = None
+        self.roi_patch = None
+        self.frames_since_keyframe = 0
+
+    def needs_keyframe(self, frame, ear=None):
+        # Always run the face mesh when disabled or when there is nothing to reuse
+        if self.interval <= 1 or self.face_result is None or self.roi_patch is None:
+            return True
+
+        # A moving or turned head would keep failing the focus gate with stale values
+        if head_moving(*self.face_result[3:6]):
+            return True
+
+        if self.frames_since_keyframe + 1 >= self.interval:
+            return True
+
+        if ear is not None and self.keyframe_ear is not None and abs(ear - self.keyframe_ear) > self.ear_threshold:
+            return True
+
+        mean_change, changed_share = self.roi_motion(frame)
+        return mean_change > self.roi_threshold or changed_share > self.roi_changed_share
+
+    def record_keyframe(self, frame, ear, face_result):
+        self.face_result = face_result
+        self.keyframe_ear = ear
+        self.frames_since_keyframe = 0
+
+        face_detected, left_eye, right_eye = face_result[:3]
+        if face_detected == 0 or left_eye is None or right_eye is None:
+            # Keep running the face mesh until the face is found again
+            self.keyframe_roi, self.roi_patch = None, None
+            return
+
+        self.keyframe_roi = self.eye_roi(frame, left_eye, right_eye)
+        self.roi_patch = self.grey_patch(frame, self.keyframe_roi)
+
+    def reuse(self, frame):
+        # Face results of the last keyframe (speed and pose included), with the current frame as the output image
+        self.frames_since_keyframe += 1
+        return (*self.face_result[:-1], frame)
+
+    def roi_motion(self, frame):
+        """
+        Mean absolute grey level change inside the keyframe eye regions, and the share of
+        pixels changing by more than roi_threshold. The eyes are a small part of the padded
+        regions, so a head shift of a few pixels shows in the share long before the mean.
+        """
+        patch = self.grey_patch(frame, self.keyframe_roi)
+        if patch.shape != self.roi_patch.shape or patch.size == 0:
+            return np.inf, 1.0
+        change = cv2.absdiff(patch, self.roi_patch)
+        return float(np.mean(change)), np.count_nonzero(change > self.roi_threshold) / change.size
+
+    def eye_roi(self, frame, left_eye, right_eye):
+        # Bounding box of both eyes (pixel coordinates), padded and clipped to the frame
+        frame_height, frame_width = frame.shape[:2]
+        points = np.vstack([left_eye, right_eye])
+        x_min, y_min = np.min(points, axis=0) - self.roi_padding
+        x_max, y_max = np.max(points, axis=0) + self.roi_padding
+        return (max(int(x_min), 0), max(int(y_min), 0), min(int(x_max), frame_width), min(int(y_max), frame_height))
+
+    def grey_patch(self, frame, roi):
+        x_min, y_min, x_max, y_max = roi
+        patch = np.ascontiguousarray(frame[y_min:y_max, x_min:x_max])
+        if patch.size == 0:
+            return patch
+        return cv2.cvtColor(patch, cv2.COLOR_BGR2GRAY)
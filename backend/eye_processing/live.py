@@ -0,0 +1,136 @@
+"""
+Live per-second counters of a user's video stream, shared through the Django cache.
+
+The consumer counts stored frames and processed focus / face / blink results per second
+of capture time and publishes the last EYE_LIVE_WINDOW_SECONDS to the cache about once a
+second. Break checks on a live stream are then answered from the cache without
+querying SimpleEyeMetrics. With several server processes the cache has to be shared
+(e.g. Redis, see CACHES in settings). The same counters give the metrics the consumer
+pushes to the client on its socket (LiveCounters.metrics).
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .summaries import READING_MODES
+
+PUBLISH_INTERVAL = 1.0  # Seconds between cache writes
+STALE_AFTER = 5.0  # Seconds without a publish after which the stream is treated as gone
+
+def cache_key(user_id):
+    return f'eye-live:{user_id}'
+
+class LiveCounters:
+    """
+    Frames, focused frames, frames with a face and blinks per second of one video
+    stream, plus the running words read. Frames are counted when they are stored, focus,
+    face and blinks once the frame has been processed, like the per-minute rollup.
+    """
+    def __init__(self, user_id, session_id, video_id):
+        self.user_id = user_id
+        self.session_id = session_id
+        self.video_id = video_id
+        self.seconds = {}  # epoch second -> [frames, focus, face, blinks]
+        self.first_frame = None
+        self.latest_frame = None
+        self.last_result = None
+        self.published_at = 0.0
+        self.blink_in_progress = False
+        self.words_read = 0.0
+        self.last_reading_frame = None
+        self.pushed_metrics = {}
+
+    def _second(self, epoch_seconds):
+        return self.seconds.setdefault(int(epoch_seconds), [0, 0, 0, 0])
+
+    def add_frame(self, epoch_seconds, reading_mode=None, wpm=None):
+        self._second(epoch_seconds)[0] += 1
+        self.first_frame = min(self.first_frame or epoch_seconds, epoch_seconds)
+        self.latest_frame = max(self.latest_frame or epoch_seconds, epoch_seconds)
+
+        # Words read since the previous reading frame at this frame's speed, like summaries.words_read
+        if reading_mode in READING_MODES:
+            if self.last_reading_frame is not None and epoch_seconds > self.last_reading_frame:
+                self.words_read += (wpm or 0) * (epoch_seconds - self.last_reading_frame) / 60
+            self.last_reading_frame = max(self.last_reading_frame or epoch_seconds, epoch_seconds)
+
+    def add_result(self, epoch_seconds, focus, face_detected, blink_detected=False):
+        # The same middle frame can be picked for several incoming frames, only count it once
+        if self.last_result is not None and epoch_seconds <= self.last_result:
+            return
+        self.last_result = epoch_seconds
+
+        counts = self._second(epoch_seconds)
+        counts[1] += int(bool(focus))
+        counts[2] += int(bool(face_detected))
+
+        # Consecutive blink frames are one blink, counted in the second it starts
+        if blink_detected and not self.blink_in_progress:
+            counts[3] += 1
+        self.blink_in_progress = bool(blink_detected)
+
+    def metrics(self, window_seconds):
+        """
+        Blinks per minute, focus and face percentages over the last `window_seconds` of
+        capture time and the words read so far. Percentages are None without frames.
+        """
+        start = (self.latest_frame or 0) - window_seconds
+        frames, focus, face, blinks = _sum_counts(self.seconds, start, 4)
+        # A stream shorter than the window is rated over the time it covers
+        covered = min(window_seconds, max((self.latest_frame or 0) - (self.first_frame or 0), 1))
+        return {
+            'blink_rate': round(blinks * 60 / covered, 1),
+            'focus_percentage': round(focus / frames * 100, 1) if frames else None,
+            'face_detected_percentage': round(face / frames * 100, 1) if frames else None,
+            'words_read': round(self.words_read, 1),
+        }
+
+    def changed_metrics(self, window_seconds):
+        # The metrics that differ from the last call, so the client only gets deltas
+        changed = {name: value for name, value in self.metrics(window_seconds).items() if self.pushed_metrics.get(name, ...) != value}
+        self.pushed_metrics.update(changed)
+        return changed
+
+    def snapshot(self):
+        # Drop seconds that fell out of the window
+        oldest = int(self.latest_frame or 0) - settings.EYE_LIVE_WINDOW_SECONDS
+        self.seconds = {second: counts for second, counts in self.seconds.items() if second >= oldest}
+        return {
+            'session_id': self.session_id,
+            'video_id': self.video_id,
+            'latest_frame': self.latest_frame,
+            'published_at': time.time(),
+            'seconds': self.seconds,
+        }
+
+    async def publish(self, force=False):
+        if force or time.monotonic() - self.published_at >= PUBLISH_INTERVAL:
+            self.published_at = time.monotonic()
+            await cache.aset(cache_key(self.user_id), self.snapshot(), timeout=settings.EYE_LIVE_WINDOW_SECONDS)
+
+    async def clear(self):
+        await cache.adelete(cache_key(self.user_id))
+
+def window_counts(user_id, window_seconds, now_seconds=None):
+    """
+    Frames, focused frames and frames with a face of the user's live stream over the last
+    `window_seconds`, plus the capture time of the latest frame. None when there is no live
+    stream or it does not cover the window.
+    """
+    state = cache.get(cache_key(user_id))
+    now_seconds = time.time() if now_seconds is None else now_seconds
+    if state is None or now_seconds - state['published_at'] > STALE_AFTER or window_seconds > settings.EYE_LIVE_WINDOW_SECONDS:
+        return None
+
+    totals = _sum_counts(state['seconds'], now_seconds - window_seconds, 3)
+    return (*totals, state['latest_frame'])
+
+def _sum_counts(seconds, start, size):
+    # Totals of the first `size` counters of the seconds from `start` on
+    totals = [0] * size
+    for second, counts in seconds.items():
+        if second >= start:
+            for n, count in enumerate(counts[:size]):
+                totals[n] += count
+    return totals
@@ -0,0 +1,33 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db.models import Max
+from django.utils import timezone
+
+from eye_processing.archive import archive_video
+from eye_processing.models import SimpleEyeMetrics, VideoArchive
+
+class Command(BaseCommand):
+    help = "Pack the per-frame metrics of finished videos into columnar VideoArchive rows."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--idle-minutes', type=int, default=30, help="Treat a video as finished when its last frame is older than this")
+        parser.add_argument('--rebuild', action='store_true', help="Re-pack videos that already have an archive")
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(minutes=options['idle_minutes'])
+        videos = SimpleEyeMetrics.objects.values('user', 'session_id', 'video_id').annotate(last_frame=Max('timestamp')).filter(last_frame__lt=cutoff)
+
+        archived = set()
+        if not options['rebuild']:
+            archived = set(VideoArchive.objects.values_list('user', 'session_id', 'video_id'))
+
+        packed = 0
+        for video in videos.order_by('user', 'session_id', 'video_id'):
+            key = (video['user'], video['session_id'], video['video_id'])
+            if key in archived:
+                continue
+            if archive_video(*key) is not None:
+                packed += 1
+
+        self.stdout.write(self.style.SUCCESS(f"Archived {packed} video(s)"))
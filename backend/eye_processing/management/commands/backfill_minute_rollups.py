@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from eye_processing.models import EyeMetricsMinute, SimpleEyeMetrics
+from eye_processing.rollups import rebuild_minutes
+
+class Command(BaseCommand):
+    help = "Build the EyeMetricsMinute rollup for videos recorded before it existed."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rebuild', action='store_true', help="Recompute videos that already have rollup rows")
+
+    def handle(self, *args, **options):
+        videos = SimpleEyeMetrics.objects.values_list('user', 'session_id', 'video_id').distinct().order_by('user', 'session_id', 'video_id')
+
+        done = set()
+        if not options['rebuild']:
+            done = set(EyeMetricsMinute.objects.values_list('user', 'session_id', 'video_id').distinct())
+
+        rebuilt = 0
+        for video in videos:
+            if video in done:
+                continue
+            minutes = rebuild_minutes(*video)
+            rebuilt += 1
+            self.stdout.write(f"User {video[0]} session {video[1]} video {video[2]}: {minutes} minute(s)")
+
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt the rollup of {rebuilt} video(s)"))
@@ -0,0 +1,33 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db.models import Max
+from django.utils import timezone
+
+from eye_processing.models import SimpleEyeMetrics, VideoSummary
+from eye_processing.summaries import summarise_video
+
+class Command(BaseCommand):
+    help = "Write the VideoSummary of finished videos recorded before summaries existed."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--idle-minutes', type=int, default=30, help="Treat a video as finished when its last frame is older than this")
+        parser.add_argument('--rebuild', action='store_true', help="Recompute videos that already have a summary")
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(minutes=options['idle_minutes'])
+        videos = SimpleEyeMetrics.objects.values('user', 'session_id', 'video_id').annotate(last_frame=Max('timestamp')).filter(last_frame__lt=cutoff)
+
+        summarised = set()
+        if not options['rebuild']:
+            summarised = set(VideoSummary.objects.values_list('user', 'session_id', 'video_id'))
+
+        written = 0
+        for video in videos.order_by('user', 'session_id', 'video_id'):
+            key = (video['user'], video['session_id'], video['video_id'])
+            if key in summarised:
+                continue
+            if summarise_video(*key) is not None:
+                written += 1
+
+        self.stdout.write(self.style.SUCCESS(f"Summarised {written} video(s)"))
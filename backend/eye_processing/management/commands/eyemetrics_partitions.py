@@ -0,0 +1,31 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+
+from eye_processing import partitions
+
+class Command(BaseCommand):
+    help = "Create upcoming monthly SimpleEyeMetrics partitions and drop (or detach) expired ones. Run it daily, e.g. from cron."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ahead', type=int, default=settings.EYE_METRICS_PARTITIONS_AHEAD, help="Months to create ahead of the current one")
+        parser.add_argument('--retention-months', type=int, default=settings.EYE_METRICS_RETENTION_MONTHS, help="Drop partitions older than this many months (0 keeps everything)")
+        parser.add_argument('--detach-only', action='store_true', help="Detach expired partitions instead of dropping them, e.g. to archive them first")
+
+    def handle(self, *args, **options):
+        if not partitions.is_partitioned(connection):
+            self.stdout.write("SimpleEyeMetrics is not partitioned (PostgreSQL only), nothing to do.")
+            return
+
+        with transaction.atomic():
+            created, removed = partitions.manage_partitions(
+                connection, timezone.now().date(), ahead=options['ahead'],
+                retention_months=options['retention_months'], detach_only=options['detach_only']
+            )
+
+        for month in created:
+            self.stdout.write(f"Created {partitions.partition_name(month)}")
+        for month in removed:
+            self.stdout.write(f"{'Detached' if options['detach_only'] else 'Dropped'} {partitions.partition_name(month)}")
+        self.stdout.write(self.style.SUCCESS(f"{len(created)} partition(s) created, {len(removed)} removed"))
@@ -0,0 +1,27 @@
+# Generated by Django 5.1.2 on 2026-10-19 07:35
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('eye_processing', '0022_simpleeyemetrics_frame_simpleeyemetrics_reading_mode'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='simpleeyemetrics',
+            index=models.Index(fields=['user', 'session_id', 'video_id', 'timestamp'], name='eyemetrics_user_video_ts_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='simpleeyemetrics',
+            index=models.Index(condition=models.Q(('focus', True)), fields=['user', 'session_id', 'video_id', 'timestamp'], name='eyemetrics_focus_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='simpleeyemetrics',
+            index=models.Index(condition=models.Q(('blink_detected', 1)), fields=['user', 'session_id', 'video_id', 'timestamp'], name='eyemetrics_blink_idx'),
+        ),
+    ]
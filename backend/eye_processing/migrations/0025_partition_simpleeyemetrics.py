@@ -0,0 +1,159 @@
+"""
+Partition SimpleEyeMetrics by month on timestamp (PostgreSQL only, other databases
+keep the plain table).
+
+The table is rebuilt as a range partitioned table with a default partition and one
+partition per month that has data, plus the next few months. The primary key becomes
+(id, timestamp) because PostgreSQL requires the partition key in unique constraints,
+ids still come from a single identity sequence so they stay unique. Django's view of
+the model does not change. New partitions and retention are handled by the
+eyemetrics_partitions management command, see eye_processing/partitions.py.
+
+The partition helpers are copies of those in eye_processing/partitions.py as of this
+migration, so later changes to that module do not change what this migration does.
+"""
+from datetime import date
+
+from django.db import migrations
+from django.utils import timezone
+
+TABLE = 'eye_processing_simpleeyemetrics'
+DEFAULT_PARTITION = f'{TABLE}_default'
+OLD_TABLE = f'{TABLE}_unpartitioned'
+PARTITIONS_AHEAD = 3
+
+def _month_start(day):
+    return date(day.year, day.month, 1)
+
+def _add_months(month, months):
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+def _is_partitioned(connection):
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(%s))", [TABLE])
+        return cursor.fetchone()[0]
+
+def _create_default_partition(connection):
+    quote = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        cursor.execute(f"CREATE TABLE IF NOT EXISTS {quote(DEFAULT_PARTITION)} PARTITION OF {quote(TABLE)} DEFAULT")
+    _rename_partition_indexes(connection, DEFAULT_PARTITION, 'default')
+
+def _create_partition(connection, month):
+    # The table is still empty, no rows to move out of the default partition
+    quote = connection.ops.quote_name
+    name = f'{TABLE}_p{month:%Y_%m}'
+    lower, upper = f'{month.isoformat()} 00:00:00+00', f'{_add_months(month, 1).isoformat()} 00:00:00+00'
+
+    with connection.cursor() as cursor:
+        cursor.execute(f"CREATE TABLE {quote(name)} (LIKE {quote(TABLE)} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)")
+        cursor.execute(f"ALTER TABLE {quote(TABLE)} ATTACH PARTITION {quote(name)} FOR VALUES FROM (%s) TO (%s)", [lower, upper])
+    _rename_partition_indexes(connection, name, f'p{month:%Y_%m}')
+
+def _rename_partition_indexes(connection, partition, suffix):
+    # Name the indexes of a partition after the parent indexes
+    quote = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        cursor.execute("""
+            SELECT parent_index.relname, child_index.relname FROM pg_inherits
+            JOIN pg_class parent_index ON parent_index.oid = pg_inherits.inhparent
+            JOIN pg_class child_index ON child_index.oid = pg_inherits.inhrelid
+            JOIN pg_index ON pg_index.indexrelid = child_index.oid
+            WHERE pg_index.indrelid = %s::regclass
+        """, [partition])
+        for parent_index, child_index in cursor.fetchall():
+            new_name = f'{parent_index[:62 - len(suffix)]}_{suffix}'
+            if child_index != new_name:
+                cursor.execute(f"ALTER INDEX {quote(child_index)} RENAME TO {quote(new_name)}")
+
+def _strip_table(cursor, table):
+    # Free the index names and the id sequence so the new table can reuse them
+    cursor.execute("SELECT conname FROM pg_constraint WHERE conrelid = %s::regclass AND contype = 'p'", [table])
+    for (name,) in cursor.fetchall():
+        cursor.execute(f'ALTER TABLE "{table}" DROP CONSTRAINT "{name}"')
+    cursor.execute("""
+        SELECT index_class.relname FROM pg_index
+        JOIN pg_class index_class ON index_class.oid = pg_index.indexrelid
+        JOIN pg_class table_class ON table_class.oid = pg_index.indrelid
+        WHERE table_class.relname = %s AND NOT EXISTS (SELECT 1 FROM pg_inherits WHERE inhrelid = index_class.oid)
+    """, [table])
+    for (name,) in cursor.fetchall():
+        cursor.execute(f'DROP INDEX IF EXISTS "{name}"')
+
+    cursor.execute("SELECT pg_get_serial_sequence(%s, 'id')", [table])
+    sequence = cursor.fetchone()[0]
+    cursor.execute(f'ALTER TABLE "{table}" ALTER COLUMN id DROP IDENTITY IF EXISTS')
+    cursor.execute(f'ALTER TABLE "{table}" ALTER COLUMN id DROP DEFAULT')
+    if sequence:
+        cursor.execute(f'DROP SEQUENCE IF EXISTS {sequence}')
+
+def _reset_sequence(cursor):
+    cursor.execute(f"SELECT setval(pg_get_serial_sequence('{TABLE}', 'id'), COALESCE(MAX(id), 0) + 1, false) FROM \"{TABLE}\"")
+
+def partition_table(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor != 'postgresql' or _is_partitioned(connection):
+        return
+
+    SimpleEyeMetrics = apps.get_model('eye_processing', 'SimpleEyeMetrics')
+    with connection.cursor() as cursor:
+        cursor.execute(f'ALTER TABLE "{TABLE}" RENAME TO "{OLD_TABLE}"')
+        _strip_table(cursor, OLD_TABLE)
+
+        cursor.execute(f'CREATE TABLE "{TABLE}" (LIKE "{OLD_TABLE}" INCLUDING DEFAULTS) PARTITION BY RANGE ("timestamp")')
+        cursor.execute(f'ALTER TABLE "{TABLE}" ALTER COLUMN id ADD GENERATED BY DEFAULT AS IDENTITY')
+        cursor.execute(f'ALTER TABLE "{TABLE}" ADD CONSTRAINT "{TABLE}_pkey" PRIMARY KEY (id, "timestamp")')
+        cursor.execute(f"""
+            ALTER TABLE "{TABLE}" ADD CONSTRAINT "{TABLE}_user_id_fk_auth_user_id"
+            FOREIGN KEY (user_id) REFERENCES auth_user (id) DEFERRABLE INITIALLY DEFERRED
+        """)
+        cursor.execute(f'CREATE INDEX "{TABLE}_user_id_idx" ON "{TABLE}" (user_id)')
+    for index in SimpleEyeMetrics._meta.indexes:
+        schema_editor.add_index(SimpleEyeMetrics, index)
+
+    # One partition per month with data, the current month and the next few
+    with connection.cursor() as cursor:
+        cursor.execute(f'SELECT MIN("timestamp"), MAX("timestamp") FROM "{OLD_TABLE}"')
+        first, last = cursor.fetchone()
+    today = timezone.now().date()
+    month = _month_start(min(first.date(), today) if first else today)
+    last_month = _add_months(_month_start(max(last.date(), today) if last else today), PARTITIONS_AHEAD)
+
+    _create_default_partition(connection)
+    while month <= last_month:
+        _create_partition(connection, month)
+        month = _add_months(month, 1)
+
+    with connection.cursor() as cursor:
+        cursor.execute(f'INSERT INTO "{TABLE}" SELECT * FROM "{OLD_TABLE}"')
+        _reset_sequence(cursor)
+        cursor.execute(f'DROP TABLE "{OLD_TABLE}"')
+
+def unpartition_table(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor != 'postgresql' or not _is_partitioned(connection):
+        return
+
+    SimpleEyeMetrics = apps.get_model('eye_processing', 'SimpleEyeMetrics')
+    columns = ', '.join(connection.ops.quote_name(field.column) for field in SimpleEyeMetrics._meta.local_concrete_fields)
+    with connection.cursor() as cursor:
+        cursor.execute(f'ALTER TABLE "{TABLE}" RENAME TO "{OLD_TABLE}"')
+        _strip_table(cursor, OLD_TABLE)
+
+    schema_editor.create_model(SimpleEyeMetrics)
+    with connection.cursor() as cursor:
+        cursor.execute(f'INSERT INTO "{TABLE}" ({columns}) SELECT {columns} FROM "{OLD_TABLE}"')
+        _reset_sequence(cursor)
+        cursor.execute(f'DROP TABLE "{OLD_TABLE}" CASCADE')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('eye_processing', '0024_compact_simpleeyemetrics'),
+    ]
+
+    operations = [
+        migrations.RunPython(partition_table, unpartition_table),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.1.2 on 2026-10-19 07:46
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('eye_processing', '0026_videoarchive'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EyeMetricsMinute',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('session_id', models.IntegerField(default=0)),
+                ('video_id', models.IntegerField(default=0)),
+                ('minute', models.DateTimeField()),
+                ('frames', models.IntegerField(default=0)),
+                ('focus_frames', models.IntegerField(default=0)),
+                ('face_frames', models.IntegerField(default=0)),
+                ('blinks', models.IntegerField(default=0)),
+                ('wpm_sum', models.BigIntegerField(default=0)),
+                ('first_timestamp', models.DateTimeField()),
+                ('last_timestamp', models.DateTimeField()),
+                ('user', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('user', 'session_id', 'video_id', 'minute'), name='eyemetricsminute_uniq')],
+            },
+        ),
+    ]
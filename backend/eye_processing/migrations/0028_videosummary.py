@@ -0,0 +1,42 @@
+# Generated by Django 5.1.2 on 2026-10-19 07:49
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('eye_processing', '0027_eyemetricsminute'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VideoSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('session_id', models.IntegerField(default=0)),
+                ('video_id', models.IntegerField(default=0)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('ended_at', models.DateTimeField(blank=True, null=True)),
+                ('frames', models.IntegerField(default=0)),
+                ('reading_time', models.DurationField()),
+                ('focus_time', models.DurationField()),
+                ('blinks', models.IntegerField(default=0)),
+                ('average_wpm', models.FloatField(blank=True, null=True)),
+                ('total_words_read', models.FloatField(default=0)),
+                ('fixations', models.IntegerField(default=0)),
+                ('saccades', models.IntegerField(default=0)),
+                ('mean_yaw', models.FloatField(blank=True, null=True)),
+                ('mean_pitch', models.FloatField(blank=True, null=True)),
+                ('mean_roll', models.FloatField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('user', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('user', 'session_id', 'video_id'), name='videosummary_user_video_uniq')],
+            },
+        ),
+    ]
@@ -1,6 +1,17 @@
 from django.db import models
+from django.db.models import Q
 from django.contrib.auth.models import User
 
+class RealField(models.FloatField):
+    # Single precision float (float4), plenty for pixel coordinates
+    def db_type(self, connection):
+        return 'real'
+
+class MovementType(models.IntegerChoices):
+    NONE = 0, 'None'
+    FIXATION = 1, 'fixation'
+    SACCADE = 2, 'saccade'
+
 class UserSession(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, null=True)  # Track the logged-in user
     session_id = models.IntegerField(default=0)  # Track login session
@@ -10,12 +21,14 @@ class UserSession(models.Model):
 
 
 class SimpleEyeMetrics(models.Model):
+    # Written ~30 times a second per user, so columns are typed and kept narrow (see migration 0024)
+    # On PostgreSQL the table is partitioned by month on timestamp (see partitions.py)
     user = models.ForeignKey(User, on_delete=models.CASCADE, null=True)  # Track the logged-in user
     session_id = models.IntegerField(default=0)  # Track login session
     video_id = models.IntegerField(default=0)  # Track video session
     timestamp = models.DateTimeField()  # Store the timestamp for each frame
-    gaze_x = models.JSONField(null=True, blank=True)
-    gaze_y = models.JSONField(null=True, blank=True)
+    gaze_x = RealField(null=True, blank=True)
+    gaze_y = RealField(null=True, blank=True)
     face_detected = models.BooleanField(default=False)
     normalised_eye_speed = models.FloatField(null=True, blank=True)
     face_yaw = models.FloatField(null=True, blank=True) 
@@ -23,15 +36,99 @@ class SimpleEyeMetrics(models.Model):
     face_pitch = models.FloatField(null=True, blank=True) 
     eye_aspect_ratio = models.FloatField(null=True, blank=True)  # Store the eye aspect ratio
     blink_detected = models.IntegerField(null=True, blank=True)  # Store the blink count
-    left_centre = models.JSONField(null=True, blank=True)
-    right_centre = models.JSONField(null=True, blank=True)
+    left_centre_x = models.SmallIntegerField(null=True, blank=True)
+    left_centre_y = models.SmallIntegerField(null=True, blank=True)
+    right_centre_x = models.SmallIntegerField(null=True, blank=True)
+    right_centre_y = models.SmallIntegerField(null=True, blank=True)
     focus = models.BooleanField(default=False)
     left_iris_velocity=models.FloatField(null=True, blank=True)
     right_iris_velocity=models.FloatField(null=True, blank=True)
-    movement_type=models.CharField(max_length=10, default="fixation")
+    movement_type=models.SmallIntegerField(choices=MovementType.choices, default=MovementType.FIXATION)
     frame=models.TextField(null=True, blank=True)
     reading_mode=models.IntegerField(default=3)
     wpm=models.IntegerField(default=0)
 
+    class Meta:
+        # Every analytics query filters on (user, session_id, video_id) and a timestamp range or ordering
+        indexes = [
+            models.Index(fields=['user', 'session_id', 'video_id', 'timestamp'], name='eyemetrics_user_video_ts_idx'),
+            models.Index(fields=['user', 'session_id', 'video_id', 'timestamp'], condition=Q(focus=True), name='eyemetrics_focus_idx'),
+            models.Index(fields=['user', 'session_id', 'video_id', 'timestamp'], condition=Q(blink_detected=1), name='eyemetrics_blink_idx'),
+        ]
+
+    def __str__(self):
+        return f"User: {self.user.username} - Session: {self.session_id} - Video: {self.video_id} - Timestamp: {self.timestamp}"
+
+class VideoArchive(models.Model):
+    # Per-frame metrics of a finished video packed into compressed NumPy columns (see archive.py)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, null=True)
+    session_id = models.IntegerField(default=0)
+    video_id = models.IntegerField(default=0)
+    frame_count = models.IntegerField(default=0)
+    started_at = models.DateTimeField(null=True, blank=True)
+    ended_at = models.DateTimeField(null=True, blank=True)
+    focus_frames = models.IntegerField(default=0)
+    face_frames = models.IntegerField(default=0)
+    blinks = models.IntegerField(default=0)
+    data = models.BinaryField()
+    archived_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'session_id', 'video_id'], name='videoarchive_user_video_uniq'),
+        ]
+
+    def __str__(self):
+        return f"User: {self.user.username} - Session: {self.session_id} - Video: {self.video_id} - Frames: {self.frame_count}"
+
+
+class EyeMetricsMinute(models.Model):
+    # Per-minute counters of a video, maintained by the consumer at ingest time (see rollups.py)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, null=True)
+    session_id = models.IntegerField(default=0)
+    video_id = models.IntegerField(default=0)
+    minute = models.DateTimeField()  # Start of the minute (UTC)
+    frames = models.IntegerField(default=0)
+    focus_frames = models.IntegerField(default=0)
+    face_frames = models.IntegerField(default=0)
+    blinks = models.IntegerField(default=0)  # Blinks starting in this minute
+    wpm_sum = models.BigIntegerField(default=0)
+    first_timestamp = models.DateTimeField()
+    last_timestamp = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'session_id', 'video_id', 'minute'], name='eyemetricsminute_uniq'),
+        ]
+
+    def __str__(self):
+        return f"User: {self.user.username} - Session: {self.session_id} - Video: {self.video_id} - Minute: {self.minute}"
+
+
+class VideoSummary(models.Model):
+    # Totals of a finished video, written on disconnect (see summaries.py)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, null=True)
+    session_id = models.IntegerField(default=0)
+    video_id = models.IntegerField(default=0)
+    started_at = models.DateTimeField(null=True, blank=True)
+    ended_at = models.DateTimeField(null=True, blank=True)
+    frames = models.IntegerField(default=0)
+    reading_time = models.DurationField()
+    focus_time = models.DurationField()
+    blinks = models.IntegerField(default=0)
+    average_wpm = models.FloatField(null=True, blank=True)
+    total_words_read = models.FloatField(default=0)
+    fixations = models.IntegerField(default=0)
+    saccades = models.IntegerField(default=0)
+    mean_yaw = models.FloatField(null=True, blank=True)
+    mean_pitch = models.FloatField(null=True, blank=True)
+    mean_roll = models.FloatField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'session_id', 'video_id'], name='videosummary_user_video_uniq'),
+        ]
+
     def __str__(self):
-        return f"User: {self.user.username} - Session: {self.session_id} - Video: {self.video_id} - Timestamp: {self.timestamp}"
\ No newline at end of file
+        return f"User: {self.user.username} - Session: {self.session_id} - Video: {self.video_id} - Reading time: {self.reading_time}"
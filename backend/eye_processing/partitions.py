@@ -0,0 +1,126 @@
+"""
+Monthly range partitions for the per-frame SimpleEyeMetrics table (PostgreSQL only).
+
+The table is partitioned on timestamp by migration 0025. Every month gets its own
+partition named <table>_pYYYY_MM, rows outside the created months land in the
+<table>_default partition. Queries filtering on a timestamp range are pruned to the
+matching months and retention drops whole partitions instead of deleting rows.
+Partitions are kept up to date with `python manage.py eyemetrics_partitions`.
+"""
+import re
+from datetime import date
+
+TABLE = 'eye_processing_simpleeyemetrics'
+DEFAULT_PARTITION = f'{TABLE}_default'
+PARTITION_NAME = re.compile(rf'^{TABLE}_p(\d{{4}})_(\d{{2}})$')
+
+def month_start(day):
+    return date(day.year, day.month, 1)
+
+def add_months(month, months):
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+def partition_name(month):
+    return f'{TABLE}_p{month:%Y_%m}'
+
+def is_partitioned(connection):
+    if connection.vendor != 'postgresql':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(%s))", [TABLE])
+        return cursor.fetchone()[0]
+
+def list_partitions(connection):
+    # Months that have a partition attached, oldest first
+    with connection.cursor() as cursor:
+        cursor.execute("""
+            SELECT child.relname FROM pg_inherits
+            JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+            WHERE pg_inherits.inhparent = %s::regclass
+        """, [TABLE])
+        names = [row[0] for row in cursor.fetchall()]
+
+    months = []
+    for name in names:
+        match = PARTITION_NAME.match(name)
+        if match:
+            months.append(date(int(match.group(1)), int(match.group(2)), 1))
+    return sorted(months)
+
+def create_default_partition(connection):
+    quote = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        cursor.execute(f"CREATE TABLE IF NOT EXISTS {quote(DEFAULT_PARTITION)} PARTITION OF {quote(TABLE)} DEFAULT")
+    _rename_partition_indexes(connection, DEFAULT_PARTITION, 'default')
+
+def create_partition(connection, month):
+    """
+    Create and attach the partition for `month`. Rows of that month which already
+    ended up in the default partition are moved into it first, otherwise attaching
+    would fail. Returns False when the partition already exists.
+    """
+    month = month_start(month)
+    if month in list_partitions(connection):
+        return False
+
+    quote = connection.ops.quote_name
+    name = partition_name(month)
+    lower, upper = f'{month.isoformat()} 00:00:00+00', f'{add_months(month, 1).isoformat()} 00:00:00+00'
+
+    with connection.cursor() as cursor:
+        cursor.execute(f"CREATE TABLE {quote(name)} (LIKE {quote(TABLE)} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)")
+        cursor.execute(f"""
+            WITH moved AS (
+                DELETE FROM {quote(DEFAULT_PARTITION)} WHERE "timestamp" >= %s AND "timestamp" < %s RETURNING *
+            )
+            INSERT INTO {quote(name)} SELECT * FROM moved
+        """, [lower, upper])
+        cursor.execute(f"ALTER TABLE {quote(TABLE)} ATTACH PARTITION {quote(name)} FOR VALUES FROM (%s) TO (%s)", [lower, upper])
+
+    _rename_partition_indexes(connection, name, f'p{month:%Y_%m}')
+    return True
+
+def drop_partition(connection, month, detach_only=False):
+    # Detaching is a metadata change, the rows stay in a standalone table for archiving
+    quote = connection.ops.quote_name
+    name = partition_name(month)
+    with connection.cursor() as cursor:
+        cursor.execute(f"ALTER TABLE {quote(TABLE)} DETACH PARTITION {quote(name)}")
+        if not detach_only:
+            cursor.execute(f"DROP TABLE {quote(name)}")
+
+def manage_partitions(connection, today, ahead=3, retention_months=0, detach_only=False):
+    """
+    Make sure partitions exist from the current month to `ahead` months in the future
+    and remove the partitions that ended more than `retention_months` months ago
+    (0 keeps everything). Returns the created and removed months.
+    """
+    current = month_start(today)
+    created = [month for month in (add_months(current, n) for n in range(ahead + 1)) if create_partition(connection, month)]
+
+    removed = []
+    if retention_months > 0:
+        cutoff = add_months(current, -retention_months)
+        for month in list_partitions(connection):
+            if month < cutoff:
+                drop_partition(connection, month, detach_only=detach_only)
+                removed.append(month)
+
+    return created, removed
+
+def _rename_partition_indexes(connection, partition, suffix):
+    # Name the indexes of a partition after the parent indexes, so query plans show which index was used
+    quote = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        cursor.execute("""
+            SELECT parent_index.relname, child_index.relname FROM pg_inherits
+            JOIN pg_class parent_index ON parent_index.oid = pg_inherits.inhparent
+            JOIN pg_class child_index ON child_index.oid = pg_inherits.inhrelid
+            JOIN pg_index ON pg_index.indexrelid = child_index.oid
+            WHERE pg_index.indrelid = %s::regclass
+        """, [partition])
+        for parent_index, child_index in cursor.fetchall():
+            new_name = f'{parent_index[:62 - len(suffix)]}_{suffix}'
+            if child_index != new_name:
+                cursor.execute(f"ALTER INDEX {quote(child_index)} RENAME TO {quote(new_name)}")
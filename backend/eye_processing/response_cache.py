@@ -0,0 +1,74 @@
+"""
+Per-user data versions and cached responses of the eye_processing analytics views.
+
+Every write path that changes what the analytics endpoints return (the consumer's
+rollup flush, video summaries, rollup rebuilds, a new login session) bumps the user's
+data version in the Django cache. Responses are cached under (endpoint, user, query
+parameters, version) and carry an ETag derived from the same key, so repeated polls
+between two flushes get a 304 or the cached body without querying SimpleEyeMetrics.
+Responses of a live stream are therefore at most EYE_ROLLUP_FLUSH_SECONDS behind.
+"""
+import functools
+import hashlib
+import math
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from rest_framework.response import Response
+
+def version_key(user_id):
+    return f'eye-data-version:{user_id}'
+
+def data_version(user_id):
+    # A user without a stored version (new, or evicted from the cache) starts a new one
+    return cache.get_or_set(version_key(user_id), time.time, timeout=None)
+
+def bump_data_version(user_id):
+    cache.set(version_key(user_id), time.time(), timeout=None)
+
+def cached_response(bucket_seconds=None):
+    """
+    Decorator for the GET handler of an analytics view: serve the response cached for
+    the user's current data version, answering If-None-Match / If-Modified-Since with
+    304. Only 200 responses are cached. Views whose answer also depends on the clock
+    pass `bucket_seconds`, the response is then only reused within the same bucket.
+    """
+    def decorator(get):
+        @functools.wraps(get)
+        def wrapper(view, request, *args, **kwargs):
+            version = data_version(request.user.id)
+            key = response_cache_key(type(view).__name__, request, version, bucket_seconds)
+            etag = f'"{key.rsplit(":", 1)[1]}"'
+            last_modified = None if bucket_seconds else math.ceil(version)
+
+            not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+            if not_modified is not None:
+                not_modified['ETag'] = etag
+                return not_modified
+
+            data = cache.get(key)
+            if data is not None:
+                response = Response(data, status=200)
+            else:
+                response = get(view, request, *args, **kwargs)
+                if response.status_code != 200:
+                    return response
+                cache.set(key, response.data, timeout=settings.EYE_RESPONSE_CACHE_SECONDS)
+
+            response['ETag'] = etag
+            if last_modified is not None:
+                response['Last-Modified'] = http_date(last_modified)
+            response['Cache-Control'] = 'private, no-cache'
+            return response
+        return wrapper
+    return decorator
+
+def response_cache_key(endpoint, request, version, bucket_seconds=None):
+    parts = [endpoint, request.user.id, sorted(request.query_params.lists()), version]
+    if bucket_seconds:
+        parts.append(int(time.time() // bucket_seconds))
+    digest = hashlib.sha256(repr(parts).encode()).hexdigest()[:32]
+    return f'eye-response:{request.user.id}:{digest}'
@@ -0,0 +1,142 @@
+"""
+Per-minute rollup of the per-frame metrics (EyeMetricsMinute).
+
+The consumer counts frames into a MinuteRollup as they are stored and processed and
+upserts the buffered minutes every few seconds, so dashboards read O(minutes) rows
+instead of O(frames). rebuild_minutes recomputes the rollup of a video from its frames
+(backfill_minute_rollups command).
+"""
+from datetime import timezone as dt_timezone
+
+import numpy as np
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .archive import blink_starts, load_video_columns
+from .models import EyeMetricsMinute
+from .response_cache import bump_data_version
+
+COUNTERS = ('frames', 'focus_frames', 'face_frames', 'blinks', 'wpm_sum')
+
+def as_utc(timestamp):
+    # Naive timestamps are in the default time zone, like Django does when saving them
+    if timezone.is_naive(timestamp):
+        timestamp = timezone.make_aware(timestamp)
+    return timestamp.astimezone(dt_timezone.utc)
+
+def minute_of(timestamp):
+    return as_utc(timestamp).replace(second=0, microsecond=0)
+
+class MinuteRollup:
+    """
+    Per-minute counters of one video, buffered in the consumer between flushes. Frames
+    are counted when they are stored, focus, face and blinks once the frame has been
+    processed as a middle frame.
+    """
+    def __init__(self, user_id, video_id):
+        self.user_id = user_id
+        self.video_id = video_id
+        self.minutes = {}
+        self.blink_in_progress = False
+        self.last_processed = None
+
+    def _minute(self, session_id, timestamp):
+        timestamp = as_utc(timestamp)
+        key = (session_id, minute_of(timestamp))
+        row = self.minutes.get(key)
+        if row is None:
+            row = self.minutes[key] = dict.fromkeys(COUNTERS, 0) | {'first_timestamp': timestamp, 'last_timestamp': timestamp}
+        row['first_timestamp'] = min(row['first_timestamp'], timestamp)
+        row['last_timestamp'] = max(row['last_timestamp'], timestamp)
+        return row
+
+    def add_frame(self, session_id, timestamp, wpm):
+        row = self._minute(session_id, timestamp)
+        row['frames'] += 1
+        row['wpm_sum'] += wpm or 0
+
+    def add_result(self, session_id, timestamp, focus, face_detected, blink_detected):
+        # The same middle frame can be picked for several incoming frames, only count it once
+        timestamp = as_utc(timestamp)
+        if self.last_processed is not None and timestamp <= self.last_processed:
+            return
+        self.last_processed = timestamp
+
+        row = self._minute(session_id, timestamp)
+        row['focus_frames'] += int(bool(focus))
+        row['face_frames'] += int(bool(face_detected))
+
+        # Consecutive blink frames are one blink, counted in the minute it starts
+        if blink_detected and not self.blink_in_progress:
+            row['blinks'] += 1
+        self.blink_in_progress = bool(blink_detected)
+
+    def flush(self):
+        rows, self.minutes = self.minutes, {}
+        if rows:
+            upsert_minutes(self.user_id, self.video_id, rows)
+            bump_data_version(self.user_id)
+
+def blinks_per_minute(timestamps, blink_detected):
+    # Blinks starting in each minute that has frames, oldest minute first
+    _, minute_index = np.unique(timestamps.astype('datetime64[m]'), return_inverse=True)
+    return np.bincount(minute_index, weights=blink_starts(blink_detected)).astype(np.int64).tolist()
+
+def upsert_minutes(user_id, video_id, rows):
+    """
+    Add buffered counters to EyeMetricsMinute, one INSERT ... ON CONFLICT per minute.
+    `rows` maps (session_id, minute) to the counters and first/last timestamps.
+    """
+    table = EyeMetricsMinute._meta.db_table
+    adapt = connection.ops.adapt_datetimefield_value
+    increments = ', '.join(f'{counter} = {table}.{counter} + excluded.{counter}' for counter in COUNTERS)
+
+    sql = f"""
+        INSERT INTO {table} (user_id, session_id, video_id, minute, {', '.join(COUNTERS)}, first_timestamp, last_timestamp)
+        VALUES (%s, %s, %s, %s, {', '.join(['%s'] * len(COUNTERS))}, %s, %s)
+        ON CONFLICT (user_id, session_id, video_id, minute) DO UPDATE SET {increments},
+            first_timestamp = CASE WHEN excluded.first_timestamp < {table}.first_timestamp THEN excluded.first_timestamp ELSE {table}.first_timestamp END,
+            last_timestamp = CASE WHEN excluded.last_timestamp > {table}.last_timestamp THEN excluded.last_timestamp ELSE {table}.last_timestamp END
+    """
+    params = [
+        (user_id, session_id, video_id, adapt(minute), *(row[counter] for counter in COUNTERS), adapt(row['first_timestamp']), adapt(row['last_timestamp']))
+        for (session_id, minute), row in sorted(rows.items())
+    ]
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, params)
+
+def rebuild_minutes(user, session_id, video_id):
+    # Recompute the rollup of one video from its frames (or its archive), returns the number of minutes
+    columns = load_video_columns(user, session_id, video_id, ['timestamp', 'focus', 'face_detected', 'blink_detected', 'wpm'])
+    timestamps = columns['timestamp']
+    user_id = getattr(user, 'pk', user)
+    if len(timestamps) == 0:
+        EyeMetricsMinute.objects.filter(user_id=user_id, session_id=session_id, video_id=video_id).delete()
+        bump_data_version(user_id)
+        return 0
+
+    minutes, first, minute_index = np.unique(timestamps.astype('datetime64[m]'), return_index=True, return_inverse=True)
+    last = np.append(first[1:], len(timestamps)) - 1
+
+    def per_minute(values):
+        return np.bincount(minute_index, weights=values, minlength=len(minutes)).astype(np.int64).tolist()
+
+    def utc(values):
+        return [value.replace(tzinfo=dt_timezone.utc) for value in values.astype('datetime64[us]').tolist()]
+
+    counters = zip(
+        utc(minutes), np.bincount(minute_index, minlength=len(minutes)).tolist(), per_minute(columns['focus']), per_minute(columns['face_detected']),
+        per_minute(blink_starts(columns['blink_detected'])), per_minute(columns['wpm']), utc(timestamps[first]), utc(timestamps[last]),
+    )
+
+    with transaction.atomic():
+        EyeMetricsMinute.objects.filter(user_id=user_id, session_id=session_id, video_id=video_id).delete()
+        EyeMetricsMinute.objects.bulk_create([
+            EyeMetricsMinute(
+                user_id=user_id, session_id=session_id, video_id=video_id, minute=minute, frames=frames, focus_frames=focus_frames,
+                face_frames=face_frames, blinks=blinks, wpm_sum=wpm_sum, first_timestamp=first_timestamp, last_timestamp=last_timestamp
+            )
+            for minute, frames, focus_frames, face_frames, blinks, wpm_sum, first_timestamp, last_timestamp in counters
+        ])
+    bump_data_version(user_id)
+    return len(minutes)
@@ -0,0 +1,80 @@
+"""
+Summaries of finished videos (VideoSummary).
+
+A video's history never changes once its WebSocket disconnects, so its totals are
+computed once from its columns (archive.load_video_columns) and stored. The history
+views then read one row per video instead of recomputing from the frames.
+"""
+from datetime import timezone
+
+import numpy as np
+
+from .archive import count_blinks, load_video_columns
+from .models import MovementType, VideoSummary
+from .response_cache import bump_data_version
+
+SUMMARY_COLUMNS = ['timestamp', 'focus', 'blink_detected', 'wpm', 'reading_mode', 'movement_type', 'face_yaw', 'face_pitch', 'face_roll']
+READING_MODES = [2, 3, 4]
+
+def words_read(timestamps, wpm):
+    # Words read between consecutive records at the later record's speed
+    minutes = np.diff(timestamps).astype('timedelta64[us]').astype(np.int64) / 60e6
+    return float(np.sum(wpm[1:] * minutes))
+
+def count_movements(movement_type, focus):
+    # Fixations and saccades as runs of consecutive focused frames with the same movement type
+    movement = np.where(focus, movement_type, MovementType.NONE)
+    starts = movement != np.concatenate([[MovementType.NONE], movement[:-1]])
+    return int(np.count_nonzero(starts & (movement == MovementType.FIXATION))), int(np.count_nonzero(starts & (movement == MovementType.SACCADE)))
+
+def mean_angle(values):
+    values = values[~np.isnan(values)]
+    return float(np.mean(values)) if values.size else None
+
+def as_datetime(value):
+    return value.astype(object).replace(tzinfo=timezone.utc)
+
+def isoformat_utc(timestamps):
+    # Same strings as datetime.isoformat() of the UTC datetimes, formatted by NumPy
+    strings = np.datetime_as_string(timestamps.astype('datetime64[us]'), unit='us').tolist()
+    for i in np.flatnonzero(timestamps.astype('datetime64[us]').astype(np.int64) % 1_000_000 == 0).tolist():
+        strings[i] = strings[i][:19]  # isoformat() leaves out zero microseconds
+    return [string + '+00:00' for string in strings]
+
+def summarise_video(user, session_id, video_id):
+    """
+    Compute and store the VideoSummary of one video (replacing an older one). `user` is
+    a User or its id. Returns None when the video has no frames.
+    """
+    columns = load_video_columns(user, session_id, video_id, SUMMARY_COLUMNS)
+    timestamps = columns['timestamp']
+    if len(timestamps) == 0:
+        return None
+
+    # Same definitions as the reading-times view: focus time is the focused share of the reading time
+    reading_time = (timestamps[-1] - timestamps[0]).astype('timedelta64[us]').astype(object)
+    focus_time = reading_time * (np.count_nonzero(columns['focus']) / len(timestamps))
+
+    reading = np.isin(columns['reading_mode'], READING_MODES)
+    fixations, saccades = count_movements(columns['movement_type'], columns['focus'])
+
+    summary, _ = VideoSummary.objects.update_or_create(
+        user_id=getattr(user, 'pk', user), session_id=session_id, video_id=video_id,
+        defaults={
+            'started_at': as_datetime(timestamps[0]),
+            'ended_at': as_datetime(timestamps[-1]),
+            'frames': len(timestamps),
+            'reading_time': reading_time,
+            'focus_time': focus_time,
+            'blinks': count_blinks(columns['blink_detected']),
+            'average_wpm': float(np.mean(columns['wpm'][reading])) if reading.any() else None,
+            'total_words_read': words_read(timestamps[reading], columns['wpm'][reading]),
+            'fixations': fixations,
+            'saccades': saccades,
+            'mean_yaw': mean_angle(columns['face_yaw']),
+            'mean_pitch': mean_angle(columns['face_pitch']),
+            'mean_roll': mean_angle(columns['face_roll']),
+        }
+    )
+    bump_data_version(summary.user_id)
+    return summary
@@ -1,3 +1,788 @@
-from django.test import TestCase
+import gzip
+import json
+from datetime import date, datetime, timedelta, timezone
+from decimal import Decimal
+from unittest import skipUnless
 
-# Create your tests here.
+import numpy as np
+from scipy.spatial.transform import Rotation
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
+from django.utils.timezone import now
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+from asgiref.sync import async_to_sync
+from django.core.cache import cache
+
+from backend import middleware
+from backend.renderers import FastJSONRenderer
+
+from . import partitions
+from .live import LiveCounters
+from .archive import archive_video, load_video_columns, read_rows, ARCHIVE_COLUMNS
+from .models import EyeMetricsMinute, MovementType, SimpleEyeMetrics, UserSession, VideoArchive
+from .response_cache import bump_data_version
+from .rollups import MinuteRollup, blinks_per_minute, rebuild_minutes
+from .views import RetrieveLastBlinkRateView
+from .summaries import isoformat_utc, summarise_video, words_read
+from .eye_metrics.face import FaceProcessor, compute_axes, axes_to_euler, POSE_LANDMARK_IDX
+from .eye_metrics.keyframes import KeyframeScheduler
+from .eye_metrics.fixations_saccades import FixationSaccadeDetector, classify_eye_movements
+
+class HeadPoseParityTests(SimpleTestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(26)
+        # Face-like landmarks: jitter around a frontal layout plus fully random frames
+        frontal = np.array([[0.5, 0.55, -0.05], [0.4, 0.45, 0.0], [0.6, 0.45, 0.0], [0.5, 0.25, 0.0]])
+        jittered = frontal + rng.normal(scale=0.05, size=(500, 4, 3))
+        self.points = np.concatenate([jittered, rng.normal(size=(500, 4, 3))])
+
+    def scipy_pose(self, x_axis, y_axis, z_axis):
+        rotation = Rotation.from_matrix(np.vstack([x_axis, y_axis, z_axis]).T)
+        roll, yaw, pitch = rotation.as_euler("zyx", degrees=True)
+        return (-roll) % 360 - 180, yaw, pitch
+
+    def assertAnglesClose(self, expected, actual):
+        difference = (np.asarray(expected) - np.asarray(actual) + 180) % 360 - 180
+        self.assertLess(np.max(np.abs(difference)), 1e-6)
+
+    def test_matches_scipy_per_frame(self):
+        for nose_tip, left_eye, right_eye, forehead in self.points:
+            axes = compute_axes(nose_tip, left_eye, right_eye, forehead)
+            self.assertAnglesClose(self.scipy_pose(*axes), axes_to_euler(*axes))
+
+    def test_batch_matches_per_frame(self):
+        landmarks = np.zeros((len(self.points), 478, 3))
+        landmarks[:, list(POSE_LANDMARK_IDX), :] = self.points
+
+        _, _, _, batch_yaw, batch_pitch, batch_roll = FaceProcessor().compute_face_axes_batch(landmarks)
+
+        for n, (nose_tip, left_eye, right_eye, forehead) in enumerate(self.points):
+            roll, yaw, pitch = axes_to_euler(*compute_axes(nose_tip, left_eye, right_eye, forehead))
+            self.assertAnglesClose([roll, yaw, pitch], [batch_roll[n], batch_yaw[n], batch_pitch[n]])
+
+
+class FaceVelocityTests(SimpleTestCase):
+
+    def setUp(self):
+        self.face_processor = FaceProcessor()
+        self.axes = np.eye(3)
+        self.start = datetime(2025, 1, 1, 12, 0, 0)
+
+    def eyes(self, offset):
+        eye = np.full((6, 3), offset, dtype=np.float32)
+        return eye, eye
+
+    def speed(self, offset, seconds):
+        left_eye, right_eye = self.eyes(offset)
+        _, speed = self.face_processor.compute_velocity(left_eye, right_eye, *self.axes, self.start + timedelta(seconds=seconds))
+        return speed
+
+    def test_speed_uses_capture_timestamps(self):
+        self.assertEqual(self.speed(0.0, 0), 0.0)
+        self.assertAlmostEqual(self.speed(0.01, 0.5), np.linalg.norm([0.02] * 3), places=5)
+
+    def test_stale_frame_does_not_disturb_next_velocity(self):
+        self.speed(0.0, 0)
+        self.assertEqual(self.speed(0.5, -1), 0.0)
+        self.assertAlmostEqual(self.speed(0.01, 0.5), np.linalg.norm([0.02] * 3), places=5)
+
+
+class KeyframeSchedulerTests(SimpleTestCase):
+
+    def setUp(self):
+        self.scheduler = KeyframeScheduler(interval=3, ear_threshold=0.05, roi_threshold=12.0)
+        self.frame = np.full((120, 160, 3), 100, dtype=np.uint8)
+        eye = np.array([[40, 50], [60, 50], [50, 45], [50, 55]])
+        self.face_result = (1, eye, eye + [60, 0], 0.1, 5.0, 2.0, 0.0, self.frame)
+
+    def test_reuses_face_mesh_between_keyframes(self):
+        self.assertTrue(self.scheduler.needs_keyframe(self.frame, 0.3))
+        self.scheduler.record_keyframe(self.frame, 0.3, self.face_result)
+
+        for _ in range(2):
+            self.assertFalse(self.scheduler.needs_keyframe(self.frame, 0.31))
+            face_detected, left_eye, right_eye = self.scheduler.reuse(self.frame)[:3]
+            self.assertEqual(face_detected, 1)
+            self.assertIs(left_eye, self.face_result[1])
+        self.assertTrue(self.scheduler.needs_keyframe(self.frame, 0.31))
+
+    def test_ear_and_roi_motion_force_keyframe(self):
+        self.scheduler.record_keyframe(self.frame, 0.3, self.face_result)
+        self.assertTrue(self.scheduler.needs_keyframe(self.frame, 0.2))
+
+        moved = self.frame.copy()
+        moved[40:60, 30:130] = 200
+        self.assertTrue(self.scheduler.needs_keyframe(moved, 0.3))
+
+    def test_head_motion_between_keyframes_forces_keyframe(self):
+        frame = self.frame.copy()
+        frame[45:56, 40:61] = 30  # Dark eyes
+        frame[45:56, 100:121] = 30
+        self.scheduler.record_keyframe(frame, 0.3, self.face_result)
+        self.assertFalse(self.scheduler.needs_keyframe(frame, 0.3))
+        self.assertEqual(self.scheduler.reuse(frame)[3:7], (0.1, 5.0, 2.0, 0.0))
+
+        # The head moves a few pixels: the keyframe speed and pose must not be reused
+        moved = np.roll(frame, (4, 6), axis=(0, 1))
+        self.assertTrue(self.scheduler.needs_keyframe(moved, 0.3))
+
+    def test_moving_keyframe_is_not_reused(self):
+        for speed, yaw, pitch in ((0.4, 5.0, 2.0), (0.1, 30.0, 2.0), (0.1, 5.0, -35.0)):
+            self.scheduler.record_keyframe(self.frame, 0.3, (1, *self.face_result[1:3], speed, yaw, pitch, 0.0, self.frame))
+            self.assertTrue(self.scheduler.needs_keyframe(self.frame, 0.3))
+
+    def test_lost_face_runs_face_mesh(self):
+        self.scheduler.record_keyframe(self.frame, 0.3, (0, None, None, 0.0, None, None, None, self.frame))
+        self.assertTrue(self.scheduler.needs_keyframe(self.frame, 0.3))
+
+
+class EyeMovementBatchTests(SimpleTestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(30)
+        start = datetime(2025, 1, 1, 12, 0, 0)
+        n = 600
+
+        def centres(missing):
+            points = rng.integers(200, 260, size=(n, 2))
+            return [None if gone else (int(x), int(y)) for (x, y), gone in zip(points, rng.random(n) < missing)]
+
+        self.left, self.right = centres(0.2), centres(0.3)
+        # Mostly 30fps, with duplicated and out-of-order timestamps mixed in
+        offsets = np.cumsum(rng.choice([33333, 33334, 0, -20000, 250000], size=n, p=[0.45, 0.45, 0.04, 0.03, 0.03]))
+        self.timestamps = [start + timedelta(microseconds=int(offset)) for offset in offsets]
+
+    def test_batch_matches_streaming(self):
+        detector = FixationSaccadeDetector()
+        streamed = [detector.process_eye_movements(left, right, 640, 480, timestamp)
+                    for left, right, timestamp in zip(self.left, self.right, self.timestamps)]
+
+        left_velocity, right_velocity, movement_type = classify_eye_movements(self.left, self.right, self.timestamps, 640, 480)
+
+        self.assertEqual([s[0] for s in streamed], left_velocity.tolist())
+        self.assertEqual([s[1] for s in streamed], right_velocity.tolist())
+        self.assertEqual([s[2] for s in streamed], movement_type.tolist())
+        self.assertIn("saccade", movement_type)
+
+    def test_accepts_datetime64_arrays(self):
+        left_velocity, _, movement_type = classify_eye_movements(self.left, self.right, self.timestamps, 640, 480)
+        timestamps = np.array(self.timestamps, dtype="datetime64[us]")
+        left_velocity_64, _, movement_type_64 = classify_eye_movements(self.left, self.right, timestamps, 640, 480)
+
+        np.testing.assert_array_equal(left_velocity, left_velocity_64)
+        np.testing.assert_array_equal(movement_type, movement_type_64)
+
+
+class SimpleEyeMetricsQueryPlanTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="reader", password="password")
+        other = User.objects.create_user(username="other", password="password")
+        start = datetime(2025, 1, 1, 12, 0, 0)
+        SimpleEyeMetrics.objects.bulk_create([
+            SimpleEyeMetrics(user=user, session_id=session_id, video_id=video_id, timestamp=start + timedelta(seconds=i / 30),
+                             focus=i % 3 == 0, face_detected=True, blink_detected=int(i % 50 == 0))
+            for user in (cls.user, other) for session_id in range(1, 4) for video_id in range(1, 3) for i in range(200)
+        ])
+
+    def setUp(self):
+        if connection.vendor == "postgresql":
+            # Small test tables would otherwise be read sequentially
+            with connection.cursor() as cursor:
+                cursor.execute("SET enable_seqscan = off")
+
+    def assertUsesIndex(self, queryset, index_name):
+        plan = queryset.explain()
+        self.assertIn(index_name, plan)
+
+    def video_records(self):
+        return SimpleEyeMetrics.objects.filter(user=self.user, session_id=3, video_id=2)
+
+    def test_time_window_uses_composite_index(self):
+        records = self.video_records().filter(timestamp__gte=datetime(2025, 1, 1, 12, 0, 3))
+        self.assertUsesIndex(records, "eyemetrics_user_video_ts_idx")
+        self.assertUsesIndex(self.video_records().order_by("timestamp"), "eyemetrics_user_video_ts_idx")
+
+    def test_focus_count_uses_partial_index(self):
+        self.assertUsesIndex(self.video_records().filter(focus=True), "eyemetrics_focus_idx")
+
+    def test_blink_query_uses_partial_index(self):
+        self.assertUsesIndex(self.video_records().filter(blink_detected=1), "eyemetrics_blink_idx")
+
+
+class CompactSimpleEyeMetricsMigrationTests(TransactionTestCase):
+    migrate_from = [("eye_processing", "0023_simpleeyemetrics_indexes")]
+    migrate_to = [("eye_processing", "0024_compact_simpleeyemetrics")]
+
+    def migrate(self, targets):
+        executor = MigrationExecutor(connection)
+        executor.migrate(targets)
+        return executor.loader.project_state(targets).apps
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        self.migrate(executor.loader.graph.leaf_nodes())
+
+    def test_centres_are_truncated_on_every_backend(self):
+        old_apps = self.migrate(self.migrate_from)
+        old_apps.get_model("eye_processing", "SimpleEyeMetrics").objects.create(
+            timestamp=datetime(2025, 1, 1, tzinfo=timezone.utc), left_centre=[10.5, -3.5], right_centre=[20.5, 7.9], movement_type="saccade"
+        )
+
+        frame = self.migrate(self.migrate_to).get_model("eye_processing", "SimpleEyeMetrics").objects.get()
+        self.assertEqual((frame.left_centre_x, frame.left_centre_y, frame.right_centre_x, frame.right_centre_y), (10, -3, 20, 7))
+        self.assertEqual(frame.movement_type, 2)
+
+
+@skipUnless(connection.vendor == "postgresql", "SimpleEyeMetrics is only partitioned on PostgreSQL")
+class SimpleEyeMetricsPartitionTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="reader", password="password")
+
+    def add_frame(self, timestamp):
+        return SimpleEyeMetrics.objects.create(user=self.user, session_id=1, video_id=1, timestamp=timestamp)
+
+    def partition_rows(self, month):
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT COUNT(*) FROM "{partitions.partition_name(month)}"')
+            return cursor.fetchone()[0]
+
+    def test_time_range_is_pruned_to_one_partition(self):
+        january, february = date(2025, 1, 1), date(2025, 2, 1)
+        for month in (january, february):
+            partitions.create_partition(connection, month)
+            self.add_frame(datetime(month.year, month.month, 10, tzinfo=timezone.utc))
+
+        plan = SimpleEyeMetrics.objects.filter(
+            timestamp__gte=datetime(2025, 1, 5, tzinfo=timezone.utc), timestamp__lt=datetime(2025, 1, 20, tzinfo=timezone.utc)
+        ).explain()
+        self.assertIn(partitions.partition_name(january), plan)
+        self.assertNotIn(partitions.partition_name(february), plan)
+
+    def test_new_partition_takes_rows_from_default(self):
+        frame = self.add_frame(datetime(2024, 6, 3, tzinfo=timezone.utc))
+        self.assertTrue(partitions.create_partition(connection, date(2024, 6, 1)))
+        self.assertFalse(partitions.create_partition(connection, date(2024, 6, 1)))
+
+        self.assertEqual(self.partition_rows(date(2024, 6, 1)), 1)
+        self.assertTrue(SimpleEyeMetrics.objects.filter(id=frame.id).exists())
+
+    def test_retention_drops_expired_months(self):
+        for month in (date(2025, 1, 1), date(2025, 2, 1), date(2025, 3, 1)):
+            partitions.create_partition(connection, month)
+
+        created, removed = partitions.manage_partitions(connection, date(2025, 6, 15), ahead=1, retention_months=3)
+
+        self.assertEqual(created, [date(2025, 6, 1), date(2025, 7, 1)])
+        self.assertEqual(removed, [date(2025, 1, 1), date(2025, 2, 1)])
+        self.assertEqual(partitions.list_partitions(connection)[0], date(2025, 3, 1))
+
+
+class VideoArchiveTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="reader", password="password")
+        start = datetime(2025, 1, 1, 12, 0, 0, tzinfo=timezone.utc)
+        SimpleEyeMetrics.objects.bulk_create([
+            SimpleEyeMetrics(user=cls.user, session_id=1, video_id=1, timestamp=start + timedelta(milliseconds=100 * i),
+                             focus=i % 4 != 0, face_detected=i % 10 != 0, blink_detected=int(i % 40 < 3),
+                             gaze_x=None if i % 7 == 0 else i / 3, left_centre_x=None if i % 5 == 0 else i % 300,
+                             reading_mode=2 + i % 3, wpm=200 + i % 50)
+            for i in range(1800)
+        ])
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_archive_round_trips_columns(self):
+        archive = archive_video(self.user, 1, 1)
+        self.assertEqual(archive.frame_count, 1800)
+        self.assertEqual(archive.focus_frames, SimpleEyeMetrics.objects.filter(focus=True).count())
+        self.assertEqual(archive.blinks, 45)
+
+        archived = load_video_columns(self.user, 1, 1, list(ARCHIVE_COLUMNS))
+        rows = read_rows(self.user, 1, 1, list(ARCHIVE_COLUMNS))
+        for name in ARCHIVE_COLUMNS:
+            np.testing.assert_array_equal(archived[name], rows[name])
+
+    def test_views_read_archive_transparently(self):
+        urls = ["/api/eye/last-blink-count/", "/api/eye/reading-speed/"]
+        before = [self.client.get(url).json() for url in urls]
+
+        archive_video(self.user, 1, 1)
+        # Archived videos are no longer read from the per-frame rows
+        SimpleEyeMetrics.objects.update(wpm=0, blink_detected=0)
+
+        self.assertEqual(before, [self.client.get(url).json() for url in urls])
+        self.assertEqual(VideoArchive.objects.count(), 1)
+
+
+class MinuteRollupTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="reader", password="password")
+        cls.start = now().replace(microsecond=0) - timedelta(minutes=3)
+        cls.frames = [
+            SimpleEyeMetrics(user=cls.user, session_id=1, video_id=1, timestamp=cls.start + timedelta(milliseconds=100 * i),
+                             focus=i % 10 != 0, face_detected=i % 2 == 0, blink_detected=int(i % 40 < 3), wpm=200 + i % 50)
+            for i in range(1800)
+        ]
+        SimpleEyeMetrics.objects.bulk_create(cls.frames)
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def rollup_rows(self):
+        return list(EyeMetricsMinute.objects.order_by("minute").values(
+            "minute", "frames", "focus_frames", "face_frames", "blinks", "wpm_sum", "first_timestamp", "last_timestamp"
+        ))
+
+    def test_ingest_rollup_matches_rebuild(self):
+        rollup = MinuteRollup(self.user.id, 1)
+        for n, frame in enumerate(self.frames):
+            rollup.add_frame(1, frame.timestamp, frame.wpm)
+            rollup.add_result(1, frame.timestamp, frame.focus, frame.face_detected, frame.blink_detected)
+            # Middle frames can be picked twice
+            rollup.add_result(1, frame.timestamp, frame.focus, frame.face_detected, frame.blink_detected)
+            if n % 700 == 0:
+                rollup.flush()
+        rollup.flush()
+        ingested = self.rollup_rows()
+
+        self.assertEqual(rebuild_minutes(self.user, 1, 1), len(ingested))
+        self.assertEqual(ingested, self.rollup_rows())
+        self.assertEqual(sum(row["frames"] for row in ingested), 1800)
+        self.assertEqual(sum(row["blinks"] for row in ingested), 45)
+
+    def test_views_read_rollup(self):
+        rebuild_minutes(self.user, 1, 1)
+        UserSession.objects.create(user=self.user, session_id=1)
+
+        video = self.client.get("/api/eye/reading-times/").json()["sessions"][0]["videos"][0]
+        self.assertEqual(float(video["total_reading_time"]), 179.9)
+        self.assertAlmostEqual(float(video["total_focus_time"]), 179.9 * 0.9)
+
+        self.assertEqual(self.client.get("/api/eye/last-blink-count/").json()["blink_rate"],
+                         list(EyeMetricsMinute.objects.order_by("minute").values_list("blinks", flat=True)))
+
+        # 90% focus and 50% face detection in any one minute window
+        self.assertEqual(self.client.get("/api/eye/break-check/?time_limit=1").json(), {"focus_status": True, "face_detected_status": False})
+
+
+class AllUserSessionsQueryTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="reader", password="password")
+        start = datetime(2025, 1, 1, tzinfo=timezone.utc)
+        UserSession.objects.bulk_create([UserSession(user=cls.user, session_id=session_id) for session_id in range(1, 201)])
+        EyeMetricsMinute.objects.bulk_create([
+            EyeMetricsMinute(user=cls.user, session_id=session_id, video_id=video_id, minute=minute, frames=1800, focus_frames=900,
+                             first_timestamp=minute, last_timestamp=minute + timedelta(seconds=59))
+            for session_id in range(1, 201) for video_id in range(1, 4)
+            for minute in (start + timedelta(days=session_id, minutes=10 * video_id + m) for m in range(5))
+        ])
+
+    def test_sessions_use_one_grouped_query(self):
+        cache.clear()
+        client = APIClient()
+        client.force_authenticate(self.user)
+
+        # The sessions, the video summaries, the minute rollups of videos without a summary and the frames of videos with neither
+        with self.assertNumQueries(4):
+            sessions = client.get("/api/eye/reading-times/").json()["sessions"]
+
+        self.assertEqual(len(sessions), 200)
+        self.assertEqual([video["video_id"] for video in sessions[0]["videos"]], [1, 2, 3])
+        self.assertEqual(float(sessions[0]["total_reading_time"]), 3 * 299)
+        self.assertEqual(float(sessions[0]["videos"][0]["total_focus_time"]), 299 / 2)
+
+
+class VideoSummaryTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="reader", password="password")
+        start = datetime(2025, 1, 1, 12, 0, 0, tzinfo=timezone.utc)
+        # Fixation runs of 8 frames separated by 2 saccade frames, no face every 10th frame
+        SimpleEyeMetrics.objects.bulk_create([
+            SimpleEyeMetrics(user=cls.user, session_id=1, video_id=1, timestamp=start + timedelta(milliseconds=100 * i),
+                             focus=i % 10 != 9, face_detected=i % 10 != 9, face_yaw=None if i % 10 == 9 else 4.0,
+                             movement_type=MovementType.SACCADE if i % 10 in (7, 8) else MovementType.FIXATION,
+                             blink_detected=int(i % 40 < 3), reading_mode=3, wpm=240)
+            for i in range(600)
+        ])
+        UserSession.objects.create(user=cls.user, session_id=1)
+
+    def test_summary_totals(self):
+        summary = summarise_video(self.user, 1, 1)
+
+        self.assertEqual(summary.reading_time, timedelta(seconds=59.9))
+        self.assertEqual(summary.focus_time, timedelta(seconds=59.9) * 0.9)
+        self.assertEqual((summary.fixations, summary.saccades, summary.blinks), (60, 60, 15))
+        self.assertAlmostEqual(summary.total_words_read, 240 * 59.9 / 60)
+        self.assertEqual((summary.average_wpm, summary.mean_yaw, summary.mean_pitch), (240, 4.0, None))
+
+    def test_reading_times_read_summaries(self):
+        cache.clear()
+        summarise_video(self.user, 1, 1)
+        client = APIClient()
+        client.force_authenticate(self.user)
+
+        video = client.get("/api/eye/reading-times/").json()["sessions"][0]["videos"][0]
+        self.assertEqual(float(video["total_reading_time"]), 59.9)
+        self.assertAlmostEqual(float(video["total_focus_time"]), 59.9 * 0.9)
+
+    def test_reading_times_keep_videos_without_summary(self):
+        # An older video never summarised (unclean disconnect), a newer one summarised
+        cache.clear()
+        start = datetime(2025, 1, 1, 11, 0, 0, tzinfo=timezone.utc)
+        EyeMetricsMinute.objects.create(user=self.user, session_id=1, video_id=0, minute=start, frames=100, focus_frames=50,
+                                        first_timestamp=start, last_timestamp=start + timedelta(seconds=40))
+        rebuild_minutes(self.user, 1, 1)
+        summarise_video(self.user, 1, 1)
+        client = APIClient()
+        client.force_authenticate(self.user)
+
+        videos = client.get("/api/eye/reading-times/").json()["sessions"][0]["videos"]
+        self.assertEqual([video["video_id"] for video in videos], [0, 1])
+        self.assertEqual(float(videos[0]["total_reading_time"]), 40)
+        self.assertEqual(float(videos[0]["total_focus_time"]), 20)
+        self.assertEqual(float(videos[1]["total_reading_time"]), 59.9)
+
+    def test_reading_times_count_frames_without_summary_or_rollup(self):
+        # Recorded before summaries and rollups existed
+        cache.clear()
+        client = APIClient()
+        client.force_authenticate(self.user)
+
+        with self.assertNumQueries(4):
+            videos = client.get("/api/eye/reading-times/").json()["sessions"][0]["videos"]
+        self.assertEqual([video["video_id"] for video in videos], [1])
+        self.assertEqual(float(videos[0]["total_reading_time"]), 59.9)
+        self.assertAlmostEqual(float(videos[0]["total_focus_time"]), 59.9 * 0.9)
+
+
+class BlinkRateTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="reader", password="password")
+        start = datetime(2025, 1, 1, 12, 0, 50, tzinfo=timezone.utc)
+        # Blinks of 4 frames every 3 seconds, some of them crossing a minute boundary
+        SimpleEyeMetrics.objects.bulk_create([
+            SimpleEyeMetrics(user=cls.user, session_id=1, video_id=1, timestamp=start + timedelta(milliseconds=100 * i),
+                             blink_detected=None if i % 30 == 0 else int(i % 30 >= 26))
+            for i in range(1500)
+        ])
+
+    def test_database_and_archive_paths_agree(self):
+        view = RetrieveLastBlinkRateView()
+        with self.assertNumQueries(2):
+            from_database = view.calculate_blink_rate(self.user, 1, 1)
+
+        self.assertEqual(len(from_database), 4)
+        self.assertEqual(sum(from_database), 50)
+
+        archive_video(self.user, 1, 1)
+        self.assertEqual(view.calculate_blink_rate(self.user, 1, 1), from_database)
+
+        rebuild_minutes(self.user, 1, 1)
+        self.assertEqual(list(EyeMetricsMinute.objects.order_by("minute").values_list("blinks", flat=True)), from_database)
+
+    def test_no_frames(self):
+        self.assertEqual(RetrieveLastBlinkRateView().calculate_blink_rate(self.user, 1, 2), [])
+        self.assertEqual(blinks_per_minute(np.array([], dtype="datetime64[us]"), np.array([])), [])
+
+
+class LiveBreakCheckTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="reader", password="password")
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.counters = LiveCounters(self.user.id, 1, 1)
+
+        # 90 seconds at 10 fps up to now, 90% focus and a face in half of the frames
+        latest = now().timestamp()
+        for i in range(900):
+            frame_time = latest - 90 + i / 10
+            self.counters.add_frame(frame_time)
+            self.counters.add_result(frame_time, i % 10 != 0, i % 2 == 0)
+            self.counters.add_result(frame_time, True, True)  # Middle frame picked again
+
+    def tearDown(self):
+        cache.clear()
+
+    def test_live_stream_is_answered_from_cache(self):
+        async_to_sync(self.counters.publish)(force=True)
+
+        with self.assertNumQueries(0):
+            response = self.client.get("/api/eye/break-check/?time_limit=1")
+        self.assertEqual(response.json(), {"focus_status": True, "face_detected_status": False})
+
+    def test_without_live_stream_falls_back_to_database(self):
+        async_to_sync(self.counters.publish)(force=True)
+        async_to_sync(self.counters.clear)()
+
+        self.assertEqual(self.client.get("/api/eye/break-check/?time_limit=1").status_code, 400)
+
+
+class ReadingSpeedDownsampleTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="reader", password="password")
+        start = datetime(2025, 1, 1, 12, 0, tzinfo=timezone.utc)
+        SimpleEyeMetrics.objects.bulk_create([
+            SimpleEyeMetrics(user=cls.user, session_id=1, video_id=1, timestamp=start + timedelta(milliseconds=100 * i),
+                             reading_mode=2, wpm=200 + i % 50)
+            for i in range(1001)
+        ])
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_max_points_keeps_totals(self):
+        full = self.client.get("/api/eye/reading-speed/").json()
+        sampled = self.client.get("/api/eye/reading-speed/?max_points=100").json()
+
+        self.assertEqual(len(full["reading_speed_over_time"]), 1000)
+        self.assertEqual(len(sampled["reading_speed_over_time"]), 100)
+        self.assertEqual(sampled["total_words_read"], full["total_words_read"])
+        self.assertEqual(sampled["average_wpm"], full["average_wpm"])
+
+        # Buckets of 10 points: mean time of the bucket and mean speed
+        first = sampled["reading_speed_over_time"][0]
+        self.assertEqual(first["timestamp"], "2025-01-01T12:00:00.550000+00:00")
+        self.assertEqual(first["wpm"], 205.5)
+
+        self.assertEqual(self.client.get("/api/eye/reading-speed/?max_points=5000").json(), full)
+
+    def test_invalid_max_points(self):
+        for value in ["0", "-3", "abc"]:
+            self.assertEqual(self.client.get(f"/api/eye/reading-speed/?max_points={value}").status_code, 400)
+
+
+class ResponseCacheTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="reader", password="password")
+        start = datetime(2025, 1, 1, 12, 0, tzinfo=timezone.utc)
+        SimpleEyeMetrics.objects.bulk_create([
+            SimpleEyeMetrics(user=cls.user, session_id=1, video_id=1, timestamp=start + timedelta(milliseconds=100 * i),
+                             blink_detected=int(i % 40 < 3), reading_mode=2, wpm=240)
+            for i in range(600)
+        ])
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def tearDown(self):
+        cache.clear()
+
+    def test_polls_are_answered_without_queries_until_new_data(self):
+        first = self.client.get("/api/eye/reading-speed/")
+        self.assertEqual(first.status_code, 200)
+
+        with self.assertNumQueries(0):
+            cached = self.client.get("/api/eye/reading-speed/")
+            not_modified = self.client.get("/api/eye/reading-speed/", HTTP_IF_NONE_MATCH=first["ETag"])
+        self.assertEqual(cached.json(), first.json())
+        self.assertEqual(cached["ETag"], first["ETag"])
+        self.assertEqual(not_modified.status_code, 304)
+
+        # Other parameters are cached separately
+        self.assertNotEqual(self.client.get("/api/eye/reading-speed/?max_points=10")["ETag"], first["ETag"])
+
+        # New frames only show up once the ingest path bumps the data version
+        SimpleEyeMetrics.objects.update(wpm=120)
+        self.assertEqual(self.client.get("/api/eye/reading-speed/").json(), first.json())
+        bump_data_version(self.user.id)
+        changed = self.client.get("/api/eye/reading-speed/", HTTP_IF_NONE_MATCH=first["ETag"])
+        self.assertEqual(changed.status_code, 200)
+        self.assertEqual(changed.json()["average_wpm"], 120)
+
+    def test_rollup_flush_bumps_version(self):
+        etag = self.client.get("/api/eye/last-blink-count/")["ETag"]
+
+        rollup = MinuteRollup(self.user.id, 1)
+        rollup.add_frame(1, datetime(2025, 1, 1, 12, 1, tzinfo=timezone.utc), 240)
+        rollup.flush()
+
+        response = self.client.get("/api/eye/last-blink-count/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {"blink_rate": [0]})
+
+    def test_errors_are_not_cached(self):
+        self.assertEqual(self.client.get("/api/eye/reading-times/").status_code, 404)
+        UserSession.objects.create(user=self.user, session_id=1)
+        self.assertEqual(self.client.get("/api/eye/reading-times/").status_code, 200)
+
+
+class LiveMetricsTests(SimpleTestCase):
+
+    def setUp(self):
+        # 120 seconds at 10 fps, 90% focus, a face in half of the frames and a 3 frame blink every 4 seconds
+        self.counters = LiveCounters(1, 1, 1)
+        self.epochs = 1_700_000_000 + np.arange(1200) / 10
+        self.wpm = 200 + np.arange(1200) % 50
+        for i, epoch in enumerate(self.epochs):
+            self.counters.add_frame(epoch, 2 if i % 100 else 1, int(self.wpm[i]))
+            self.counters.add_result(epoch, i % 10 != 0, i % 2 == 0, i % 40 < 3)
+
+    def test_metrics_over_window(self):
+        reading = np.arange(1200) % 100 != 0
+        timestamps = (self.epochs[reading] * 1e6).astype("datetime64[us]")
+
+        self.assertEqual(self.counters.metrics(60), {
+            "blink_rate": 15.0,
+            "focus_percentage": 90.0,
+            "face_detected_percentage": 50.0,
+            "words_read": round(words_read(timestamps, self.wpm[reading]), 1),
+        })
+
+    def test_changed_metrics_are_deltas(self):
+        self.assertEqual(self.counters.changed_metrics(60), self.counters.metrics(60))
+        self.assertEqual(self.counters.changed_metrics(60), {})
+
+        # A stored frame that has not been processed yet
+        self.counters.add_frame(self.epochs[-1] + 0.1, 2, 300)
+        self.assertEqual(set(self.counters.changed_metrics(60)), {"words_read", "focus_percentage", "face_detected_percentage"})
+
+
+class FastJSONRendererTests(SimpleTestCase):
+
+    def test_same_json_as_drf(self):
+        data = {
+            "timestamp": datetime(2025, 1, 1, 12, 0, tzinfo=timezone.utc),
+            "timestamps": [datetime(2025, 1, 1, 12, 0, 0, 123456, tzinfo=timezone.utc), datetime(2025, 1, 1, 12, 0, 0, 5000)],
+            "duration": timedelta(seconds=59.9),
+            "decimal": Decimal("1.50"),
+            "blink_rate": np.arange(5),
+            "wpm": np.float32(240.5),
+            "count": np.int64(3),
+            "text": "line\u2028separator",
+        }
+        fast = FastJSONRenderer().render(data, "application/json")
+        self.assertEqual(json.loads(fast), json.loads(JSONRenderer().render(data, "application/json")))
+        self.assertEqual(json.loads(fast)["timestamps"], ["2025-01-01T12:00:00.123456Z", "2025-01-01T12:00:00.005000"])
+        self.assertIn(b"\\u2028", fast)
+
+    def test_non_finite_floats_raise_like_drf(self):
+        for value in (float("nan"), [1.0, float("inf")], np.array([0.5, np.nan]), np.float32("nan"), Decimal("NaN")):
+            with self.subTest(value=value):
+                with self.assertRaises(ValueError):
+                    JSONRenderer().render({"value": value}, "application/json")
+                with self.assertRaises(ValueError):
+                    FastJSONRenderer().render({"value": value}, "application/json")
+
+        self.assertEqual(FastJSONRenderer().render({"value": None, "rate": [1.5]}), b'{"value":null,"rate":[1.5]}')
+
+    def test_isoformat_utc(self):
+        timestamps = np.datetime64("2025-01-01T12:00:00", "us") + np.array([0, 1, 33333, 1_000_000], dtype="timedelta64[us]")
+        expected = [timestamp.replace(tzinfo=timezone.utc).isoformat() for timestamp in timestamps.tolist()]
+        self.assertEqual(isoformat_utc(timestamps), expected)
+
+
+class CompressionMiddlewareTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="reader", password="password")
+        start = datetime(2025, 1, 1, 12, 0, tzinfo=timezone.utc)
+        SimpleEyeMetrics.objects.bulk_create([
+            SimpleEyeMetrics(user=cls.user, session_id=1, video_id=1, timestamp=start + timedelta(milliseconds=100 * i), reading_mode=2, wpm=240)
+            for i in range(600)
+        ])
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_large_responses_are_compressed(self):
+        plain = self.client.get("/api/eye/reading-speed/")
+        response = self.client.get("/api/eye/reading-speed/", HTTP_ACCEPT_ENCODING="gzip")
+
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertEqual(json.loads(gzip.decompress(response.content)), plain.json())
+        self.assertEqual(response["ETag"], "W/" + plain["ETag"])
+
+        # The weak ETag still matches
+        self.assertEqual(self.client.get("/api/eye/reading-speed/", HTTP_IF_NONE_MATCH=response["ETag"]).status_code, 304)
+
+    def test_small_responses_are_not_compressed(self):
+        response = self.client.get("/api/eye/last-blink-count/", HTTP_ACCEPT_ENCODING="gzip, br")
+        self.assertFalse(response.has_header("Content-Encoding"))
+
+    @skipUnless(middleware.brotli, "brotli is not installed")
+    def test_brotli_preferred(self):
+        response = self.client.get("/api/eye/reading-speed/", HTTP_ACCEPT_ENCODING="gzip, br")
+        self.assertEqual(response["Content-Encoding"], "br")
+        self.assertEqual(json.loads(middleware.brotli.decompress(response.content)), self.client.get("/api/eye/reading-speed/").json())
+
+
+class ExportTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="reader", password="password")
+        other = User.objects.create_user(username="other", password="password")
+        start = datetime(2025, 1, 1, 12, 0, tzinfo=timezone.utc)
+        SimpleEyeMetrics.objects.bulk_create([
+            SimpleEyeMetrics(user=user, session_id=1, video_id=1 + i // 2500, timestamp=start + timedelta(milliseconds=100 * i),
+                             focus=i % 4 != 0, gaze_x=None if i % 7 == 0 else 0.5, wpm=240, frame="data")
+            for user in (cls.user, other) for i in range(5000)
+        ])
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_ndjson_streams_all_rows(self):
+        response = self.client.get("/api/eye/export/?session_id=1")
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        self.assertTrue(response.streaming)
+
+        rows = [json.loads(line) for line in b"".join(response.streaming_content).decode().splitlines()]
+        self.assertEqual(len(rows), 5000)
+        self.assertNotIn("frame", rows[0])
+        self.assertEqual(rows[7], rows[7] | {"session_id": 1, "video_id": 1, "timestamp": "2025-01-01T12:00:00.700000+00:00", "gaze_x": None, "focus": True})
+        self.assertEqual(rows[-1]["video_id"], 2)
+
+    def test_csv_projection_of_one_video(self):
+        response = self.client.get("/api/eye/export/?session_id=1&video_id=2&export_format=csv&columns=timestamp,focus")
+        self.assertEqual(response["Content-Disposition"], 'attachment; filename="session-1-video-2.csv"')
+
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0], "timestamp,focus")
+        self.assertEqual(lines[1], "2025-01-01T12:04:10+00:00,False")
+        self.assertEqual(len(lines), 2501)
+
+    def test_invalid_parameters(self):
+        for query in ["", "session_id=a", "session_id=1&export_format=xml", "session_id=1&columns=timestamp,frame"]:
+            self.assertEqual(self.client.get(f"/api/eye/export/?{query}").status_code, 400)
@@ -10,12 +10,16 @@ import numpy as np
 from PIL import Image, UnidentifiedImageError
 import base64
 import asyncio
+import time
 
 from channels.generic.websocket import AsyncWebsocketConsumer
+from django.conf import settings
 from django.db.models import Max
 
-from eye_processing.eye_metrics.process_eye_metrics import process_eye
+from eye_processing.eye_metrics.process_eye_metrics import EyeMetricsPipeline
 from eye_processing.eye_metrics.process_blinks import process_ears, process_blinks
+from eye_processing.rollups import MinuteRollup, as_utc
+from eye_processing.live import LiveCounters
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
 django.setup()  # Ensure Django is initialised before importing Django modules
@@ -68,6 +72,17 @@ class VideoFrameConsumer(AsyncWebsocketConsumer):
             self.video_id = (max_video_id['video_id__max'] or 0) + 1
             self.session_id = max_session_id['session_id__max']  
 
+            # Face mesh tracking, velocities and keyframes are per connection
+            self.pipeline = EyeMetricsPipeline(keyframe_interval=settings.EYE_KEYFRAME_INTERVAL)
+
+            # Per-minute counters of this video, upserted every EYE_ROLLUP_FLUSH_SECONDS
+            self.rollup = MinuteRollup(self.user.id, self.video_id)
+            self.rollup_flushed_at = time.monotonic()
+
+            # Per-second counters of this stream in the cache, for break checks and the pushed metrics
+            self.live_counters = LiveCounters(self.user.id, self.session_id, self.video_id)
+            self.metrics_pushed_at = time.monotonic()
+
             await self.accept()
         except IndexError:
             print("Invalid query string format:", query_string)
@@ -78,6 +93,8 @@ class VideoFrameConsumer(AsyncWebsocketConsumer):
             
     async def disconnect(self, close_code):
         from eye_processing.models import SimpleEyeMetrics
+        from eye_processing.archive import archive_video
+        from eye_processing.summaries import summarise_video
 
         # Close all threads
         for task in self.tasks:
@@ -96,6 +113,29 @@ class VideoFrameConsumer(AsyncWebsocketConsumer):
         except Exception as e:
             print(f"Error clearing frames on disconnect: {e}")
 
+        try:
+            await self.flush_rollup(force=True)
+        except Exception as e:
+            print(f"Error flushing rollup on disconnect: {e}")
+
+        try:
+            if hasattr(self, 'live_counters'):
+                await self.live_counters.clear()
+        except Exception as e:
+            print(f"Error clearing live counters on disconnect: {e}")
+
+        try:
+            # The video is finished, pack its rows into the columnar archive
+            await sync_to_async(archive_video)(self.user, self.session_id, self.video_id)
+        except Exception as e:
+            print(f"Error archiving video on disconnect: {e}")
+
+        try:
+            # Session history reads the video's totals from its summary from now on
+            await sync_to_async(summarise_video)(self.user, self.session_id, self.video_id)
+        except Exception as e:
+            print(f"Error summarising video on disconnect: {e}")
+
         await self.close()
 
     async def receive(self, text_data):
@@ -134,7 +174,7 @@ class VideoFrameConsumer(AsyncWebsocketConsumer):
 
     async def process_reading_frame(self, frame_data, timestamp, x_coordinate_px, y_coordinate_px, reading_mode, wpm):
         try:
-            from eye_processing.models import SimpleEyeMetrics, UserSession
+            from eye_processing.models import SimpleEyeMetrics, UserSession, MovementType
 
             # Decode the incoming frame
             image_data = base64.b64decode(frame_data.split(',')[1])
@@ -173,6 +213,8 @@ class VideoFrameConsumer(AsyncWebsocketConsumer):
                 wpm=wpm
             )
             await sync_to_async(eye_metrics.save)()
+            self.rollup.add_frame(session_id, timestamp_dt, wpm)
+            self.live_counters.add_frame(as_utc(timestamp_dt).timestamp(), reading_mode, wpm)  # Same clock as the stored timestamps
 
             # Get past frames within time_window * 2
             start_time = timestamp_dt - timedelta(seconds=TIME_WINDOW * 2)
@@ -220,7 +262,10 @@ class VideoFrameConsumer(AsyncWebsocketConsumer):
                         blink_detected = False
 
                     if middle_frame is not None:
-                        face_detected, normalised_eye_speed, yaw, pitch, roll, left_centre, right_centre, focus, left_iris_velocity, right_iris_velocity, movement_type, _ = process_eye(middle_frame, middle_frame_entry.timestamp, blink_detected)
+                        face_detected, normalised_eye_speed, yaw, pitch, roll, left_centre, right_centre, focus, left_iris_velocity, right_iris_velocity, movement_type, _ = self.pipeline.process_eye(middle_frame, middle_frame_entry.timestamp, blink_detected, ear=middle_frame_entry.eye_aspect_ratio)
+
+                        left_centre_x, left_centre_y = left_centre if left_centre is not None else (None, None)
+                        right_centre_x, right_centre_y = right_centre if right_centre is not None else (None, None)
 
                         # Update database for the middle frame
                         await sync_to_async(SimpleEyeMetrics.objects.filter(
@@ -233,14 +278,18 @@ class VideoFrameConsumer(AsyncWebsocketConsumer):
                             face_yaw=yaw,
                             face_roll=roll,
                             face_pitch=pitch,
-                            left_centre=left_centre,
-                            right_centre=right_centre,
+                            left_centre_x=left_centre_x,
+                            left_centre_y=left_centre_y,
+                            right_centre_x=right_centre_x,
+                            right_centre_y=right_centre_y,
                             focus=focus,
                             left_iris_velocity=left_iris_velocity,
                             right_iris_velocity=right_iris_velocity,
-                            movement_type=movement_type,
+                            movement_type=MovementType[movement_type.upper()],  # "None", "fixation" or "saccade"
                             blink_detected=blink_detected
                         )
+                        self.rollup.add_result(session_id, middle_frame_entry.timestamp, focus, face_detected, blink_detected)
+                        self.live_counters.add_result(middle_frame_entry.timestamp.timestamp(), focus, face_detected, blink_detected)
 
                         # Cleanup: Delete old frames outside of time_window * 2
                         await sync_to_async(lambda: SimpleEyeMetrics.objects.filter(
@@ -250,9 +299,30 @@ class VideoFrameConsumer(AsyncWebsocketConsumer):
                             timestamp__lt=start_time
                         ).update(frame=None))()
 
+            await self.flush_rollup()
+            await self.live_counters.publish()
+            await self.push_metrics()
+
         except (base64.binascii.Error, UnidentifiedImageError) as e:
             print("Error decoding image:", e)
 
+    async def flush_rollup(self, force=False):
+        if not hasattr(self, 'rollup'):
+            return
+        if force or time.monotonic() - self.rollup_flushed_at >= settings.EYE_ROLLUP_FLUSH_SECONDS:
+            self.rollup_flushed_at = time.monotonic()
+            await sync_to_async(self.rollup.flush)()
+
+    async def push_metrics(self):
+        # Send the metrics that changed since the last push, every EYE_METRICS_PUSH_SECONDS (0 disables)
+        if not settings.EYE_METRICS_PUSH_SECONDS or time.monotonic() - self.metrics_pushed_at < settings.EYE_METRICS_PUSH_SECONDS:
+            return
+        self.metrics_pushed_at = time.monotonic()
+
+        changed = self.live_counters.changed_metrics(settings.EYE_METRICS_WINDOW_SECONDS)
+        if changed:
+            await self.send(text_data=json.dumps({"mode": "metrics", **changed}))
+
     async def process_diagnostic_frame(self, frame_data, timestamp, draw_mesh, draw_contours, show_axis, draw_eye):
         try:
             # Decode the base64-encoded image
@@ -268,7 +338,7 @@ class VideoFrameConsumer(AsyncWebsocketConsumer):
             # face_detected, normalised_eye_speed, yaw, pitch, roll, left_centre, right_centre, focus, left_iris_velocity, right_iris_velocity, movement_type, diagnostic_frame = process_eye(frame, timestamp_dt, blink_detected=False, draw_mesh=draw_mesh, draw_contours=draw_contours, show_axis=show_axis, draw_eye=draw_eye)
 
             # Process EAR values for the current frame in a separate thread
-            task = asyncio.create_task(asyncio.to_thread(process_eye, frame, timestamp_dt, blink_detected=False, draw_mesh=draw_mesh, draw_contours=draw_contours, show_axis=show_axis, draw_eye=draw_eye))  # Add to tasks list
+            task = asyncio.create_task(asyncio.to_thread(self.pipeline.process_eye, frame, timestamp_dt, blink_detected=False, draw_mesh=draw_mesh, draw_contours=draw_contours, show_axis=show_axis, draw_eye=draw_eye))  # Add to tasks list
             self.tasks.append(task)
 
             # Wait for the result from the processing
@@ -1,30 +1,42 @@
 import numpy as np
-from datetime import timedelta
+from datetime import datetime, timedelta, timezone
 
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
-from django.db.models import Max, Min
+from django.conf import settings
+from django.db import connection
+from django.http import StreamingHttpResponse
+from django.db.models import Count, Exists, F, Max, Min, OuterRef, Q, Sum, Window
+from django.db.models.functions import Lag, TruncMinute
 from django.utils.timezone import now
 
-from .models import SimpleEyeMetrics, UserSession
+from .archive import load_archived_columns, load_video_columns
+from .export import EXPORT_COLUMNS, EXPORT_FORMATS, csv_lines, export_rows, ndjson_lines
+from .live import window_counts
+from .models import EyeMetricsMinute, SimpleEyeMetrics, UserSession, VideoSummary
+from .response_cache import cached_response
+from .rollups import blinks_per_minute, minute_of
+from .summaries import isoformat_utc, words_read
 
 class RetrieveLastBlinkRateView(APIView):
 
     permission_classes = [IsAuthenticated]  # Ensure the user is authenticated
     
+    @cached_response()
     def get(self, request, *args, **kwargs):
 
         # Filter by user to retrieve the latest session ID and video ID
         current_session_id = SimpleEyeMetrics.objects.filter(user=request.user).aggregate(Max('session_id'))['session_id__max']
         latest_video_id = SimpleEyeMetrics.objects.filter(user=request.user, session_id=current_session_id).aggregate(Max('video_id'))['video_id__max']
         
-        # Retrieve blink timestamps for blink rate calculation
-        blink_records = SimpleEyeMetrics.objects.filter(
+        # Blinks per minute from the rollup, videos recorded before the rollup existed are counted from the frames
+        blink_rate = list(EyeMetricsMinute.objects.filter(
             user=request.user, session_id=current_session_id, video_id=latest_video_id
-        ).order_by('timestamp')
+        ).order_by('minute').values_list('blinks', flat=True))
 
-        blink_rate = self.calculate_blink_rate(blink_records)
+        if not blink_rate:
+            blink_rate = self.calculate_blink_rate(request.user, current_session_id, latest_video_id)
 
         # Only send blink_rate
         data = {
@@ -33,180 +45,153 @@ class RetrieveLastBlinkRateView(APIView):
         
         return Response(data, status=200)
     
-    def calculate_blink_rate(self, blink_timestamps):
+    def calculate_blink_rate(self, user, session_id, video_id):
         """
         Calculate blink rate per minute from blink timestamps.
-        Treats consecutive 1s as one blink until there is a 0.
+        Treats consecutive 1s as one blink until there is a 0, counted in the minute it starts.
         """
-        if not blink_timestamps.exists():
-            return []
+        archived = load_archived_columns(user, session_id, video_id, ['timestamp', 'blink_detected'])
+        if archived is not None:
+            return blinks_per_minute(archived['timestamp'], archived['blink_detected'])
 
-        # Extract blink counts (0 or 1) per frame from the database
-        blink_counts = [entry.blink_count for entry in blink_timestamps]
-        
-        # Initialize variables
-        blink_rates = []  # Store the number of blinks per minute
-        blink_in_progress = False  # Flag to track ongoing blink
-        current_blink_count = 0  # Count of blinks in the current minute
-
-        start_time = blink_timestamps[0].timestamp
-        end_time = blink_timestamps[-1].timestamp
-
-        current_time = start_time
-        minute_blink_count = 0
-
-        # Loop through each timestamp and calculate blink rate
-        for index, blink in enumerate(blink_counts):
-            if blink == 1: 
-                if not blink_in_progress:  
-                    minute_blink_count += 1 
-                    blink_in_progress = True
-            else:  # Blink ended (0 detected)
-                blink_in_progress = False  # Reset the blink flag
-
-            # Check if the minute has passed (based on timestamp)
-            if blink_timestamps[index].timestamp >= current_time + timedelta(minutes=1):
-                # Store the blink rate for the last minute
-                blink_rates.append(minute_blink_count)
-                # Move to the next minute
-                current_time = current_time + timedelta(minutes=1)
-                minute_blink_count = 0  # Reset for the new minute
-
-        # Make sure the last minute is added if there are remaining blinks
-        if minute_blink_count > 0:
-            blink_rates.append(minute_blink_count)
-
-        return blink_rates
+        # Rising edges with LAG() and minute buckets in the database, only the per-minute counts come back
+        frames = SimpleEyeMetrics.objects.filter(
+            user=user, session_id=session_id, video_id=video_id
+        ).annotate(
+            minute=TruncMinute('timestamp'),
+            previous_blink=Window(Lag('blink_detected'), order_by=F('timestamp').asc()),
+        ).values('minute', 'blink_detected', 'previous_blink')
+
+        frames_sql, params = frames.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(f"""
+                SELECT SUM(CASE WHEN blink_detected = 1 AND (previous_blink IS NULL OR previous_blink <> 1) THEN 1 ELSE 0 END)
+                FROM ({frames_sql}) frames
+                GROUP BY minute
+                ORDER BY minute
+            """, params)
+            return [blinks for (blinks,) in cursor.fetchall()]
     
 class RetrieveAllUserSessionsView(APIView):
     permission_classes = [IsAuthenticated]  # Ensure the user is authenticated
 
+    @cached_response()
     def get(self, request, *args, **kwargs):
         # Retrieve all sessions for the authenticated user
-        user_sessions = UserSession.objects.filter(user=request.user)
+        user_sessions = list(UserSession.objects.filter(user=request.user))
 
-        if not user_sessions.exists():
+        if not user_sessions:
             return Response({"error": "No sessions found for this user."}, status=404)
 
+        # Finished videos come from their summaries, videos still being recorded from the rollup
+        videos_by_session = self.calculate_video_times(request.user)
+
         # Prepare session data
         sessions_data = []
         for session in user_sessions:
-            total_reading_time, total_focus_time = self.calculate_total_session_times(request.user, session.session_id)
-
-
-            # Get reading times for each video in this session
-            video_reading_times = SimpleEyeMetrics.objects.filter(
-                user=request.user, session_id=session.session_id
-            ).values('video_id').distinct()
-
-            # Format video reading times
-            video_data = [
-                {
-                    "video_id": video["video_id"],
-                    "total_reading_time": self.calculate_reading_time(request.user, session.session_id, video["video_id"]),
-                    "total_focus_time": self.calculate_focus_time(request.user, session.session_id, video["video_id"]),
-                }
-                for video in video_reading_times
-            ]
+            video_data = videos_by_session.get(session.session_id, [])
 
             # Add session details to the response
             sessions_data.append({
                 "session_id": session.session_id,
-                "total_reading_time": total_reading_time,
-                "total_focus_time": total_focus_time,
+                "total_reading_time": sum((video["total_reading_time"] for video in video_data), timedelta(0)),
+                "total_focus_time": sum((video["total_focus_time"] for video in video_data), timedelta(0)),
                 "videos": video_data,
             })
 
         # Return all sessions data
         return Response({"sessions": sessions_data}, status=200)
 
-    def calculate_reading_time(self, user, session_id, video_id):
-        # Get the earliest and latest timestamps for the session and video
-        timestamps = SimpleEyeMetrics.objects.filter(
-            user=user,
-            session_id=session_id,
-            video_id=video_id
-        ).aggregate(
+    def calculate_video_times(self, user):
+        summaries = VideoSummary.objects.filter(user=user)
+        times = {
+            (session_id, video_id): (reading_time, focus_time)
+            for session_id, video_id, reading_time, focus_time in summaries.values_list('session_id', 'video_id', 'reading_time', 'focus_time')
+        }
+
+        # Videos without a summary (still recording, or not summarised after a restart or failure) from their minute rollup
+        live_minutes = EyeMetricsMinute.objects.filter(user=user).exclude(
+            Exists(summaries.filter(session_id=OuterRef('session_id'), video_id=OuterRef('video_id')))
+        )
+
+        videos = live_minutes.values('session_id', 'video_id').annotate(
+            start_time=Min('first_timestamp'),
+            end_time=Max('last_timestamp'),
+            total_records=Sum('frames'),
+            focus_records=Sum('focus_frames'),
+        )
+        # Videos recorded before summaries and rollups existed, from their frames
+        old_frames = SimpleEyeMetrics.objects.filter(user=user).exclude(
+            Exists(summaries.filter(session_id=OuterRef('session_id'), video_id=OuterRef('video_id')))
+        ).exclude(
+            Exists(EyeMetricsMinute.objects.filter(user=user, session_id=OuterRef('session_id'), video_id=OuterRef('video_id')))
+        )
+        old_videos = old_frames.values('session_id', 'video_id').annotate(
             start_time=Min('timestamp'),
-            end_time=Max('timestamp')
+            end_time=Max('timestamp'),
+            total_records=Count('id'),
+            focus_records=Count('id', filter=Q(focus=True)),
         )
 
-        # Calculate the reading time
-        start_time = timestamps['start_time']
-        end_time = timestamps['end_time']
+        for video in [*videos, *old_videos]:
+            times.setdefault((video['session_id'], video['video_id']), (self.calculate_reading_time(video), self.calculate_focus_time(video)))
+
+        videos_by_session = {}
+        for (session_id, video_id), (reading_time, focus_time) in sorted(times.items()):
+            videos_by_session.setdefault(session_id, []).append({
+                "video_id": video_id,
+                "total_reading_time": reading_time,
+                "total_focus_time": focus_time,
+            })
+        return videos_by_session
+
+    def calculate_reading_time(self, video):
+        # Time between the earliest and latest frames of the video
+        start_time = video['start_time']
+        end_time = video['end_time']
 
         return (end_time - start_time) if start_time and end_time else timedelta(0)
     
-    def calculate_focus_time(self, user, session_id, video_id):
-        reading_time = self.calculate_reading_time(user, session_id, video_id)
-
-        total_records = SimpleEyeMetrics.objects.filter(
-            user=user, session_id=session_id, video_id=video_id
-        ).count()
+    def calculate_focus_time(self, video):
+        total_records = video['total_records'] or 0
 
         if total_records == 0:
             return timedelta(0)
 
-        focus_records = SimpleEyeMetrics.objects.filter(
-            user=user, session_id=session_id, video_id=video_id, focus=True
-        ).count()
-
-        focus_percentage = (focus_records / total_records) if total_records > 0 else 0 
+        focus_percentage = (video['focus_records'] or 0) / total_records
     
-        return reading_time * focus_percentage
-
-    def calculate_total_session_times(self, user, session_id):
-        video_ids = SimpleEyeMetrics.objects.filter(
-            user=user, session_id=session_id
-        ).values_list('video_id', flat=True).distinct()
-
-        total_reading_time = timedelta(0)
-        weighted_focus_time = timedelta(0)
-
-        for video_id in video_ids:
-            video_reading_time = self.calculate_reading_time(user, session_id, video_id)
-            video_focus_time = self.calculate_focus_time(user, session_id, video_id)
-
-            total_reading_time += video_reading_time
-            weighted_focus_time += video_focus_time
-
-        return total_reading_time, weighted_focus_time
+        return self.calculate_reading_time(video) * focus_percentage
     
 class RetrieveBreakCheckView(APIView):
 
     permission_classes = [IsAuthenticated]  # Ensure the user is authenticated
     
+    @cached_response(bucket_seconds=settings.EYE_BREAK_CHECK_CACHE_SECONDS)  # The time window moves with the clock
     def get(self, request, *args, **kwargs):
 
         time_limit = float(request.query_params.get('time_limit', 1))  # Default to 1 minute
 
-        # Filter by user to retrieve the latest session ID and video ID
-        current_session_id = SimpleEyeMetrics.objects.filter(user=request.user).aggregate(Max('session_id'))['session_id__max']
-        latest_video_id = SimpleEyeMetrics.objects.filter(user=request.user, session_id=current_session_id).aggregate(Max('video_id'))['video_id__max']
-        if current_session_id is None or latest_video_id is None:
-            return Response({"error": "No session or video data found."}, status=400)
-
-        # Define the time window
-        time_window = now() - timedelta(minutes=time_limit)
-
-        # Retrieve data for the last time window 
-        records = SimpleEyeMetrics.objects.filter(
-            user=request.user, 
-            session_id=current_session_id, 
-            video_id=latest_video_id, 
-            timestamp__gte=time_window
-        )
-
-        total_records = records.count()
+        # A live stream answers from its counters in the cache, otherwise count the stored frames
+        counts = window_counts(request.user.id, time_limit * 60)
+        if counts is not None:
+            total_records, focus_true_count, face_detected_true_count, latest_frame = counts
+            latest_frame = datetime.fromtimestamp(latest_frame, tz=timezone.utc)
+        else:
+            # Filter by user to retrieve the latest session ID and video ID
+            current_session_id = SimpleEyeMetrics.objects.filter(user=request.user).aggregate(Max('session_id'))['session_id__max']
+            latest_video_id = SimpleEyeMetrics.objects.filter(user=request.user, session_id=current_session_id).aggregate(Max('video_id'))['video_id__max']
+            if current_session_id is None or latest_video_id is None:
+                return Response({"error": "No session or video data found."}, status=400)
+
+            total_records, focus_true_count, face_detected_true_count, latest_frame = self.count_window_records(
+                request.user, current_session_id, latest_video_id, time_limit
+            )
 
         # Check if we have enough data to determine focus and face detection levels in time window
         if total_records < (time_limit * 60):
-            return Response({"status": f"insufficient_data, found {total_records} records, current time: {now()} ... latest frame: {SimpleEyeMetrics.objects.order_by('timestamp').last().timestamp}"}, status=200)
+            return Response({"status": f"insufficient_data, found {total_records} records, current time: {now()} ... latest frame: {latest_frame}"}, status=200)
 
         # Calculate the percentage of True values for focus and face_detected
-        focus_true_count = records.filter(focus=True).count()
-        face_detected_true_count = records.filter(face_detected=True).count()
-
         focus_percentage = (focus_true_count / total_records) * 100
         face_detected_percentage = (face_detected_true_count / total_records) * 100
 
@@ -220,11 +205,48 @@ class RetrieveBreakCheckView(APIView):
         }
 
         return Response(data, status=200)
+
+    def count_window_records(self, user, session_id, video_id, time_limit):
+        # Define the time window
+        time_window = now() - timedelta(minutes=time_limit)
+
+        # Whole minutes of the window come from the rollup, only the partial first minute from the frames
+        first_full_minute = minute_of(time_window) + timedelta(minutes=1)
+        minutes = EyeMetricsMinute.objects.filter(
+            user=user,
+            session_id=session_id,
+            video_id=video_id,
+            minute__gte=first_full_minute
+        ).aggregate(total=Sum('frames'), focus=Sum('focus_frames'), face_detected=Sum('face_frames'), latest_frame=Max('last_timestamp'))
+
+        # Retrieve data for the start of the time window 
+        records = SimpleEyeMetrics.objects.filter(
+            user=user, 
+            session_id=session_id, 
+            video_id=video_id, 
+            timestamp__gte=time_window,
+            timestamp__lt=first_full_minute
+        ).aggregate(total=Count('id'), focus=Count('id', filter=Q(focus=True)), face_detected=Count('id', filter=Q(face_detected=True)))
+
+        return (
+            (minutes['total'] or 0) + records['total'],
+            (minutes['focus'] or 0) + records['focus'],
+            (minutes['face_detected'] or 0) + records['face_detected'],
+            minutes['latest_frame'],
+        )
     
 class RetrieveReadingSpeedView(APIView):
     permission_classes = [IsAuthenticated]  # Ensure the user is authenticated
 
+    @cached_response()
     def get(self, request, *args, **kwargs):
+        # Optional cap on the number of points in reading_speed_over_time
+        max_points = request.query_params.get('max_points')
+        if max_points is not None:
+            if not max_points.isdigit() or int(max_points) < 1:
+                return Response({"error": "max_points must be a positive integer."}, status=400)
+            max_points = int(max_points)
+
         # Get latest session and video ID
         current_session_id = SimpleEyeMetrics.objects.filter(user=request.user).aggregate(Max('session_id'))['session_id__max']
         latest_video_id = SimpleEyeMetrics.objects.filter(user=request.user, session_id=current_session_id).aggregate(Max('video_id'))['video_id__max']
@@ -232,15 +254,11 @@ class RetrieveReadingSpeedView(APIView):
         if current_session_id is None or latest_video_id is None:
             return Response({"error": "No session or video data found."}, status=400)
 
-        # Fetch relevant reading records (only modes 2, 3, 4)
-        reading_records = SimpleEyeMetrics.objects.filter(
-            user=request.user,
-            session_id=current_session_id,
-            video_id=latest_video_id,
-            reading_mode__in=[2, 3, 4]
-        ).order_by("timestamp")
+        # Fetch relevant reading records (only modes 2, 3, 4), from the archive once the video has finished
+        columns = load_video_columns(request.user, current_session_id, latest_video_id, ['timestamp', 'wpm', 'reading_mode'])
+        reading = np.isin(columns['reading_mode'], [2, 3, 4])
 
-        if not reading_records.exists():
+        if not reading.any():
             return Response({
                 "total_words_read": None,
                 "average_wpm": None,
@@ -248,36 +266,67 @@ class RetrieveReadingSpeedView(APIView):
             }, status=200)
 
         # Calculate reading speed metrics
-        reading_speed_metrics = self.calculate_reading_speed_metrics(reading_records)
+        reading_speed_metrics = self.calculate_reading_speed_metrics(columns['timestamp'][reading], columns['wpm'][reading], max_points)
 
         return Response(reading_speed_metrics, status=200)
 
-    def calculate_reading_speed_metrics(self, reading_records):
-        total_words_read = 0
-        reading_speed_over_time = []
-        total_wpm = []
-        prev_timestamp = None
+    def calculate_reading_speed_metrics(self, timestamps, wpm, max_points=None):
+        total_words_read = words_read(timestamps, wpm)
 
-        for record in reading_records:
-            if record.wpm is not None:
-                total_wpm.append(record.wpm)
+        points_timestamps, points_wpm = timestamps[1:], wpm[1:]
+        if max_points is not None and len(points_wpm) > max_points:
+            points_timestamps, points_wpm = self.downsample(points_timestamps, points_wpm, max_points)
 
-                if prev_timestamp:
-                    time_diff = (record.timestamp - prev_timestamp).total_seconds() / 60  # Convert to minutes
-                    words_read = record.wpm * time_diff
-                    total_words_read += words_read
+        reading_speed_over_time = [
+            {"timestamp": timestamp, "wpm": speed}
+            for timestamp, speed in zip(isoformat_utc(points_timestamps), points_wpm.tolist())
+        ]
 
-                    reading_speed_over_time.append({
-                        "timestamp": record.timestamp.isoformat(),
-                        "wpm": record.wpm
-                    })
-
-                prev_timestamp = record.timestamp
-
-        avg_wpm = np.mean(total_wpm) if total_wpm else None
+        avg_wpm = np.mean(wpm) if len(wpm) else None
 
         return {
             "total_words_read": round(total_words_read, 2),
             "average_wpm": round(avg_wpm, 2) if avg_wpm is not None else None,
             "reading_speed_over_time": reading_speed_over_time
-        }
\ No newline at end of file
+        }
+
+    def downsample(self, timestamps, wpm, max_points):
+        # Bucket average: max_points buckets of (almost) equal size, each one point at its mean time and speed
+        bounds = np.linspace(0, len(wpm), max_points + 1).astype(np.int64)[:-1]
+        sizes = np.diff(np.append(bounds, len(wpm)))
+
+        microseconds = timestamps.astype('datetime64[us]').astype(np.int64)
+        offsets = np.add.reduceat(microseconds - microseconds[0], bounds) // sizes
+        mean_timestamps = (microseconds[0] + offsets).astype('datetime64[us]')
+        mean_wpm = np.round(np.add.reduceat(wpm.astype(np.float64), bounds) / sizes, 2)
+
+        return mean_timestamps, mean_wpm
+
+class ExportSessionMetricsView(APIView):
+    permission_classes = [IsAuthenticated]  # Ensure the user is authenticated
+
+    def get(self, request, *args, **kwargs):
+        # `format` is taken by DRF's format suffixes, so the output format is `export_format`
+        session_id = request.query_params.get('session_id')
+        video_id = request.query_params.get('video_id')
+        export_format = request.query_params.get('export_format', 'ndjson')
+        columns = request.query_params.get('columns')
+
+        if session_id is None or not session_id.isdigit() or (video_id is not None and not video_id.isdigit()):
+            return Response({"error": "session_id (and video_id if given) must be integers."}, status=400)
+        if export_format not in EXPORT_FORMATS:
+            return Response({"error": f"export_format must be one of: {', '.join(EXPORT_FORMATS)}."}, status=400)
+
+        # Optional projection, e.g. columns=timestamp,focus,wpm
+        columns = columns.split(',') if columns else EXPORT_COLUMNS
+        unknown = [column for column in columns if column not in EXPORT_COLUMNS]
+        if unknown:
+            return Response({"error": f"Unknown columns: {', '.join(unknown)}. Available: {', '.join(EXPORT_COLUMNS)}."}, status=400)
+
+        rows = export_rows(request.user, int(session_id), int(video_id) if video_id is not None else None, columns)
+        lines = ndjson_lines(rows, columns) if export_format == 'ndjson' else csv_lines(rows, columns)
+
+        filename = f"session-{session_id}" + (f"-video-{video_id}" if video_id is not None else "") + f".{export_format}"
+        response = StreamingHttpResponse(lines, content_type=EXPORT_FORMATS[export_format])
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
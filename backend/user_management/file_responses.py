@@ -0,0 +1,103 @@
+"""
+Document downloads with conditional requests and byte ranges.
+
+document_response answers If-None-Match / If-Modified-Since with 304 and a single
+`Range: bytes=...` with 206, so a reader re-opening a document or fetching only some
+of its pages does not download the whole file again. Bodies are FileResponses of the
+open file (a FileRange for 206), which WSGI servers with wsgi.file_wrapper (e.g.
+gunicorn) send with sendfile() instead of copying through Python.
+"""
+import io
+import os
+import re
+
+from django.http import FileResponse, HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_http_date_safe
+
+RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+class FileRange:
+    """
+    Part of an open file for FileResponse. Reads stop at the end of the range, while
+    positions stay those of the underlying file so sendfile() starts at the right offset.
+    """
+    def __init__(self, file, start, length):
+        self.file = file
+        self.end = start + length
+        self.file.seek(start)
+
+    def read(self, size=-1):
+        remaining = max(self.end - self.file.tell(), 0)
+        return self.file.read(remaining if size is None or size < 0 else min(size, remaining))
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_END:
+            return self.file.seek(self.end + offset)
+        return self.file.seek(offset, whence)
+
+    def tell(self):
+        return self.file.tell()
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def close(self):
+        self.file.close()
+
+def parse_range(header, size):
+    """
+    (start, length) of a single byte range, None to send the whole file (no or
+    unsupported Range header) and False when the range cannot be satisfied.
+    """
+    match = RANGE.match(header.replace(' ', '')) if header else None
+    if not match or match.groups() == ('', ''):
+        return None
+    first, last = match.groups()
+    if first == '':
+        # Suffix range: the last N bytes
+        length = min(int(last), size)
+        return (size - length, length) if length > 0 else False
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or end < start:
+        return False
+    return start, end - start + 1
+
+def range_matches(request, etag, last_modified):
+    # If-Range: only send part of the file when the client's copy is still current
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if not if_range:
+        return True
+    if if_range.startswith('"'):
+        return if_range == etag
+    return parse_http_date_safe(if_range) == last_modified
+
+def document_response(request, path, filename, etag, headers=None):
+    """
+    Response for downloading the file at `path` as `filename`, with `etag` (the quoted
+    content hash) and the file's mtime as validators. `headers` are added to every
+    response, including 304 and 206 ones.
+    """
+    size = os.path.getsize(path)
+    last_modified = int(os.path.getmtime(path))
+
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        byte_range = parse_range(request.META.get('HTTP_RANGE'), size) if range_matches(request, etag, last_modified) else None
+        if byte_range is False:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+        elif byte_range is None:
+            response = FileResponse(open(path, 'rb'), as_attachment=True, filename=filename)
+        else:
+            start, length = byte_range
+            response = FileResponse(FileRange(open(path, 'rb'), start, length), as_attachment=True, filename=filename, status=206)
+            response['Content-Range'] = f'bytes {start}-{start + length - 1}/{size}'
+
+    response['Accept-Ranges'] = 'bytes'
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    for name, value in (headers or {}).items():
+        response[name] = value
+    return response
@@ -0,0 +1,12 @@
+"""
+Entry points of the run_document_jobs worker processes. Workers are spawned, so this
+module is imported before Django is set up and only loads the models once it is.
+"""
+import django
+
+def setup_worker():
+    django.setup()
+
+def run_job(job_id):
+    from .jobs import execute
+    return execute(job_id)
@@ -0,0 +1,73 @@
+"""
+Database-backed queue for heavy document work.
+
+Requests only add a DocumentJob row (enqueue) and return. The run_document_jobs
+management command claims pending jobs and runs them in a pool of worker processes,
+so PDF rasterisation and text layout never block a request thread and no external
+broker is needed: `python manage.py run_document_jobs` next to the server is enough.
+"""
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import DocumentJob
+
+ACTIVE = [DocumentJob.Status.PENDING, DocumentJob.Status.RUNNING]
+
+def render_preview(document):
+    if document.update_preview() is None:
+        raise RuntimeError(f"Could not render a preview of {document.file_object.name}")
+
+HANDLERS = {
+    DocumentJob.Kind.PREVIEW: render_preview,
+}
+
+def enqueue(document, kind):
+    # One active job per stored file and kind is enough, it updates every document sharing the file
+    job = DocumentJob.objects.filter(document__file_object=document.file_object.name, kind=kind, status__in=ACTIVE).first()
+    if job is None:
+        job = DocumentJob.objects.create(document=document, kind=kind)
+    return job
+
+def claim_jobs(limit=1):
+    """
+    Mark up to `limit` of the oldest pending jobs as running and return their ids.
+    On PostgreSQL concurrent workers skip each other's locked rows.
+    """
+    with transaction.atomic():
+        jobs = DocumentJob.objects.filter(status=DocumentJob.Status.PENDING)
+        if connection.features.has_select_for_update_skip_locked:
+            jobs = jobs.select_for_update(skip_locked=True)
+        ids = list(jobs.order_by('created_at', 'id').values_list('id', flat=True)[:limit])
+
+        DocumentJob.objects.filter(id__in=ids).update(status=DocumentJob.Status.RUNNING, started_at=timezone.now(), attempts=F('attempts') + 1)
+    return ids
+
+def execute(job_id):
+    # Run one job, in a worker process. Returns the error message or None
+    try:
+        job = DocumentJob.objects.select_related('document').get(id=job_id)
+        HANDLERS[job.kind](job.document)
+        return None
+    except Exception as e:
+        return f"{type(e).__name__}: {e}"
+
+def finish_job(job_id, error=None):
+    # Failed jobs go back to the queue until they used DOCUMENT_JOB_MAX_ATTEMPTS
+    job = DocumentJob.objects.filter(id=job_id).first()
+    if job is None:  # The document was deleted meanwhile
+        return
+    if error is None:
+        job.status = DocumentJob.Status.DONE
+    elif job.attempts < settings.DOCUMENT_JOB_MAX_ATTEMPTS:
+        job.status = DocumentJob.Status.PENDING
+    else:
+        job.status = DocumentJob.Status.FAILED
+    job.error = error
+    job.finished_at = timezone.now()
+    job.save(update_fields=['status', 'error', 'finished_at'])
+
+def requeue_stale_jobs(started_before):
+    # Jobs left running by a worker that died
+    return DocumentJob.objects.filter(status=DocumentJob.Status.RUNNING, started_at__lt=started_before).update(status=DocumentJob.Status.PENDING)
\ No newline at end of file
@@ -0,0 +1,17 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from user_management.uploads import expire_uploads
+
+class Command(BaseCommand):
+    help = "Remove chunked document uploads that were started but not completed, with their part files."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hours', type=float, default=settings.DOCUMENT_UPLOAD_EXPIRY_HOURS, help="Remove uploads idle for longer than this")
+
+    def handle(self, *args, **options):
+        expired = expire_uploads(timezone.now() - timedelta(hours=options['hours']))
+        self.stdout.write(self.style.SUCCESS(f"Removed {expired} expired upload(s)"))
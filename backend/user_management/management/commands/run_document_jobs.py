@@ -0,0 +1,64 @@
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from user_management.job_worker import run_job, setup_worker
+from user_management.jobs import claim_jobs, finish_job, requeue_stale_jobs
+from user_management.uploads import expire_uploads
+
+# How often the worker removes abandoned chunked uploads
+EXPIRE_UPLOADS_SECONDS = 3600
+
+class Command(BaseCommand):
+    help = "Run queued document jobs (preview rendering, ...) in a pool of worker processes."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=settings.DOCUMENT_JOB_WORKERS, help="Worker processes, 0 runs the jobs in this process")
+        parser.add_argument('--poll-seconds', type=float, default=1.0, help="Wait between checks of an empty queue")
+        parser.add_argument('--stale-minutes', type=int, default=10, help="Requeue jobs that have been running for longer than this")
+        parser.add_argument('--once', action='store_true', help="Exit once the queue is empty")
+
+    def handle(self, *args, **options):
+        workers = options['workers']
+        requeued = requeue_stale_jobs(timezone.now() - timedelta(minutes=options['stale_minutes']))
+        if requeued:
+            self.stdout.write(f"Requeued {requeued} stale job(s)")
+
+        # Spawned workers set Django up themselves instead of sharing this process's database connection
+        pool = None
+        if workers > 0:
+            pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'), initializer=setup_worker)
+
+        processed = 0
+        uploads_expired_at = None
+        try:
+            while True:
+                if uploads_expired_at is None or time.monotonic() - uploads_expired_at > EXPIRE_UPLOADS_SECONDS:
+                    expire_uploads(timezone.now() - timedelta(hours=settings.DOCUMENT_UPLOAD_EXPIRY_HOURS))
+                    uploads_expired_at = time.monotonic()
+
+                job_ids = claim_jobs(limit=max(workers, 1))
+                if not job_ids:
+                    if options['once']:
+                        break
+                    time.sleep(options['poll_seconds'])
+                    continue
+
+                errors = pool.map(run_job, job_ids) if pool else map(run_job, job_ids)
+                for job_id, error in zip(job_ids, errors):
+                    finish_job(job_id, error)
+                    if error:
+                        self.stderr.write(f"Job {job_id} failed: {error}")
+                processed += len(job_ids)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if pool:
+                pool.shutdown()
+
+        self.stdout.write(self.style.SUCCESS(f"Processed {processed} job(s)"))
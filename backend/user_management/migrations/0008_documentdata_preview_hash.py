@@ -0,0 +1,18 @@
+# Generated by Django 5.1.2 on 2026-10-19 08:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user_management', '0007_documentdata_preview_path'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='documentdata',
+            name='preview_hash',
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.1.2 on 2026-10-19 08:21
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user_management', '0010_documentdata_content_hash'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='documentdata',
+            index=models.Index(fields=['file_object'], name='documentdata_file_idx'),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 5.1.2 on 2026-10-19 16:20
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user_management', '0012_documentupload'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='documentupload',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+    ]
@@ -1,3 +1,4 @@
+import hashlib
 import uuid
 import os 
 from PIL import Image, ImageDraw, ImageFont, ImageOps
@@ -15,6 +16,13 @@ def get_unique_file_path(instance, filename):
     unique_filename = f"{uuid.uuid4()}.{ext}"
     return os.path.join('documents', unique_filename)
 
+def hash_chunks(chunks):
+    # SHA-256 of a file read in chunks, without holding all of it in memory
+    digest = hashlib.sha256()
+    for chunk in chunks:
+        digest.update(chunk)
+    return digest.hexdigest()
+
 class CalibrationData(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     created_at = models.DateTimeField(auto_now_add=True)
@@ -32,6 +40,9 @@ class DocumentData(models.Model):
     line_number = models.IntegerField(null=True, blank=True)
     page_number = models.IntegerField(null=True, blank=True)
     favourite = models.BooleanField(default=False)  # Track favorite status
+    preview_path = models.CharField(max_length=255, null=True, blank=True)  # Preview JPEG relative to MEDIA_ROOT, rendered on save
+    preview_hash = models.CharField(max_length=64, null=True, blank=True)  # SHA-256 of the preview JPEG, its ETag and cache key
+    content_hash = models.CharField(max_length=64, null=True, blank=True)  # SHA-256 of the document file, its ETag
 
     def generate_preview(self):
         try:
@@ -157,15 +168,85 @@ class DocumentData(models.Model):
                 img = cropped_img.resize((target_width, target_height), Image.Resampling.LANCZOS)
 
             img.save(preview_path)
-            return os.path.join("media", "documents", preview_filename).replace("\\", "/")
+            return os.path.join("documents", preview_filename).replace("\\", "/")
 
         except Exception as e:
             print(f"Error generating preview: {e}")
             return None
         
+    def update_preview(self):
+        # Render the preview of the current file once, for every document sharing the file
+        self.preview_path = self.generate_preview()
+        self.preview_hash = None
+        if self.preview_path:
+            with open(self.preview_file_path(), 'rb') as preview_file:
+                self.preview_hash = hashlib.sha256(preview_file.read()).hexdigest()
+        DocumentData.objects.filter(file_object=self.file_object.name).update(preview_path=self.preview_path, preview_hash=self.preview_hash)
+        return self.preview_path
+
+    def update_content_hash(self):
+        # Documents saved before content hashes were stored get theirs on first download (stored under a UUID name)
+        with open(self.file_object.path, 'rb') as document_file:
+            self.content_hash = hash_chunks(iter(lambda: document_file.read(1 << 20), b''))
+        self.save(update_fields=['content_hash'])
+        return self.content_hash
+
+    def preview_file_path(self):
+        return os.path.join(settings.MEDIA_ROOT, self.preview_path) if self.preview_path else None
+
+    class Meta:
+        # Documents with the same content share one stored file, counted by file_object
+        indexes = [models.Index(fields=['file_object'], name='documentdata_file_idx')]
+
     def __str__(self):
         return f"DocumentData for {self.user} - {self.file_name} at {self.saved_at} which is a favourite: {self.favourite}"
 
+class DocumentJob(models.Model):
+    # Heavy work on a document (preview rendering, ...) queued by the request and run by the run_document_jobs worker
+    class Kind(models.TextChoices):
+        PREVIEW = 'preview'
+
+    class Status(models.TextChoices):
+        PENDING = 'pending'
+        RUNNING = 'running'
+        DONE = 'done'
+        FAILED = 'failed'
+
+    document = models.ForeignKey(DocumentData, on_delete=models.CASCADE, related_name='jobs')
+    kind = models.CharField(max_length=20, choices=Kind.choices)
+    status = models.CharField(max_length=10, choices=Status.choices, default=Status.PENDING)
+    attempts = models.IntegerField(default=0)
+    error = models.TextField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        # Workers claim the oldest pending jobs
+        indexes = [models.Index(fields=['status', 'created_at'], name='documentjob_status_idx')]
+
+    def __str__(self):
+        return f"DocumentJob {self.kind} for {self.document_id}: {self.status} after {self.attempts} attempt(s)"
+
+class DocumentUpload(models.Model):
+    # Chunked upload in progress: created by init, appended to by PUT chunks, turned into DocumentData on complete
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    file_name = models.CharField(max_length=255)
+    size = models.BigIntegerField()  # Announced by init, complete needs all of it
+    received = models.BigIntegerField(default=0)  # Bytes in the part file, the offset of the next chunk
+    line_number = models.IntegerField(null=True, blank=True)
+    page_number = models.IntegerField(null=True, blank=True)
+    saved_at = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)  # Last chunk, uploads idle for DOCUMENT_UPLOAD_EXPIRY_HOURS are removed
+
+    def part_path(self):
+        return os.path.join(settings.MEDIA_ROOT, 'uploads', f"{self.id}.part")
+
+    def __str__(self):
+        return f"DocumentUpload of {self.file_name} for {self.user}: {self.received}/{self.size} bytes"
+
 class OnboardingData(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     created_at = models.DateTimeField(auto_now_add=True)
@@ -0,0 +1,126 @@
+"""
+Content-addressed document storage.
+
+Uploaded documents are stored once per content, as documents/<sha256>.<ext>, however
+many users upload them and however often. DocumentData rows with the same content
+reference the same file and share its preview. The file and the preview are deleted
+with the last row referencing them (release_document_file), under row locks shared with
+uploads of the same content (lock_references).
+"""
+import hashlib
+import os
+import uuid
+
+from django.core.files.storage import default_storage
+from django.core.files.uploadhandler import FileUploadHandler
+from django.db import transaction
+
+from .jobs import enqueue
+from .models import DocumentData, DocumentJob
+
+class HashingUploadHandler(FileUploadHandler):
+    """
+    First of FILE_UPLOAD_HANDLERS: computes the SHA-256 of each uploaded file while its
+    chunks arrive and passes them on to the handler storing it. The hex digests are
+    left in request.upload_hashes by field name.
+    """
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.digest = hashlib.sha256()
+
+    def receive_data_chunk(self, raw_data, start):
+        self.digest.update(raw_data)
+        return raw_data
+
+    def file_complete(self, file_size):
+        if not hasattr(self.request, 'upload_hashes'):
+            self.request.upload_hashes = {}
+        self.request.upload_hashes[self.field_name] = self.digest.hexdigest()
+        return None
+
+def document_file_name(content_hash, file_name):
+    ext = os.path.splitext(file_name)[1].lower()
+    return os.path.join('documents', f"{content_hash}{ext}").replace("\\", "/")
+
+def lock_references(name):
+    """
+    Lock the DocumentData rows referencing the stored file `name`, in a transaction.
+    Releasing a file locks them before its own row goes, so an upload of the same
+    content waits and then finds the file gone (and writes it again) instead of
+    reusing it just before it is deleted. Returns whether any row references it.
+    """
+    return bool(list(DocumentData.objects.select_for_update().filter(file_object=name).values_list('id', flat=True)))
+
+def store_document(file_object, content_hash):
+    """
+    Name of the stored file with this content, written only if no one uploaded it before.
+    Call with lock_references held so the file cannot be released meanwhile. The first
+    uploads of new content have no rows to lock, so the file is written under a temporary
+    name and renamed over the content name: a simultaneous upload of the same content
+    replaces it with the same bytes instead of getting a suffixed name from the storage.
+    """
+    name = document_file_name(content_hash, file_object.name)
+    if default_storage.exists(name):
+        return name
+
+    temporary_name = default_storage.save(f"{name}.{uuid.uuid4().hex}.part", file_object)
+    try:
+        os.replace(default_storage.path(temporary_name), default_storage.path(name))
+    except OSError:
+        default_storage.delete(temporary_name)
+        raise
+    return name
+
+def release_document_file(name, preview_path=None):
+    """
+    Delete a stored document and its preview once no DocumentData references them any
+    more. Call in the transaction that removed the reference, after lock_references:
+    the file is deleted before the locks are released.
+    """
+    if not name or lock_references(name):
+        return False
+    default_storage.delete(name)
+    if preview_path and not DocumentData.objects.filter(preview_path=preview_path).exists():
+        default_storage.delete(preview_path)
+    return True
+
+def delete_document(document):
+    # Delete the database entry, then the file and its preview unless other documents share them
+    with transaction.atomic():
+        lock_references(document.file_object.name)
+        document.delete()
+        release_document_file(document.file_object.name, document.preview_path)
+
+def save_document(user, file_name, file_object, content_hash, **fields):
+    """
+    Store `file_object` by `content_hash` and create or update the user's document
+    `file_name` for it, with its reading position `fields`. Documents with the same
+    content share the file, and its preview once rendered.
+    """
+    with transaction.atomic():
+        lock_references(document_file_name(content_hash, file_object.name))
+        stored_name = store_document(file_object, content_hash)
+
+        previous = DocumentData.objects.select_for_update().filter(user=user, file_name=file_name).values('file_object', 'preview_path').first()
+        shared = DocumentData.objects.filter(file_object=stored_name).exclude(preview_hash=None).values('preview_path', 'preview_hash').first() or {}
+
+        document, _ = DocumentData.objects.update_or_create(
+            user=user,
+            file_name=file_name,
+            defaults={
+                **fields,
+                'file_object': stored_name,
+                'content_hash': content_hash,
+                'preview_path': shared.get('preview_path'),
+                'preview_hash': shared.get('preview_hash'),  # None until the new preview is rendered
+            },
+        )
+
+        if previous and previous['file_object'] != stored_name:
+            lock_references(previous['file_object'])
+            release_document_file(previous['file_object'], previous['preview_path'])
+
+    # New content, its preview is rendered by the document job worker
+    if not shared:
+        enqueue(document, DocumentJob.Kind.PREVIEW)
+    return document
@@ -1,3 +1,465 @@
-from django.test import TestCase
+import hashlib
+import io
+import os
+import shutil
+import tempfile
+import threading
+from datetime import timedelta
+from io import StringIO
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from .models import DocumentData, DocumentJob, DocumentUpload
+from . import storage, uploads
+from .views import thumbnail_signature
+
+
+class DocumentTestCase(TestCase):
+    # Uploaded documents and previews go to a temporary MEDIA_ROOT
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.media_root = tempfile.mkdtemp()
+        cls.media_override = override_settings(MEDIA_ROOT=cls.media_root)
+        cls.media_override.enable()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.media_override.disable()
+        shutil.rmtree(cls.media_root, ignore_errors=True)
+        super().tearDownClass()
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="reader", password="password")
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def upload(self, file_name="notes.txt", content=b"First line\n\nSecond paragraph of the document"):
+        return self.client.post("/api/user/document-save", {
+            "file_name": file_name,
+            "file_object": SimpleUploadedFile(file_name, content, content_type="text/plain"),
+            "line_number": 0,
+            "page_number": 1,
+            "timestamp": 1735732800000,
+        })
+
+    def run_jobs(self):
+        # In this process, worker processes would not see the test transaction
+        call_command("run_document_jobs", "--once", "--workers", "0", stdout=StringIO(), stderr=StringIO())
+
+
+class DocumentPreviewTests(DocumentTestCase):
+
+    def test_preview_rendered_by_worker(self):
+        self.assertEqual(self.upload().status_code, 201)
+        self.assertIsNone(DocumentData.objects.get(user=self.user).preview_path)
+
+        self.run_jobs()
+        document = DocumentData.objects.get(user=self.user)
+        self.assertEqual(DocumentJob.objects.get().status, DocumentJob.Status.DONE)
+        self.assertTrue(document.preview_path.startswith("documents/"))
+        self.assertTrue(os.path.exists(document.preview_file_path()))
+
+    def test_file_list_does_not_render_previews(self):
+        self.upload()
+        self.run_jobs()
+        with mock.patch.object(DocumentData, "generate_preview") as generate_preview:
+            files = self.client.get("/api/user/file-list/").json()
+        generate_preview.assert_not_called()
+        self.assertEqual(files[0]["name"], "notes.txt")
+        self.assertTrue(files[0]["thumbnailUrl"])
+
+    def test_new_content_replaces_preview(self):
+        self.upload()
+        self.run_jobs()
+        old_preview = DocumentData.objects.get(user=self.user).preview_file_path()
+
+        self.upload(content=b"Rewritten document")
+        self.run_jobs()
+        new_preview = DocumentData.objects.get(user=self.user).preview_file_path()
+        self.assertNotEqual(new_preview, old_preview)
+        self.assertFalse(os.path.exists(old_preview))
+        self.assertTrue(os.path.exists(new_preview))
+
+    def test_placeholder_until_preview_is_ready(self):
+        self.upload()
+        self.assertEqual(self.client.get("/api/user/file-list/").json()[0] | {"lastOpened": None}, {
+            "name": "notes.txt", "thumbnailUrl": None, "thumbnailHash": None, "thumbnailPending": True, "isStarred": False, "lastOpened": None,
+        })
+
+        self.run_jobs()
+        self.assertFalse(self.client.get("/api/user/file-list/").json()[0]["thumbnailPending"])
+
+    def test_documents_without_preview_are_queued_once(self):
+        self.upload()
+        DocumentJob.objects.all().delete()  # Saved before previews were rendered in the background
+
+        self.assertTrue(self.client.get("/api/user/file-list/").json()[0]["thumbnailPending"])
+        self.client.get("/api/user/file-list/")
+        self.assertEqual(DocumentJob.objects.count(), 1)
+
+        self.run_jobs()
+        self.assertIsNotNone(DocumentData.objects.get(user=self.user).preview_hash)
+
+    def test_failing_jobs_are_retried_then_failed(self):
+        self.upload()
+        with mock.patch.object(DocumentData, "generate_preview", return_value=None):
+            self.run_jobs()
+
+        job = DocumentJob.objects.get()
+        self.assertEqual((job.status, job.attempts), (DocumentJob.Status.FAILED, 3))
+        self.assertIn("Could not render a preview", job.error)
+        self.assertFalse(self.client.get("/api/user/file-list/").json()[0]["thumbnailPending"])
+
+
+class DocumentStorageTests(DocumentTestCase):
+    content = b"Reading assignment for the whole class"
+
+    def setUp(self):
+        super().setUp()
+        self.other = APIClient()
+        self.other.force_authenticate(User.objects.create_user(username="classmate", password="password"))
+
+    def test_identical_uploads_share_file_and_preview(self):
+        self.upload(content=self.content)
+        self.upload(file_name="copy.txt", content=self.content)
+        self.other.post("/api/user/document-save", {
+            "file_name": "assignment.txt",
+            "file_object": SimpleUploadedFile("assignment.txt", self.content, content_type="text/plain"),
+            "line_number": 0, "page_number": 1, "timestamp": 1735732800000,
+        })
+
+        documents = DocumentData.objects.all()
+        self.assertEqual({document.file_object.name for document in documents}, {f"documents/{hashlib.sha256(self.content).hexdigest()}.txt"})
+        self.assertEqual(DocumentJob.objects.count(), 1)
+
+        self.run_jobs()
+        self.assertEqual(len({(document.preview_path, document.preview_hash) for document in DocumentData.objects.all()}), 1)
+        self.assertIsNotNone(DocumentData.objects.first().preview_hash)
+
+        # Uploaded once more after the preview exists: nothing to render
+        self.upload(file_name="again.txt", content=self.content)
+        self.assertEqual(DocumentJob.objects.count(), 1)
+        self.assertIsNotNone(DocumentData.objects.get(file_name="again.txt").preview_hash)
+
+    def test_file_deleted_with_last_reference(self):
+        self.upload(content=self.content)
+        self.upload(file_name="copy.txt", content=self.content)
+        self.run_jobs()
+        document = DocumentData.objects.first()
+        file_path, preview_path = document.file_object.path, document.preview_file_path()
+
+        self.client.delete("/api/user/file-delete?file_name=notes.txt")
+        self.assertTrue(os.path.exists(file_path))
+        self.assertTrue(os.path.exists(preview_path))
+
+        self.client.delete("/api/user/file-delete?file_name=copy.txt")
+        self.assertFalse(os.path.exists(file_path))
+        self.assertFalse(os.path.exists(preview_path))
+
+
+class ChunkedUploadTests(DocumentTestCase):
+    content = b"%PDF-1.4\n" + b"page content " * 1000
+
+    def start(self, file_name="book.pdf", size=None):
+        response = self.client.post("/api/user/document-upload", {
+            "file_name": file_name, "size": len(self.content) if size is None else size, "line_number": 3, "page_number": 2, "timestamp": 1735732800000,
+        })
+        return response.json()["uploadId"] if response.status_code == 201 else response
+
+    def put(self, upload_id, offset, data):
+        return self.client.put(f"/api/user/document-upload/{upload_id}", data, content_type="application/octet-stream", HTTP_UPLOAD_OFFSET=str(offset))
+
+    @override_settings(DOCUMENT_UPLOAD_BLOCK_BYTES=1024)
+    def test_upload_in_chunks_and_resume(self):
+        upload_id = self.start()
+        self.assertEqual(self.put(upload_id, 0, self.content[:5000]).json(), {"offset": 5000})
+
+        # A resent or skipped chunk is refused with the offset to resume from
+        self.assertEqual(self.put(upload_id, 4000, self.content[4000:8000]).status_code, 409)
+        self.assertEqual(self.client.get(f"/api/user/document-upload/{upload_id}").json(), {"offset": 5000, "size": len(self.content)})
+        self.assertEqual(self.client.post(f"/api/user/document-upload/{upload_id}/complete").json()["offset"], 5000)
+
+        self.assertEqual(self.put(upload_id, 5000, self.content[5000:]).json(), {"offset": len(self.content)})
+        self.assertEqual(self.client.post(f"/api/user/document-upload/{upload_id}/complete").status_code, 201)
+
+        document = DocumentData.objects.get(user=self.user, file_name="book.pdf")
+        self.assertEqual(document.content_hash, hashlib.sha256(self.content).hexdigest())
+        self.assertEqual((document.line_number, document.page_number), (3, 2))
+        with open(document.file_object.path, "rb") as stored:
+            self.assertEqual(stored.read(), self.content)
+        self.assertEqual(DocumentJob.objects.get().document, document)
+        self.assertFalse(os.path.exists(os.path.join(self.media_root, "uploads", f"{upload_id}.part")))
+
+    def test_hash_without_running_digest(self):
+        upload_id = self.start()
+        self.put(upload_id, 0, self.content)
+        with mock.patch.dict("user_management.uploads._digests", clear=True):  # Chunks received by another process
+            self.client.post(f"/api/user/document-upload/{upload_id}/complete")
+        self.assertEqual(DocumentData.objects.get(file_name="book.pdf").content_hash, hashlib.sha256(self.content).hexdigest())
+
+    def test_content_checked_on_first_chunk(self):
+        upload_id = self.start()
+        response = self.put(upload_id, 0, b"PK\x03\x04 not a pdf")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.client.get(f"/api/user/document-upload/{upload_id}").status_code, 404)
+
+    def test_invalid_uploads(self):
+        self.assertEqual(self.start(file_name="movie.mp4").status_code, 400)
+        self.assertEqual(self.start(size=0).status_code, 400)
+
+        upload_id = self.start()
+        self.assertEqual(self.put(upload_id, 0, self.content + b"more").status_code, 400)
+
+        other = APIClient()
+        other.force_authenticate(User.objects.create_user(username="other", password="password"))
+        self.assertEqual(other.get(f"/api/user/document-upload/{upload_id}").status_code, 404)
+
+
+class UploadExpiryTests(DocumentTestCase):
+
+    def start(self):
+        upload = uploads.start_upload(self.user, "book.pdf", 100, line_number=0, page_number=1, saved_at=timezone.now())
+        uploads.append_chunk(upload, 0, io.BytesIO(b"%PDF-1.4\n" + b"x" * 40))
+        return upload
+
+    def test_idle_uploads_expire(self):
+        idle, active = self.start(), self.start()
+        DocumentUpload.objects.filter(id=idle.id).update(updated_at=timezone.now() - timedelta(hours=25))
+        orphan = os.path.join(self.media_root, "uploads", "orphan.part")
+        open(orphan, "wb").close()
+        os.utime(orphan, (0, 0))
+
+        out = StringIO()
+        call_command("expire_document_uploads", stdout=out)
+        self.assertIn("Removed 1 expired upload(s)", out.getvalue())
+        self.assertEqual(list(DocumentUpload.objects.values_list("id", flat=True)), [active.id])
+        self.assertFalse(os.path.exists(idle.part_path()))
+        self.assertFalse(os.path.exists(orphan))
+        self.assertTrue(os.path.exists(active.part_path()))
+        self.assertNotIn(idle.id, uploads._digests)
+        self.assertIn(active.id, uploads._digests)
+
+    def test_digests_evicted(self):
+        completed, aborted, abandoned = self.start(), self.start(), self.start()
+        uploads.append_chunk(completed, 49, io.BytesIO(b"y" * 51))
+        uploads.complete_upload(completed)
+        self.client.delete(f"/api/user/document-upload/{aborted.id}")
+        self.assertEqual(set(uploads._digests) & {completed.id, aborted.id}, set())
+
+        with mock.patch("user_management.uploads.time.monotonic", return_value=uploads._digests[abandoned.id][2] + 25 * 3600):
+            uploads.evict_digests(24 * 3600)
+        self.assertNotIn(abandoned.id, uploads._digests)
+
+
+@skipUnless(connection.vendor == "postgresql", "Needs row locks (SELECT ... FOR UPDATE NOWAIT)")
+class ChunkedUploadLockTests(TransactionTestCase):
+
+    def test_concurrent_chunk_is_refused(self):
+        user = User.objects.create_user(username="reader", password="password")
+        upload = uploads.start_upload(user, "notes.txt", 10, line_number=0, page_number=1, saved_at=timezone.now())
+        locked, release = threading.Event(), threading.Event()
+
+        def hold_lock():
+            # Another request writing a chunk of the same upload
+            try:
+                with uploads.locked_upload(upload):
+                    locked.set()
+                    release.wait(5)
+            finally:
+                connection.close()
+
+        holder = threading.Thread(target=hold_lock)
+        with tempfile.TemporaryDirectory() as media_root, override_settings(MEDIA_ROOT=media_root):
+            holder.start()
+            locked.wait(5)
+            with self.assertRaises(uploads.UploadOffsetError):
+                uploads.append_chunk(upload, 0, io.BytesIO(b"first line"))
+            release.set()
+            holder.join()
+            self.assertFalse(os.path.exists(upload.part_path()))
+
+            self.assertEqual(uploads.append_chunk(upload, 0, io.BytesIO(b"first line")), 10)
+
+
+@skipUnless(connection.vendor == "postgresql", "Needs row locks (SELECT ... FOR UPDATE)")
+class SharedFileReleaseTests(TransactionTestCase):
+
+    def test_upload_during_release_keeps_file(self):
+        content = b"Reading assignment for the whole class"
+        content_hash = hashlib.sha256(content).hexdigest()
+        owner = User.objects.create_user(username="owner", password="password")
+        classmate = User.objects.create_user(username="classmate", password="password")
+        releasing, locked = threading.Event(), threading.Event()
+        delete_file = storage.default_storage.delete
+
+        def slow_delete(name):
+            # Between the reference check and the file delete
+            locked.set()
+            releasing.wait(0.5)
+            delete_file(name)
+
+        def delete_last_reference(document):
+            try:
+                storage.delete_document(document)  # FileDeleteView of the last owner
+            finally:
+                connection.close()
+
+        with tempfile.TemporaryDirectory() as media_root, override_settings(MEDIA_ROOT=media_root):
+            document = storage.save_document(owner, "notes.txt", SimpleUploadedFile("notes.txt", content), content_hash, saved_at=timezone.now())
+            deleter = threading.Thread(target=delete_last_reference, args=(document,))
+            with mock.patch.object(storage.default_storage, "delete", side_effect=slow_delete):
+                deleter.start()
+                locked.wait(5)
+
+                # Waits for the release, then writes the file again
+                shared = storage.save_document(classmate, "assignment.txt", SimpleUploadedFile("assignment.txt", content), content_hash, saved_at=timezone.now())
+                releasing.set()
+                deleter.join()
+
+            self.assertEqual(shared.file_object.name, document.file_object.name)
+            with open(shared.file_object.path, "rb") as stored:
+                self.assertEqual(stored.read(), content)
+
+
+    def test_simultaneous_first_uploads_share_file(self):
+        content = b"Reading assignment for the whole class"
+        content_hash = hashlib.sha256(content).hexdigest()
+        owner = User.objects.create_user(username="owner", password="password")
+        classmate = User.objects.create_user(username="classmate", password="password")
+        checked, stored = threading.Event(), threading.Event()
+        file_exists = storage.default_storage.exists
+        documents = []
+
+        def slow_exists(name):
+            # The first upload checks for the file, then the second one stores it
+            found = file_exists(name)
+            if threading.current_thread() is not threading.main_thread() and not checked.is_set():
+                checked.set()
+                stored.wait(5)
+            return found
+
+        def first_upload():
+            try:
+                documents.append(storage.save_document(owner, "notes.txt", SimpleUploadedFile("notes.txt", content), content_hash, saved_at=timezone.now()))
+            finally:
+                connection.close()
+
+        with tempfile.TemporaryDirectory() as media_root, override_settings(MEDIA_ROOT=media_root):
+            uploader = threading.Thread(target=first_upload)
+            with mock.patch.object(storage.default_storage, "exists", side_effect=slow_exists):
+                uploader.start()
+                checked.wait(5)
+                documents.append(storage.save_document(classmate, "assignment.txt", SimpleUploadedFile("assignment.txt", content), content_hash, saved_at=timezone.now()))
+                stored.set()
+                uploader.join()
+
+            self.assertEqual({document.file_object.name for document in documents}, {f"documents/{content_hash}.txt"})
+            self.assertEqual(os.listdir(os.path.join(media_root, "documents")), [f"{content_hash}.txt"])
+            with open(documents[0].file_object.path, "rb") as stored_file:
+                self.assertEqual(stored_file.read(), content)
+
+
+class ThumbnailTests(DocumentTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.upload()
+        self.run_jobs()
+        self.document = DocumentData.objects.get(user=self.user)
+
+    def thumbnail_url(self, preview_hash=None):
+        preview_hash = preview_hash or self.document.preview_hash
+        return f"/api/user/thumbnail/{self.document.id}/{preview_hash}/{thumbnail_signature(self.document.id, preview_hash)}"
+
+    def test_file_list_links_thumbnails(self):
+        files = self.client.get("/api/user/file-list/").json()
+        self.assertEqual(files[0]["thumbnailHash"], self.document.preview_hash)
+        self.assertEqual(files[0]["thumbnailUrl"], self.thumbnail_url())
+        self.assertNotIn("thumbnail", files[0])
+
+    def test_thumbnail_is_cached_by_hash(self):
+        url = self.thumbnail_url()
+        response = self.client.get(url, HTTP_ACCEPT_ENCODING="gzip")
+        self.assertEqual(response["Content-Type"], "image/jpeg")
+        self.assertEqual(response["ETag"], f'"{self.document.preview_hash}"')
+        self.assertEqual(response["Cache-Control"], "private, max-age=31536000, immutable")
+        self.assertFalse(response.has_header("Content-Encoding"))
+        with open(self.document.preview_file_path(), "rb") as preview_file:
+            self.assertEqual(b"".join(response.streaming_content), preview_file.read())
+
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response["ETag"]).status_code, 304)
+
+    def test_listed_url_loads_without_authorization_header(self):
+        # What an <img src> request sends: no Authorization header, or a stale one
+        url = self.client.get("/api/user/file-list/").json()[0]["thumbnailUrl"]
+        self.assertEqual(APIClient().get(url).status_code, 200)
+        self.assertEqual(APIClient().get(url, HTTP_AUTHORIZATION="Bearer expired").status_code, 200)
+
+    def test_only_signed_current_previews(self):
+        self.assertEqual(APIClient().get(self.thumbnail_url("0" * 64)).status_code, 404)
+
+        url = self.thumbnail_url()
+        self.assertEqual(APIClient().get(url[:-1] + ("0" if url[-1] != "0" else "1")).status_code, 404)
+        other_document = f"/api/user/thumbnail/{self.document.id + 1}/{self.document.preview_hash}/{thumbnail_signature(self.document.id, self.document.preview_hash)}"
+        self.assertEqual(APIClient().get(other_document).status_code, 404)
+
+
+class DocumentLoadTests(DocumentTestCase):
+    content = b"0123456789" * 100
+
+    def setUp(self):
+        super().setUp()
+        self.upload(content=self.content)
+        self.document = DocumentData.objects.get(user=self.user)
+        self.url = "/api/user/document-load?file_name=notes.txt"
+
+    def test_whole_file_with_validators(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b"".join(response.streaming_content), self.content)
+        self.assertEqual(response["ETag"], f'"{self.document.content_hash}"')
+        self.assertEqual(response["Accept-Ranges"], "bytes")
+        self.assertEqual((response["line-number"], response["page-number"]), ("0", "1"))
+
+        not_modified = self.client.get(self.url, HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(not_modified["page-number"], "1")
+        self.assertEqual(self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=response["Last-Modified"]).status_code, 304)
+
+    def test_byte_ranges(self):
+        response = self.client.get(self.url, HTTP_RANGE="bytes=10-24")
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response["Content-Range"], "bytes 10-24/1000")
+        self.assertEqual(response["Content-Length"], "15")
+        self.assertEqual(b"".join(response.streaming_content), self.content[10:25])
+        self.assertEqual(response["line-number"], "0")
+
+        suffix = self.client.get(self.url, HTTP_RANGE="bytes=-5", HTTP_ACCEPT_ENCODING="gzip")
+        self.assertFalse(suffix.has_header("Content-Encoding"))
+        self.assertEqual(b"".join(suffix.streaming_content), self.content[-5:])
+
+        unsatisfiable = self.client.get(self.url, HTTP_RANGE="bytes=1000-")
+        self.assertEqual((unsatisfiable.status_code, unsatisfiable["Content-Range"]), (416, "bytes */1000"))
+
+    def test_stale_if_range_sends_whole_file(self):
+        response = self.client.get(self.url, HTTP_RANGE="bytes=0-9", HTTP_IF_RANGE='"outdated"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b"".join(response.streaming_content), self.content)
+
+    def test_hash_of_documents_saved_before_hashes(self):
+        DocumentData.objects.update(content_hash=None)
+        response = self.client.get(self.url)
+        self.assertEqual(response["ETag"], f'"{self.document.content_hash}"')
+        self.assertEqual(DocumentData.objects.get().content_hash, self.document.content_hash)
@@ -0,0 +1,202 @@
+"""
+Resumable chunked document uploads.
+
+init creates a DocumentUpload. Each PUT appends its body, sent from the upload's
+current offset, to a part file, reading it in DOCUMENT_UPLOAD_BLOCK_BYTES blocks so
+memory stays constant whatever the document size. complete stores the file by content
+hash and saves the DocumentData row. After a dropped connection the client asks for the
+offset and sends the rest, instead of starting the whole upload again.
+
+Writing a chunk and completing hold a row lock on the DocumentUpload, so concurrent
+requests for the same upload cannot interleave their writes to the part file. Uploads
+not touched for DOCUMENT_UPLOAD_EXPIRY_HOURS are removed by expire_uploads (run by
+run_document_jobs, or `manage.py expire_document_uploads`).
+"""
+import hashlib
+import itertools
+import mimetypes
+import os
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.files import File
+from django.db import DatabaseError, connection, transaction
+from django.utils import timezone
+
+from .models import DocumentUpload, hash_chunks
+from .storage import save_document
+
+# The first bytes of each accepted document type
+MAGIC_BYTES = 8
+MAGIC = {
+    'application/pdf': lambda head: head.startswith(b'%PDF-'),
+    'application/vnd.openxmlformats-officedocument.wordprocessingml.document': lambda head: head.startswith(b'PK\x03\x04'),  # A zip
+    'text/plain': lambda head: b'\x00' not in head,
+}
+
+# Running SHA-256 of the uploads this process received from offset 0: upload id -> (offset, digest, last use).
+# hashlib state cannot be stored, chunks handled by another process or before a restart fall back to
+# hashing the part file on complete. Entries go on complete, abort and after the upload expiry
+_digests = {}
+
+class UploadOffsetError(Exception):
+    # The chunk does not start where the upload is, the client should resume from `offset`
+    def __init__(self, offset):
+        super().__init__(f"Upload is at offset {offset}.")
+        self.offset = offset
+
+class UploadContentError(ValueError):
+    # The first bytes do not match the document type, the upload is aborted
+    pass
+
+class PartFile(File):
+    # Completed part file, moved into the document storage instead of copied
+    def __init__(self, path, name):
+        super().__init__(None, name)
+        self.path = path
+
+    def temporary_file_path(self):
+        return self.path
+
+def document_mime_type(file_name):
+    mime_type, _ = mimetypes.guess_type(file_name)
+    if mime_type not in MAGIC:
+        raise ValueError("Invalid file type. Only .pdf, .docx and .txt are allowed.")
+    return mime_type
+
+def start_upload(user, file_name, size, **fields):
+    document_mime_type(file_name)
+    if not 0 < size <= settings.DOCUMENT_UPLOAD_MAX_BYTES:
+        raise ValueError(f"Invalid size: must be between 1 and {settings.DOCUMENT_UPLOAD_MAX_BYTES} bytes.")
+    return DocumentUpload.objects.create(user=user, file_name=file_name, size=size, **fields)
+
+def read_blocks(stream, first_size=0):
+    # Blocks of the request body, the first one at least `first_size` bytes unless the body is shorter
+    if stream is None:  # Empty body
+        return
+    block_size = settings.DOCUMENT_UPLOAD_BLOCK_BYTES
+    first = b''
+    while len(first) < max(first_size, 1):
+        block = stream.read(block_size)
+        if not block:
+            break
+        first += block
+    if first:
+        yield first
+    yield from iter(lambda: stream.read(block_size), b'')
+
+@contextmanager
+def locked_upload(upload):
+    """
+    The upload's row, locked until the block ends. A request finding it locked by
+    another one gets UploadOffsetError instead of waiting for the other chunk.
+    """
+    with transaction.atomic():
+        uploads = DocumentUpload.objects.filter(id=upload.id)
+        if connection.features.has_select_for_update_nowait:
+            uploads = uploads.select_for_update(nowait=True)
+        try:
+            locked = uploads.get()
+        except DatabaseError:
+            raise UploadOffsetError(upload.received)
+        yield locked
+
+def evict_digests(max_age_seconds):
+    # Running digests of uploads that stopped without being completed or aborted
+    used_before = time.monotonic() - max_age_seconds
+    for upload_id in [upload_id for upload_id, (_, _, used) in _digests.items() if used < used_before]:
+        _digests.pop(upload_id, None)
+
+def append_chunk(upload, offset, stream):
+    """
+    Write the request body `stream` at `offset` of the upload's part file and return
+    the new offset. The type of the document is checked against its first bytes.
+    """
+    evict_digests(settings.DOCUMENT_UPLOAD_EXPIRY_HOURS * 3600)
+    try:
+        with locked_upload(upload) as locked:
+            end = write_chunk(locked, offset, stream)
+    except UploadContentError:
+        abort_upload(upload)
+        raise
+    upload.received = end
+    return end
+
+def write_chunk(upload, offset, stream):
+    if offset != upload.received:
+        raise UploadOffsetError(upload.received)
+
+    if offset == 0:
+        digest = hashlib.sha256()
+    else:
+        running_offset, digest, _ = _digests.pop(upload.id, (None, None, None))
+        digest = digest if running_offset == offset else None
+
+    blocks = read_blocks(stream, MAGIC_BYTES if offset == 0 else 0)
+    if offset == 0:
+        first = next(blocks, b'')
+        if not MAGIC[document_mime_type(upload.file_name)](first[:MAGIC_BYTES]):
+            raise UploadContentError("File content does not match its type.")
+        blocks = itertools.chain([first], blocks)
+
+    path = upload.part_path()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    end = offset
+    with open(path, 'r+b' if offset else 'wb') as part:
+        part.seek(offset)
+        for block in blocks:
+            end += len(block)
+            if end > upload.size:
+                raise ValueError(f"Chunk goes past the announced size of {upload.size} bytes.")
+            part.write(block)
+            if digest is not None:
+                digest.update(block)
+        part.truncate()  # Drop what a failed earlier attempt wrote past this chunk
+
+    DocumentUpload.objects.filter(id=upload.id).update(received=end, updated_at=timezone.now())
+    if digest is not None:
+        _digests[upload.id] = (end, digest, time.monotonic())
+    return end
+
+def complete_upload(upload):
+    # Store the uploaded file by content hash and create or update its DocumentData
+    with locked_upload(upload) as upload:
+        if upload.received != upload.size:
+            raise UploadOffsetError(upload.received)
+
+        running_offset, digest, _ = _digests.pop(upload.id, (None, None, None))
+        path = upload.part_path()
+        if digest is not None and running_offset == upload.size:
+            content_hash = digest.hexdigest()
+        else:
+            with open(path, 'rb') as part:
+                content_hash = hash_chunks(iter(lambda: part.read(settings.DOCUMENT_UPLOAD_BLOCK_BYTES), b''))
+
+        document = save_document(upload.user, upload.file_name, PartFile(path, upload.file_name), content_hash, line_number=upload.line_number, page_number=upload.page_number, saved_at=upload.saved_at)
+        abort_upload(upload)  # The part file is gone unless the content was already stored
+    return document
+
+def abort_upload(upload):
+    _digests.pop(upload.id, None)
+    if os.path.exists(upload.part_path()):
+        os.remove(upload.part_path())
+    upload.delete()
+
+def expire_uploads(updated_before):
+    # Remove uploads not written to since `updated_before` and part files left without an upload
+    expired = 0
+    for upload in DocumentUpload.objects.filter(updated_at__lt=updated_before):
+        abort_upload(upload)
+        expired += 1
+
+    folder = os.path.join(settings.MEDIA_ROOT, 'uploads')
+    if os.path.isdir(folder):
+        active = {f"{upload_id}.part" for upload_id in DocumentUpload.objects.values_list('id', flat=True)}
+        for name in os.listdir(folder):
+            path = os.path.join(folder, name)
+            if name not in active and os.path.getmtime(path) < updated_before.timestamp():
+                os.remove(path)
+
+    evict_digests((timezone.now() - updated_before).total_seconds())
+    return expired
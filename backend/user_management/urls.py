@@ -1,5 +1,5 @@
 from django.urls import path
-from .views import RegisterUserView, ProfileView, CalibrationView, CalibrationRetrievalView, DocumentFirstSaveView, DocumentLoadView, DocumentUpdateView, FileListView, FileDeleteView, OnboardingView, OnboardingRetrievalView
+from .views import RegisterUserView, ProfileView, CalibrationView, CalibrationRetrievalView, DocumentFirstSaveView, DocumentUploadView, DocumentUploadChunkView, DocumentUploadCompleteView, DocumentLoadView, DocumentUpdateView, FileListView, ThumbnailView, FileDeleteView, OnboardingView, OnboardingRetrievalView
 
 # User-specific api end-points, so django routes request to appropriate user management views
 urlpatterns = [
@@ -10,8 +10,12 @@ urlpatterns = [
     path('onboarding/', OnboardingView.as_view(), name='onboarding'),
     path('onboarding-retrieval/', OnboardingRetrievalView.as_view(), name='onboarding-retrieval'),
     path('document-save', DocumentFirstSaveView.as_view(), name='document-save'),
+    path('document-upload', DocumentUploadView.as_view(), name='document-upload'),
+    path('document-upload/<uuid:upload_id>', DocumentUploadChunkView.as_view(), name='document-upload-chunk'),
+    path('document-upload/<uuid:upload_id>/complete', DocumentUploadCompleteView.as_view(), name='document-upload-complete'),
     path('document-load', DocumentLoadView.as_view(), name='document-load'),
     path('document-update', DocumentUpdateView.as_view(), name='document-update'), 
     path('file-list/', FileListView.as_view(), name='file-list'),
+    path('thumbnail/<int:document_id>/<str:preview_hash>/<str:signature>', ThumbnailView.as_view(), name='thumbnail'),
     path('file-delete', FileDeleteView.as_view(), name='file-delete')
 ]
@@ -1,20 +1,27 @@
 from datetime import datetime
 import mimetypes
 import os
-import base64
 
 from rest_framework import generics, status
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from django.contrib.auth.models import User
-from django.http import FileResponse
+from django.db.models import Exists, OuterRef
+from django.http import FileResponse, Http404
 from django.conf import settings
 from django.shortcuts import get_object_or_404
+from django.urls import reverse
+from django.utils.cache import get_conditional_response
+from django.utils.crypto import constant_time_compare, salted_hmac
 import os
 
 from .serializers import RegisterUserSerializer
-from .models import CalibrationData, DocumentData, OnboardingData
+from .models import CalibrationData, DocumentData, DocumentJob, DocumentUpload, OnboardingData, hash_chunks
+from .file_responses import document_response
+from .storage import delete_document, save_document
+from .jobs import ACTIVE, enqueue
+from .uploads import UploadOffsetError, abort_upload, append_chunk, complete_upload, start_upload
 
 class RegisterUserView(generics.CreateAPIView):
     queryset = User.objects.all() # Ensure user does not already exist
@@ -184,18 +191,70 @@ class DocumentFirstSaveView(APIView):
         return file_name, file_object, line_number, page_number, timestamp_dt
     
     def save_or_update_document_drive(self):
+        # Hashed by HashingUploadHandler while the upload arrived
+        content_hash = getattr(self.request, 'upload_hashes', {}).get('file_object') or hash_chunks(self.file_object.chunks())
+        return save_document(self.user, self.file_name, self.file_object, content_hash, line_number=self.line_number, page_number=self.page_number, saved_at=self.timestamp)
 
-        document_entry, _ = DocumentData.objects.update_or_create(
-        user=self.user,
-        file_name=self.file_name,
-        defaults={
-            'file_object': self.file_object,
-            'line_number': self.line_number,
-            'page_number': self.page_number,
-            'saved_at': self.timestamp
-            }
-        )
-        return document_entry
+class DocumentUploadView(APIView):
+    # Start a chunked upload, for documents too large to send in one document-save request
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, *args, **kwargs):
+        try:
+            upload = start_upload(
+                request.user,
+                request.data.get('file_name'),
+                int(request.data.get('size')),
+                line_number=int(request.data.get('line_number')),
+                page_number=int(request.data.get('page_number')),
+                saved_at=datetime.fromtimestamp(int(request.data.get('timestamp')) / 1000),
+            )
+        except (TypeError, ValueError) as e:
+            return Response({"error": f"Invalid upload: {e}"}, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response({"uploadId": upload.id, "offset": 0}, status=status.HTTP_201_CREATED)
+
+class DocumentUploadChunkView(APIView):
+    # GET: where to resume, PUT: append the body at the Upload-Offset header, DELETE: abort the upload
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, upload_id, *args, **kwargs):
+        upload = get_object_or_404(DocumentUpload, id=upload_id, user=request.user)
+        return Response({"offset": upload.received, "size": upload.size}, status=200)
+
+    def put(self, request, upload_id, *args, **kwargs):
+        upload = get_object_or_404(DocumentUpload, id=upload_id, user=request.user)
+        try:
+            offset = int(request.headers.get('Upload-Offset'))
+            # Read from the request stream, the body is never parsed or held in memory
+            return Response({"offset": append_chunk(upload, offset, request.stream)}, status=200)
+        except UploadOffsetError as e:
+            return Response({"error": str(e), "offset": e.offset}, status=status.HTTP_409_CONFLICT)
+        except (TypeError, ValueError) as e:
+            return Response({"error": f"Invalid chunk: {e}"}, status=status.HTTP_400_BAD_REQUEST)
+
+    def delete(self, request, upload_id, *args, **kwargs):
+        abort_upload(get_object_or_404(DocumentUpload, id=upload_id, user=request.user))
+        return Response({"message": "Upload cancelled."}, status=200)
+
+class DocumentUploadCompleteView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, upload_id, *args, **kwargs):
+        upload = get_object_or_404(DocumentUpload, id=upload_id, user=request.user)
+        try:
+            complete_upload(upload)
+            return Response(
+                {"message": "File progress data saved successfully."},
+                status=status.HTTP_201_CREATED,
+            )
+        except UploadOffsetError as e:
+            return Response({"error": f"Upload incomplete: {e}", "offset": e.offset}, status=status.HTTP_409_CONFLICT)
+        except Exception as e:
+            return Response(
+                {"error": f"Failed to save file progress data: {e}"},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            )
 
 class DocumentUpdateView(APIView):
     permission_classes = [IsAuthenticated]
@@ -318,14 +377,13 @@ class DocumentLoadView(APIView):
             if not os.path.exists(file_path):
                 return Response({"error": "File not found on the server."}, status=404)
 
-            # Create the file response
-            response = FileResponse(open(file_path, 'rb'), as_attachment=True, filename=document_data.file_name)
+            content_hash = document_data.content_hash or document_data.update_content_hash()
 
-            # Add metadata to headers
-            response["line-number"] = document_data.line_number
-            response["page-number"] = document_data.page_number
-
-            return response
+            # Whole file, a byte range or 304 Not Modified, always with the reading position headers
+            return document_response(request, file_path, document_data.file_name, etag=f'"{content_hash}"', headers={
+                "line-number": document_data.line_number,
+                "page-number": document_data.page_number,
+            })
 
         except DocumentData.DoesNotExist:
             return Response({"error": "No document data found for this user."}, status=404)
@@ -337,23 +395,31 @@ class FileListView(APIView):
 
     def get(self, request, *args, **kwargs):
         try:
-            documents = DocumentData.objects.filter(user=request.user)
+            documents = DocumentData.objects.filter(user=request.user).annotate(
+                # Jobs of any document sharing the file, they render its preview for all of them
+                has_jobs=Exists(DocumentJob.objects.filter(document__file_object=OuterRef('file_object'))),
+                preview_pending=Exists(DocumentJob.objects.filter(document__file_object=OuterRef('file_object'), kind=DocumentJob.Kind.PREVIEW, status__in=ACTIVE)),
+            )
 
             files = []
             for document in documents:
-                # Generate preview if needed
-                preview_path = document.generate_preview()
-                # Read the preview file as Base64 (if it exists)
-                preview_base64 = None
-                if preview_path and os.path.exists(preview_path):
-                    with open(preview_path, "rb") as preview_file:
-                        preview_base64 = base64.b64encode(preview_file.read()).decode('utf-8')
-                else:
-                    print("Preview file not found:", preview_path)
+                # Previews are rendered in the background when the document is saved, older documents are queued once here
+                has_preview = bool(document.preview_path and document.preview_hash)
+                if not has_preview and not document.has_jobs:
+                    enqueue(document, DocumentJob.Kind.PREVIEW)
+                    document.preview_pending = True
+
+                # The thumbnail is fetched separately, its URL changes with its content so browsers can keep it.
+                # The URL is signed, so it can be loaded directly (<img src>) without the Authorization header
+                thumbnail_url = None
+                if has_preview:
+                    thumbnail_url = reverse('thumbnail', args=[document.id, document.preview_hash, thumbnail_signature(document.id, document.preview_hash)])
 
                 files.append({
                     'name': document.file_name,
-                    'thumbnail': preview_base64,  # Base64 encoded image content
+                    'thumbnailUrl': thumbnail_url,
+                    'thumbnailHash': document.preview_hash if has_preview else None,
+                    'thumbnailPending': not has_preview and document.preview_pending,  # Show a placeholder meanwhile
                     'isStarred': document.favourite,
                     'lastOpened': document.saved_at.timestamp() * 1000,
                 })
@@ -363,6 +429,32 @@ class FileListView(APIView):
         except Exception as e:
             return Response({"error": str(e)}, status=500)
         
+def thumbnail_signature(document_id, preview_hash):
+    return salted_hmac('user_management.thumbnail', f'{document_id}:{preview_hash}').hexdigest()
+
+class ThumbnailView(APIView):
+    # Authorised by the signature in the URL handed out by the file list, not by the JWT header
+    authentication_classes = []
+    permission_classes = [AllowAny]
+
+    def get(self, request, document_id, preview_hash, signature, *args, **kwargs):
+        if not constant_time_compare(signature, thumbnail_signature(document_id, preview_hash)):
+            raise Http404("Preview not found.")
+
+        # Only the current preview of the document, older URLs are gone
+        document = get_object_or_404(DocumentData, id=document_id, preview_hash=preview_hash)
+        preview_path = document.preview_file_path()
+        if not os.path.exists(preview_path):
+            raise Http404("Preview file not found.")
+
+        etag = f'"{preview_hash}"'
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = FileResponse(open(preview_path, 'rb'), content_type='image/jpeg')
+        response['ETag'] = etag
+        response['Cache-Control'] = 'private, max-age=31536000, immutable'
+        return response
+
 class FileDeleteView(APIView):
     permission_classes = [IsAuthenticated]
 
@@ -371,18 +463,7 @@ class FileDeleteView(APIView):
             file_name = request.query_params.get('file_name')
             document = DocumentData.objects.get(user=request.user, file_name=file_name)
 
-            preview_filename = f"{os.path.basename(os.path.splitext(document.file_object.name)[0])}_preview.jpg"
-            preview_path = os.path.join(settings.MEDIA_ROOT, "documents", preview_filename)
-
-            # print("Preview path:", preview_path)
-            if os.path.exists(preview_path):
-                os.remove(preview_path)
-
-            # Delete the actual file
-            document.file_object.delete()
-
-            # Delete the database entry
-            document.delete()
+            delete_document(document)
             return Response({"message": "File deleted successfully."}, status=200)
 
         except DocumentData.DoesNotExist:
@@ -0,0 +1,110 @@
+import csv
+import json
+import os
+import sys
+import time
+from datetime import datetime
+
+import cv2
+import numpy as np
+
+CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.join(CURRENT_DIR, '..', '..', '..', 'backend')
+TEST_FILES_DIR = os.path.join(CURRENT_DIR, '..', '..', 'blink_detection', 'blink_test_files')
+sys.path.insert(0, BACKEND_DIR)
+
+from eye_processing.eye_metrics.process_eye_metrics import EyeMetricsPipeline
+
+'''
+Replays recorded reading sessions through the eye pipeline with the face mesh on every
+frame (baseline) and with keyframe scheduling, then reports the CPU time saved and how far
+yaw/pitch and the focus labels drift from the baseline.
+
+Usage: python benchmark_keyframes.py [interval ...]
+'''
+
+VIDEOS = ["mahie_test_1", "mahie_test_2", "mahie_test_3", "mahie_test_4_low_fps", "soniya_test_3"]
+INTERVALS = [2, 3, 5, 10]
+
+
+def load_session(name):
+    with open(os.path.join(TEST_FILES_DIR, f"{name}_timestamps.txt")) as file:
+        timestamps = [datetime.fromisoformat(t) for t in json.load(file)]
+
+    def read_column(filename):
+        path = os.path.join(TEST_FILES_DIR, filename)
+        if not os.path.exists(path):
+            return []
+        with open(path, encoding="utf-8-sig") as file:
+            return [float(row[0]) for row in csv.reader(file) if row]
+
+    ears = read_column(f"{name}_ears.csv")
+    blinks = read_column(f"{name}_ideal.csv")
+
+    frames = []
+    video = cv2.VideoCapture(os.path.join(TEST_FILES_DIR, f"{name}.avi"))
+    while True:
+        ok, frame = video.read()
+        if not ok or len(frames) >= len(timestamps):
+            break
+        frames.append(frame)
+    video.release()
+
+    return frames, timestamps, ears, blinks
+
+
+def run_pipeline(pipeline, frames, timestamps, ears, blinks):
+    results = []
+    start = time.process_time()
+    for i, frame in enumerate(frames):
+        ear = ears[i] if i < len(ears) else None
+        blink_detected = bool(blinks[i]) if i < len(blinks) else False
+        results.append(pipeline.process_eye(frame, timestamps[i], blink_detected, ear=ear)[:-1])
+    return results, time.process_time() - start
+
+
+def compare(baseline, scheduled):
+    yaw_drift, pitch_drift, focus_agree = [], [], []
+    for base, other in zip(baseline, scheduled):
+        focus_agree.append(base[7] == other[7])
+        if base[2] is not None and other[2] is not None:
+            yaw_drift.append(abs(base[2] - other[2]))
+            pitch_drift.append(abs(base[3] - other[3]))
+    return np.array(yaw_drift), np.array(pitch_drift), np.mean(focus_agree)
+
+
+def benchmark(intervals):
+    totals = {interval: [0.0, 0.0] for interval in intervals}
+    for name in VIDEOS:
+        frames, timestamps, ears, blinks = load_session(name)
+        baseline, baseline_cpu = run_pipeline(EyeMetricsPipeline(), frames, timestamps, ears, blinks)
+        print(f"\n{name}: {len(frames)} frames, face mesh on every frame {baseline_cpu:.2f}s CPU")
+
+        for interval in intervals:
+            pipeline = EyeMetricsPipeline(keyframe_interval=interval)
+            keyframes = [0]
+            record_keyframe = pipeline.keyframe_scheduler.record_keyframe
+
+            def counting_record_keyframe(*args):
+                keyframes[0] += 1
+                record_keyframe(*args)
+
+            pipeline.keyframe_scheduler.record_keyframe = counting_record_keyframe
+            scheduled, cpu = run_pipeline(pipeline, frames, timestamps, ears, blinks)
+            yaw_drift, pitch_drift, focus_agree = compare(baseline, scheduled)
+            totals[interval][0] += baseline_cpu
+            totals[interval][1] += cpu
+
+            print(f"  interval {interval:>2}: {cpu:.2f}s CPU ({100 * (1 - cpu / baseline_cpu):.0f}% saved), "
+                  f"face mesh on {100 * keyframes[0] / len(frames):.0f}% of frames, "
+                  f"yaw drift mean {yaw_drift.mean():.2f} max {yaw_drift.max():.2f} deg, "
+                  f"pitch drift mean {pitch_drift.mean():.2f} max {pitch_drift.max():.2f} deg, "
+                  f"focus labels agree {100 * focus_agree:.1f}%")
+
+    print("\nOverall CPU saved:")
+    for interval, (baseline_cpu, cpu) in totals.items():
+        print(f"  interval {interval:>2}: {100 * (1 - cpu / baseline_cpu):.0f}%")
+
+
+if __name__ == '__main__':
+    benchmark([int(arg) for arg in sys.argv[1:]] or INTERVALS)